@@ -57,6 +57,9 @@ SETUP_DIR="${HOME}/calibration-setup/${EXPERIMENT}"
 
 CONTROLLER_HOST_FILE="$PIPELINE_ROOT/controller_ip.txt"
 CONTROLLER_PORT=18001
+CONTROLLER_TRANSPORT="rpyc" # or "framed" for the asyncio server
+QUEUE_WEIGHTS='{}' # share of claims per run name, e.g. '{"calib_run": 3, "proj_run": 1}'
+LJF_TAIL_SIZE=0 # hand out the last N tasks of a run longest first; 0 disables
 FZF_CMD="${HOME}/miniconda3/envs/py_env/bin/fzf"
 
 MULTIPLIER=16
@@ -90,6 +90,9 @@ cmd_run_controller () {
     export CONTROLLER_TASK_TIMEOUT="$TASK_TIMEOUT"
     export CONTROLLER_CONTROLLER_HOST=$(< "$CONTROLLER_HOST_FILE" )
     export CONTROLLER_CONTROLLER_PORT=$CONTROLLER_PORT
+    export CONTROLLER_CONTROLLER_TRANSPORT=${CONTROLLER_TRANSPORT:-rpyc}
+    export CONTROLLER_QUEUE_WEIGHTS=${QUEUE_WEIGHTS:-'{}'}
+    export CONTROLLER_LJF_TAIL_SIZE=${LJF_TAIL_SIZE:-0}
 
     exec "$PY_CONDA_ENV/bin/mackenzie" controller
 }
@@ -134,6 +137,7 @@ cmd_run_agent () {
     export AGENT_MAX_LOAD=$(( MAX_COMPUTE_NODES * CPU_PER_NODE / CPU_PER_TASK - PIPELINE_TASKS ))
     export AGENT_CONTROLLER_HOST=$(< "$CONTROLLER_HOST_FILE" )
     export AGENT_CONTROLLER_PORT=$CONTROLLER_PORT
+    export AGENT_CONTROLLER_TRANSPORT=${CONTROLLER_TRANSPORT:-rpyc}
 
     exec "$PY_CONDA_ENV/bin/epihiper-setup-utils" mackenzie-agent \
         --env-file "../environment.sh" \
@@ -163,10 +167,23 @@ cmd_add_setup () {
     export CMD_CERT_FILE="$PIPELINE_ROOT/common.crt"
     export CMD_CONTROLLER_HOST=$(< "$CONTROLLER_HOST_FILE" )
     export CMD_CONTROLLER_PORT=$CONTROLLER_PORT
+    export CMD_CONTROLLER_TRANSPORT=${CONTROLLER_TRANSPORT:-rpyc}
 
     exec "$PY_CONDA_ENV/bin/mackenzie" add-setup --setup-dir "$SETUP_DIR"
 }
 
+cmd_top () {
+    set -Eeuo pipefail
+
+    export CMD_KEY_FILE="$PIPELINE_ROOT/common.key"
+    export CMD_CERT_FILE="$PIPELINE_ROOT/common.crt"
+    export CMD_CONTROLLER_HOST=$(< "$CONTROLLER_HOST_FILE" )
+    export CMD_CONTROLLER_PORT=$CONTROLLER_PORT
+    export CMD_CONTROLLER_TRANSPORT=${CONTROLLER_TRANSPORT:-rpyc}
+
+    exec "$PY_CONDA_ENV/bin/mackenzie" top "$@"
+}
+
 cmd_run_csm_task_source () {
     set -Eeuo pipefail
     set -x
@@ -175,6 +192,7 @@ cmd_run_csm_task_source () {
     export CSMTS_CERT_FILE="$PIPELINE_ROOT/common.crt"
     export CSMTS_CONTROLLER_HOST=$(< "$CONTROLLER_HOST_FILE" )
     export CSMTS_CONTROLLER_PORT=$CONTROLLER_PORT
+    export CSMTS_CONTROLLER_TRANSPORT=${CONTROLLER_TRANSPORT:-rpyc}
 
     export CSMTS_WORK_DIR="$PIPELINE_ROOT/csmts_work_dir"
 
@@ -215,6 +233,7 @@ cmd_run_bayes_opt_task_source () {
     export BOTS_CERT_FILE="$PIPELINE_ROOT/common.crt"
     export BOTS_CONTROLLER_HOST=$(< "$CONTROLLER_HOST_FILE" )
     export BOTS_CONTROLLER_PORT=$CONTROLLER_PORT
+    export BOTS_CONTROLLER_TRANSPORT=${CONTROLLER_TRANSPORT:-rpyc}
 
     export BOTS_WORK_DIR="$PIPELINE_ROOT/bots_work_dir"
 
@@ -256,6 +275,7 @@ cmd_add_post_opt_tasks () {
     export POTS_CERT_FILE="$PIPELINE_ROOT/common.crt"
     export POTS_CONTROLLER_HOST=$(< "$CONTROLLER_HOST_FILE" )
     export POTS_CONTROLLER_PORT=$CONTROLLER_PORT
+    export POTS_CONTROLLER_TRANSPORT=${CONTROLLER_TRANSPORT:-rpyc}
 
     export POTS_RUN_NAME="test1"
     export POTS_SETUP_DIR="$SETUP_DIR"
@@ -276,6 +296,7 @@ cmd_run_proj_task_source () {
     export PTS_CERT_FILE="$PIPELINE_ROOT/common.crt"
     export PTS_CONTROLLER_HOST=$(< "$CONTROLLER_HOST_FILE" )
     export PTS_CONTROLLER_PORT=$CONTROLLER_PORT
+    export PTS_CONTROLLER_TRANSPORT=${CONTROLLER_TRANSPORT:-rpyc}
 
     export PTS_RUN_NAME="proj1"
     export PTS_SETUP_DIR="$SETUP_DIR"
@@ -297,6 +318,7 @@ submit_controller
 start_aws_controller
 submit_agent
 add_setup
+top
 submit_csm_task_source
 submit_bots_task_source
 add_post_opt_tasks
@@ -7,7 +7,7 @@ import click
 import pandas as pd
 from pydantic import BaseModel
 
-from mackenzie.controller.main import ControllerProxy
+from mackenzie.controller.main import ControllerProxy, CompletedTaskFeed
 
 from ..calibration_setup import CalibTask, CalibTaskData
 from ..calibration_handler import CalibTaskResult
@@ -23,11 +23,15 @@ from ..minimizer.bayes_opt_minimizer import (
     MinimizationComplete,
 )
 from ..minimizer import minimizer_db as mdb
+from ..env_file import make_task_locality
+from ..max_runtime import get_runtime_estimates, suggest_max_runtime
 
 from .config import get_bots_config
 
 logger = logging.getLogger(__name__)
 
+COMPLETED_WAIT_TIME = 60
+
 
 class BayesOptMinimizerContext(BaseModel):
     run: str
@@ -131,13 +135,13 @@ def create_minimizers(
 
 
 def do_create_next_task(
-    controller: ControllerProxy,
     min_id: str,
     task_group: str,
     round: int,
     context: BayesOptMinimizerContext,
     raw_params: list[float],
-) -> None:
+    max_runtime: str,
+) -> tuple[str, str, str, int, str, str, str]:
     task_id = task_group
     output_dir = (
         f"{context.run}/{context.setup}/{context.cell}/{context.place}/round_{round}"
@@ -152,7 +156,8 @@ def do_create_next_task(
             place=context.place,
             raw_params=raw_params,
             multiplier=context.multiplier,
-            max_runtime=context.max_runtime,
+            max_runtime=max_runtime,
+            max_runtime_limit=context.max_runtime,
         ),
         output_dir=output_dir,
         minimizer_id=min_id,
@@ -161,32 +166,63 @@ def do_create_next_task(
     )
     task_type = "calibration"
     task_priority = context.task_priority
+    task_locality = make_task_locality(context.place, context.multiplier)
+    task_queue = context.run
 
-    controller.add_new_task(
-        task_id=task_id,
-        task_type=task_type,
-        task_data_json=task_data.json(),
-        task_priority=task_priority,
+    # Stragglers are judged against the other evaluations of the minimizer
+    speculation_group = min_id
+
+    return (
+        task_id,
+        task_type,
+        task_data.json(),
+        task_priority,
+        task_locality,
+        speculation_group,
+        task_queue,
     )
 
 
+def get_max_runtime(
+    context: BayesOptMinimizerContext, controller: ControllerProxy
+) -> str:
+    return suggest_max_runtime(
+        estimates=get_runtime_estimates(controller),
+        task_type="calibration",
+        task_locality=make_task_locality(context.place, context.multiplier),
+        max_runtime=context.max_runtime,
+    )
+
+
+def add_tasks(
+    controller: ControllerProxy, tasks: list[tuple[str, str, str, int, str, str, str]]
+):
+    for task_id in controller.add_new_tasks(tasks):
+        logger.warning("failed to add task: %s : already exists", task_id)
+
+
 def create_initial_tasks(
     min_id: str,
     minimizer: BayesOptMinimizer,
     context: BayesOptMinimizerContext,
     controller: ControllerProxy,
 ):
+    max_runtime = get_max_runtime(context, controller)
+
+    tasks = []
     for i, next_x in enumerate(minimizer.get_initial_xs()):
         task_group = f"{min_id}:{i}"
 
-        do_create_next_task(
-            controller=controller,
+        task = do_create_next_task(
             min_id=min_id,
             task_group=task_group,
             round=i,
             context=context,
             raw_params=next_x,
+            max_runtime=max_runtime,
         )
+        tasks.append(task)
+    add_tasks(controller, tasks)
 
 
 def create_next_task(
@@ -207,23 +243,27 @@ def create_next_task(
         logger.info("Minimization complete for: %s", min_id)
         return
 
-    do_create_next_task(
-        controller=controller,
+    task = do_create_next_task(
         min_id=min_id,
         task_group=task_group,
         round=round,
         context=context,
         raw_params=next_x,
+        max_runtime=get_max_runtime(context, controller),
     )
+    add_tasks(controller, [task])
 
 
-def handle_completed_tasks(con: apsw.Connection, controller: ControllerProxy):
+def handle_completed_tasks(
+    con: apsw.Connection, controller: ControllerProxy, feed: CompletedTaskFeed
+):
     for (
+        _,
         task_id,
         task_type,
         task_data_json,
         task_result_json,
-    ) in controller.get_all_completed_tasks():
+    ) in feed.get(timeout=COMPLETED_WAIT_TIME):
         if task_type == "calibration":
             logger.info("task completed: task_id=%s", task_id)
             controller.set_task_processed(task_id)
@@ -272,6 +312,7 @@ def bayes_opt_task_source():
         port=config.controller_port,
         key_file=str(config.key_file),
         cert_file=str(config.cert_file),
+        transport=config.controller_transport,
     )
 
     setup = parse_calibration_setup(config.setup_dir)
@@ -303,8 +344,18 @@ def bayes_opt_task_source():
             min_state_json = minimizer.state_dict_json()
             mdb.update_minimizer(con, min_id, min_state_json)
 
+    feed = CompletedTaskFeed(
+        controller=controller,
+        task_type="calibration",
+        task_id_prefix=f"{config.run_name}:{setup.setup_name}:",
+    )
     while True:
-        handle_completed_tasks(con=con, controller=controller)
+        try:
+            handle_completed_tasks(con=con, controller=controller, feed=feed)
+        except EOFError as e:
+            logger.warning("connection dropped: reconnecting: %s", e)
+            controller.reconnect()
+            continue
 
         statuses = []
         for (
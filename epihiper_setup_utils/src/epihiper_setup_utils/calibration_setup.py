@@ -3,6 +3,7 @@
 import json
 import shutil
 from pathlib import Path
+from typing import Optional
 
 from jinja2 import Environment, PackageLoader, StrictUndefined
 from pydantic import BaseModel
@@ -20,12 +21,16 @@ class CalibTaskData(BaseModel):
     raw_params: list[float]
     multiplier: int
     max_runtime: str
+    # Time limit of retries; max_runtime may have been lowered from it
+    max_runtime_limit: Optional[str] = None
 
 
 class CalibTask(BaseModel):
     task_id: str
     task_data: CalibTaskData
     output_dir: str  # Relateive Path
+    # Set by the controller on speculative duplicates
+    speculative_of: Optional[str] = None
 
     minimizer_id: str
     task_group: str
@@ -61,7 +66,11 @@ def setup_update_params(range_file: Path, raw_params: list[float], output_dir: P
 
 
 def setup_calibration(
-    env: EnvironmentConfig, setup_root: Path, task_data_file: Path, output_dir: Path
+    env: EnvironmentConfig,
+    setup_root: Path,
+    task_data_file: Path,
+    output_dir: Path,
+    is_retry: bool = False,
 ) -> tuple[Path, int, int]:
     """Setup for calibration."""
     task = CalibTask.parse_file(task_data_file)
@@ -90,11 +99,16 @@ def setup_calibration(
     load = env.get_load(task_data.place, task_data.multiplier)
     max_fails = env.env.max_fails
 
+    # The lowered time limit may be what killed the last attempt
+    max_runtime = task_data.max_runtime
+    if is_retry and task_data.max_runtime_limit is not None:
+        max_runtime = task_data.max_runtime_limit
+
     # Create the sbatch script
     sbatch_script_contents = template.render(
         job_name=task.task_id,
         sbatch_job_args=env.get_job_sbatch_args(task_data.place, task_data.multiplier),
-        max_runtime=task_data.max_runtime,
+        max_runtime=max_runtime,
         sbatch_pipeline_args=env.env.pipeline_sbatch_args,
         env_file_contents=env.env_file_contents,
         common_dir=str(setup_root / task_data.setup_name / task_data.cell),
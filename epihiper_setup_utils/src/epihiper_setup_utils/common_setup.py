@@ -4,22 +4,40 @@ import gzip
 import json
 import logging
 from pathlib import Path
+from typing import Optional
 
 from .env_file import EnvironmentConfig
 
 
 MAX_FAILS = 100
 
+# Written by the sbatch scripts once the outputs are compressed
+COMPLETION_MANIFEST = "completion.json"
+
 logger = logging.getLogger(__name__)
 
 
-def mkdir_output_dir(output_dir: Path) -> None:
-    """Create a fresh output directory.
+def get_output_dir(
+    output_root: Path, output_dir: str, speculative_of: Optional[str]
+) -> Path:
+    """Get the output directory of a task.
+
+    A speculative duplicate gets its own directory,
+    as it may run while the original is still writing to its directory.
+    """
+    if speculative_of is not None:
+        output_dir = f"{output_dir}-speculative"
+    return output_root / output_dir
+
+
+def mkdir_output_dir(output_dir: Path) -> bool:
+    """Create a fresh output directory; return if it is for a retry.
 
     If the directory already exists rename it with -fail_{i} suffix,
     and create a fresh output directory.
     """
-    if output_dir.exists():
+    is_retry = output_dir.exists()
+    if is_retry:
         for i in range(1, MAX_FAILS + 1):
             fail_dir = str(output_dir) + f"-fail_{i}"
             fail_dir = Path(fail_dir)
@@ -30,6 +48,7 @@ def mkdir_output_dir(output_dir: Path) -> None:
             break
 
     output_dir.mkdir(mode=0o770, parents=True, exist_ok=False)
+    return is_retry
 
 
 def setup_run_parameters(
@@ -83,34 +102,69 @@ def setup_run_parameters(
     )
 
 
+def check_completion_manifest(
+    output_dir: Path, run_parameters: dict, output_files: list[Path]
+) -> bool:
+    """Check the run against the completion manifest written by the sbatch script.
+
+    Only the manifest is read and the output files are stat-ed,
+    so the check takes the same time however large the outputs are.
+    """
+    manifest_file = output_dir / COMPLETION_MANIFEST
+    manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+
+    assert run_parameters["endTick"] == manifest["end_tick"], (
+        "Manifest end tick doesn't correspond to end tick"
+    )
+    for output_file in output_files:
+        size = manifest["files"][output_file.name]["size"]
+        assert size > 0, f"Output {output_file.name} empty"
+        assert output_file.stat().st_size == size, (
+            f"Output {output_file.name} size doesn't match manifest"
+        )
+    return True
+
+
+def check_summary_output(run_parameters: dict, output_files: list[Path]) -> bool:
+    """Check the run by reading the last tick of the summary output."""
+    # Ensure output files have non zero size
+    for output_file in output_files:
+        assert output_file.stat().st_size > 0, f"Output {output_file.name} empty"
+
+    # Ensure the last tick of summary output is same as the number of ticks
+    summary_output_file = output_files[1]
+    end_tick = run_parameters["endTick"]
+    with gzip.open(summary_output_file, "rt") as fobj:
+        last_line = ""
+        for line in fobj:
+            last_line = line
+    last_line = last_line.strip().split(",")
+    assert end_tick == int(
+        last_line[0]
+    ), "Summary last line doesn't correspond to end tick"
+
+    return True
+
+
 def check_epihiper_successful(output_dir: Path) -> bool:
-    """Check if the EpiHiper simulation finshed successfully."""
+    """Check if the EpiHiper simulation finshed successfully.
+
+    Runs with a completion manifest are checked against it;
+    older runs without one fall back to scanning the summary output.
+    """
     try:
         output_dir = Path(output_dir)
         run_params_file = output_dir / "runParameters.json"
 
         run_parameters = json.loads(run_params_file.read_text(encoding="utf-8"))
-
-        # Ensure output file has non zero size
-        output_file = Path(run_parameters["output"] + ".gz")
-        assert output_file.stat().st_size > 0, "Output file empty"
-
-        # Ensure the summary output file has non zero size
-        summary_output_file = Path(run_parameters["summaryOutput"] + ".gz")
-        assert summary_output_file.stat().st_size > 0, "Summary output empty"
-
-        # Ensure the last tick of summary output is same as the number of ticks
-        end_tick = run_parameters["endTick"]
-        with gzip.open(summary_output_file, "rt") as fobj:
-            last_line = ""
-            for line in fobj:
-                last_line = line
-        last_line = last_line.strip().split(",")
-        assert end_tick == int(
-            last_line[0]
-        ), "Summary last line doesn't correspond to end tick"
-
-        return True
+        output_files = [
+            Path(run_parameters["output"] + ".gz"),
+            Path(run_parameters["summaryOutput"] + ".gz"),
+        ]
+
+        if (output_dir / COMPLETION_MANIFEST).exists():
+            return check_completion_manifest(output_dir, run_parameters, output_files)
+        return check_summary_output(run_parameters, output_files)
     except Exception as e:
         logger.debug("EpiHiper succesful completion can't be verfied: %s", e)
         return False
@@ -1,7 +1,7 @@
 """Configuration for the controller."""
 
 import sys
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseSettings, DirectoryPath, FilePath, ValidationError
 
@@ -10,6 +10,7 @@ class CsmTaskSourceConfig(BaseSettings):
     cert_file: FilePath
     controller_host: str
     controller_port: int
+    controller_transport: Literal["rpyc", "framed"] = "rpyc"
 
     work_dir: DirectoryPath
 
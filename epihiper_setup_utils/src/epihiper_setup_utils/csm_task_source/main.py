@@ -1,14 +1,13 @@
 """Create EpiHiper Calibration Tasks using Convex Scalar Minimizer."""
 
 import logging
-from collections import defaultdict
 
 import apsw
 import click
 import pandas as pd
 from pydantic import BaseModel
 
-from mackenzie.controller.main import ControllerProxy
+from mackenzie.controller.main import ControllerProxy, CompletedTaskFeed
 
 from ..calibration_setup import CalibTask, CalibTaskData
 from ..calibration_handler import CalibTaskResult
@@ -24,11 +23,15 @@ from ..minimizer.convex_scalar_minimizer import (
     MinimizationComplete,
 )
 from ..minimizer import minimizer_db as mdb
+from ..env_file import make_task_locality
+from ..max_runtime import get_runtime_estimates, suggest_max_runtime
 
 from .config import get_csmts_config
 
 logger = logging.getLogger(__name__)
 
+COMPLETED_WAIT_TIME = 60
+
 
 class CsmMinimizerContext(BaseModel):
     run: str
@@ -124,14 +127,14 @@ def create_minimizers(
 
 
 def do_create_next_task(
-    controller: ControllerProxy,
     min_id: str,
     task_group: str,
     round: int,
     replicate: int,
     context: CsmMinimizerContext,
     raw_params: list[float],
-) -> None:
+    max_runtime: str,
+) -> tuple[str, str, str, int, str, str, str]:
     task_id = f"{task_group}:{replicate}"
     output_dir = (
         f"{context.run}/{context.setup}/{context.cell}/{context.place}"
@@ -147,7 +150,8 @@ def do_create_next_task(
             place=context.place,
             raw_params=raw_params,
             multiplier=context.multiplier,
-            max_runtime=context.max_runtime,
+            max_runtime=max_runtime,
+            max_runtime_limit=context.max_runtime,
         ),
         output_dir=output_dir,
         minimizer_id=min_id,
@@ -156,15 +160,27 @@ def do_create_next_task(
     )
     task_type = "calibration"
     task_priority = context.task_priority
+    task_locality = make_task_locality(context.place, context.multiplier)
+    task_queue = context.run
 
-    controller.add_new_task(
-        task_id=task_id,
-        task_type=task_type,
-        task_data_json=task_data.json(),
-        task_priority=task_priority,
+    return (
+        task_id,
+        task_type,
+        task_data.json(),
+        task_priority,
+        task_locality,
+        task_group,
+        task_queue,
     )
 
 
+def add_tasks(
+    controller: ControllerProxy, tasks: list[tuple[str, str, str, int, str, str, str]]
+):
+    for task_id in controller.add_new_tasks(tasks):
+        logger.warning("failed to add task: %s : already exists", task_id)
+
+
 def create_next_tasks(
     min_id: str,
     minimizer: ConvexScalarMinimizer,
@@ -179,16 +195,26 @@ def create_next_tasks(
         logger.info("Minimization complete for: %s", min_id)
         return
 
+    max_runtime = suggest_max_runtime(
+        estimates=get_runtime_estimates(controller),
+        task_type="calibration",
+        task_locality=make_task_locality(context.place, context.multiplier),
+        max_runtime=context.max_runtime,
+    )
+
+    tasks = []
     for replicate in range(context.num_replicates):
-        do_create_next_task(
-            controller=controller,
+        task = do_create_next_task(
             min_id=min_id,
             task_group=task_group,
             round=round,
             replicate=replicate,
             context=context,
             raw_params=[next_x],
+            max_runtime=max_runtime,
         )
+        tasks.append(task)
+    add_tasks(controller, tasks)
 
 
 class GroupedDatum(BaseModel):
@@ -200,10 +226,11 @@ class GroupedDatum(BaseModel):
 
 
 def do_group_completed_tasks(
-    completed_tasks: list[tuple[str, str, str, str]]
-) -> dict[str, GroupedDatum]:
-    grouped_data = defaultdict(GroupedDatum)
+    completed_tasks: list[tuple[int, str, str, str, str]],
+    grouped_data: dict[str, GroupedDatum],
+) -> None:
     for (
+        _,
         task_id,
         task_type,
         task_data_json,
@@ -214,15 +241,16 @@ def do_group_completed_tasks(
             task_result = CalibTaskResult.parse_raw(task_result_json)
 
             task_group = task_data.task_group
-            gd = grouped_data[task_group]
+            gd = grouped_data.setdefault(task_group, GroupedDatum())
+            if task_id in gd.task_ids:
+                continue
+
             gd.task_ids.append(task_id)
             gd.num_replicates = task_data.num_replicates
             gd.min_id = task_data.minimizer_id
             gd.x = task_data.task_data.raw_params[0]
             gd.ys.append(task_result.objective)
 
-    return grouped_data
-
 
 def do_handle_completed_group(
     con: apsw.Connection, controller: ControllerProxy, gd: GroupedDatum
@@ -243,16 +271,23 @@ def do_handle_completed_group(
     mdb.update_minimizer(con, gd.min_id, min_state_json)
 
 
-def handle_completed_tasks(con: apsw.Connection, controller: ControllerProxy):
-    grouped_data = do_group_completed_tasks(controller.get_all_completed_tasks())
+def handle_completed_tasks(
+    con: apsw.Connection,
+    controller: ControllerProxy,
+    feed: CompletedTaskFeed,
+    grouped_data: dict[str, GroupedDatum],
+):
+    completed_tasks = feed.get(timeout=COMPLETED_WAIT_TIME)
+    do_group_completed_tasks(completed_tasks, grouped_data)
 
     # Process the groups
-    for task_group, gd in grouped_data.items():
+    for task_group, gd in list(grouped_data.items()):
         if gd.num_replicates != len(gd.ys):
             continue
 
         logger.info("task group completed: task_group=%s", task_group)
         do_handle_completed_group(con, controller, gd)
+        del grouped_data[task_group]
 
 
 @click.command()
@@ -270,6 +305,7 @@ def csm_task_source():
         port=config.controller_port,
         key_file=str(config.key_file),
         cert_file=str(config.cert_file),
+        transport=config.controller_transport,
     )
 
     setup = parse_calibration_setup(config.setup_dir)
@@ -295,8 +331,21 @@ def csm_task_source():
 
         create_next_tasks(min_id, minimizer, min_context, controller)
 
+    feed = CompletedTaskFeed(
+        controller=controller,
+        task_type="calibration",
+        task_id_prefix=f"{config.run_name}:{setup.setup_name}:",
+    )
+    grouped_data: dict[str, GroupedDatum] = {}
     while True:
-        handle_completed_tasks(con=con, controller=controller)
+        try:
+            handle_completed_tasks(
+                con=con, controller=controller, feed=feed, grouped_data=grouped_data
+            )
+        except EOFError as e:
+            logger.warning("connection dropped: reconnecting: %s", e)
+            controller.reconnect()
+            continue
 
         statuses = []
         for (
@@ -26,6 +26,11 @@ def place_to_synpop(place: str) -> str:
         return place
 
 
+def make_task_locality(place: str, multiplier: int) -> str:
+    """Get the partition needed to run a task for the place and multiplier."""
+    return f"{place_to_synpop(place)}:{multiplier}"
+
+
 class EnvironmentConfig:
     def __init__(self, env_file: Path):
         env = dotenv_values(str(env_file))
@@ -40,6 +45,17 @@ class EnvironmentConfig:
         assert contact_network_file.exists()
         return str(contact_network_file)
 
+    def get_partition_localities(self) -> list[str]:
+        """Get the task localities of the partitions present in the cache."""
+        localities = []
+        for contact_network_file in self.env.partition_cache_dir.glob(
+            "*/*/contact_network.txt"
+        ):
+            partition_dir = contact_network_file.parent
+            synpop, multiplier = partition_dir.parent.name, partition_dir.name
+            localities.append(f"{synpop}:{multiplier}")
+        return localities
+
     def get_job_sbatch_args(self, place: str, multipiler: int) -> str:
         synpop = place_to_synpop(place)
         partition_cache_dir = self.env.partition_cache_dir
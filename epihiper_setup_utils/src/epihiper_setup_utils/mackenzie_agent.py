@@ -5,7 +5,12 @@ from functools import partial
 
 import click
 
-from mackenzie.agent.main import agent_main, SetupTaskType, GetTaskResultType
+from mackenzie.agent.main import (
+    agent_main,
+    SetupTaskType,
+    GetTaskResultType,
+    EstimateLoadType,
+)
 
 from .env_file import EnvironmentConfig
 from . import calibration_handler as calib
@@ -33,11 +38,19 @@ def mackenzie_agent(env_file: Path, output_root: Path):
 
     type_setup_task: dict[str, SetupTaskType] = {}
     type_get_task_result: dict[str, GetTaskResultType] = {}
+    type_estimate_load: dict[str, EstimateLoadType] = {}
 
     type_setup_task["calibration"] = partial(calib.setup_task, env, output_root)
     type_get_task_result["calibration"] = partial(calib.get_task_result, env, output_root)
+    type_estimate_load["calibration"] = partial(calib.estimate_load, env)
 
     type_setup_task["projection"] = partial(proj.setup_task, env, output_root)
     type_get_task_result["projection"] = partial(proj.get_task_result, env, output_root)
-
-    return agent_main(type_setup_task, type_get_task_result)
+    type_estimate_load["projection"] = partial(proj.estimate_load, env)
+
+    return agent_main(
+        type_setup_task,
+        type_get_task_result,
+        env.get_partition_localities,
+        type_estimate_load=type_estimate_load,
+    )
@@ -0,0 +1,107 @@
+"""Pick the Slurm time limit of tasks from their runtime estimates."""
+
+import math
+import logging
+from typing import Optional
+
+from mackenzie.controller.main import ControllerProxy
+
+logger = logging.getLogger(__name__)
+
+# Estimates with fewer samples are not trusted
+MIN_SAMPLES = 5
+
+# Headroom over the longest runtime seen so far
+RUNTIME_MARGIN = 1.5
+
+# Never ask for less than this (s)
+MIN_RUNTIME = 15 * 60
+
+# (task_type, task_locality) -> (num_samples, max_elapsed)
+RuntimeEstimatesType = dict[tuple[str, Optional[str]], tuple[int, int]]
+
+
+def parse_slurm_time(time_str: str) -> int:
+    """Parse a Slurm time limit into seconds.
+
+    The accepted formats are
+    "minutes", "minutes:seconds", "hours:minutes:seconds",
+    "days-hours", "days-hours:minutes" and "days-hours:minutes:seconds".
+    """
+    days = 0
+    if "-" in time_str:
+        days_str, time_str = time_str.split("-", 1)
+        days = int(days_str)
+        parts = [int(p) for p in time_str.split(":")]
+        parts = parts + [0] * (3 - len(parts))
+        hours, minutes, seconds = parts
+    else:
+        parts = [int(p) for p in time_str.split(":")]
+        match parts:
+            case [minutes]:
+                hours, seconds = 0, 0
+            case [minutes, seconds]:
+                hours = 0
+            case [hours, minutes, seconds]:
+                pass
+            case _:
+                raise ValueError(f"Invalid slurm time: {time_str!r}")
+
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def format_slurm_time(seconds: int) -> str:
+    """Format seconds as a Slurm time limit, rounded up to the minute."""
+    minutes = math.ceil(seconds / 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}-{hours:02d}:{minutes:02d}:00"
+    return f"{hours}:{minutes:02d}:00"
+
+
+def get_runtime_estimates(controller: ControllerProxy) -> RuntimeEstimatesType:
+    """Get the number of samples and max elapsed time of every task class."""
+    estimates = {}
+    for row in controller.get_runtime_estimates():
+        task_type, task_locality, num_samples, _, max_elapsed = row[:5]
+        estimates[task_type, task_locality] = (num_samples, max_elapsed)
+    return estimates
+
+
+def suggest_max_runtime(
+    estimates: RuntimeEstimatesType,
+    task_type: str,
+    task_locality: Optional[str],
+    max_runtime: str,
+) -> str:
+    """Suggest the time limit of a task.
+
+    The configured max_runtime is an upper bound.
+    Once enough tasks of the same type and locality have completed,
+    the limit is lowered to RUNTIME_MARGIN times the longest of them,
+    so that jobs do not wait in the Slurm queue for time they never use.
+    Retries run with max_runtime again (see max_runtime_limit in the task data),
+    in case the lowered limit was too short.
+    """
+    estimate = estimates.get((task_type, task_locality))
+    if estimate is None:
+        return max_runtime
+
+    num_samples, max_elapsed = estimate
+    if num_samples < MIN_SAMPLES:
+        return max_runtime
+
+    limit = parse_slurm_time(max_runtime)
+    suggested = max(MIN_RUNTIME, int(max_elapsed * RUNTIME_MARGIN))
+    if suggested >= limit:
+        return max_runtime
+
+    suggested_runtime = format_slurm_time(suggested)
+    logger.debug(
+        "lowered max runtime: task_type=%s, task_locality=%s, max_runtime=%s",
+        task_type,
+        task_locality,
+        suggested_runtime,
+    )
+    return suggested_runtime
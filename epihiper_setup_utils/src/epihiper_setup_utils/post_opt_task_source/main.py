@@ -14,6 +14,8 @@ from ..calibration_setup_parser import (
     ParamRanges,
     parse_calibration_setup,
 )
+from ..env_file import make_task_locality
+from ..max_runtime import get_runtime_estimates, suggest_max_runtime
 
 from .config import get_pots_config
 
@@ -32,13 +34,13 @@ class PostOptimizerContext(BaseModel):
 
 
 def do_create_next_task(
-    controller: ControllerProxy,
     min_id: str,
     task_group: str,
     replicate: int,
     context: PostOptimizerContext,
     raw_params: list[float],
-) -> None:
+    max_runtime: str,
+) -> tuple[str, str, str, int, str, str, str]:
     task_id = f"{task_group}:{replicate}"
     output_dir = f"{context.run}/{context.setup}/{context.cell}/{context.place}/post_opt_runs/replicate_{replicate}"
 
@@ -51,7 +53,8 @@ def do_create_next_task(
             place=context.place,
             raw_params=raw_params,
             multiplier=context.multiplier,
-            max_runtime=context.max_runtime,
+            max_runtime=max_runtime,
+            max_runtime_limit=context.max_runtime,
         ),
         output_dir=output_dir,
         minimizer_id=min_id,
@@ -60,16 +63,18 @@ def do_create_next_task(
     )
     task_type = "calibration"
     task_priority = context.task_priority
-
-    try:
-        controller.add_new_task(
-            task_id=task_id,
-            task_type=task_type,
-            task_data_json=task_data.json(),
-            task_priority=task_priority,
-        )
-    except Exception as e:
-        logging.warning("failed to add task: %s : %s", task_id, e)
+    task_locality = make_task_locality(context.place, context.multiplier)
+    task_queue = context.run
+
+    return (
+        task_id,
+        task_type,
+        task_data.json(),
+        task_priority,
+        task_locality,
+        task_group,
+        task_queue,
+    )
 
 
 def get_param(x: float, min: float, max: float) -> float:
@@ -95,6 +100,7 @@ def post_opt_task_source():
         port=config.controller_port,
         key_file=str(config.key_file),
         cert_file=str(config.cert_file),
+        transport=config.controller_transport,
     )
 
     opt_status_df = pd.read_csv(config.opt_status_file)
@@ -115,25 +121,45 @@ def post_opt_task_source():
                 opt_x[cell.cell_name, place.place_name],
             )
 
+    estimates = get_runtime_estimates(controller)
+
+    tasks = []
     for cell in setup.cells:
         for place in cell.places:
             min_id = f"{config.run_name}:{setup.setup_name}:{cell.cell_name}:{place.place_name}"
+            max_runtime = suggest_max_runtime(
+                estimates=estimates,
+                task_type="calibration",
+                task_locality=make_task_locality(place.place_name, config.multiplier),
+                max_runtime=config.max_runtime,
+            )
 
             for replicate in range(config.num_evals):
-                do_create_next_task(
-                    controller=controller,
-                    min_id=min_id,
-                    task_group=f"post_opt:{min_id}",
-                    replicate=replicate,
-                    context=PostOptimizerContext(
-                        run=config.run_name,
-                        setup=setup.setup_name,
-                        cell=cell.cell_name,
-                        place=place.place_name,
-                        multiplier=config.multiplier,
-                        max_runtime=config.max_runtime,
-                        task_priority=place.priority,
-                        param_ranges=cell.param_ranges,
-                    ),
-                    raw_params=opt_x[cell.cell_name, place.place_name],
-                )
+                try:
+                    task = do_create_next_task(
+                        min_id=min_id,
+                        task_group=f"post_opt:{min_id}",
+                        replicate=replicate,
+                        context=PostOptimizerContext(
+                            run=config.run_name,
+                            setup=setup.setup_name,
+                            cell=cell.cell_name,
+                            place=place.place_name,
+                            multiplier=config.multiplier,
+                            max_runtime=config.max_runtime,
+                            task_priority=place.priority,
+                            param_ranges=cell.param_ranges,
+                        ),
+                        raw_params=opt_x[cell.cell_name, place.place_name],
+                        max_runtime=max_runtime,
+                    )
+                except Exception as e:
+                    logger.warning(
+                        "failed to create task: %s:%d : %s", min_id, replicate, e
+                    )
+                    continue
+                tasks.append(task)
+
+    logger.info("Adding %d tasks", len(tasks))
+    for task_id in controller.add_new_tasks(tasks):
+        logger.warning("failed to add task: %s : already exists", task_id)
@@ -1,7 +1,7 @@
 """Configuration for the Projection Optimizer Task Source."""
 
 import sys
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseSettings, DirectoryPath, FilePath, ValidationError
 
@@ -10,6 +10,7 @@ class ProjTaskSourceConfig(BaseSettings):
     cert_file: FilePath
     controller_host: str
     controller_port: int
+    controller_transport: Literal["rpyc", "framed"] = "rpyc"
 
     run_name: str
     setup_dir: DirectoryPath
@@ -10,6 +10,8 @@ from ..projection_setup import ProjTask, ProjTaskData
 from ..projection_setup_parser import (
     parse_projection_setup,
 )
+from ..env_file import make_task_locality
+from ..max_runtime import get_runtime_estimates, suggest_max_runtime
 
 from .config import get_pts_config
 
@@ -17,7 +19,6 @@ logger = logging.getLogger(__name__)
 
 
 def do_create_next_task(
-    controller: ControllerProxy,
     run: str,
     setup: str,
     cell: str,
@@ -27,7 +28,8 @@ def do_create_next_task(
     priority: int,
     multiplier: int,
     max_runtime: str,
-) -> None:
+    max_runtime_limit: str,
+) -> tuple[str, str, str, int, str, str, str]:
     task_id = f"proj:{run}:{setup}:{batch}:{cell}:{place}:{replicate}"
     output_dir = f"{run}/{setup}/batch_{batch}/{cell}/{place}/replicate_{replicate}"
 
@@ -40,6 +42,7 @@ def do_create_next_task(
             place=place,
             multiplier=multiplier,
             max_runtime=max_runtime,
+            max_runtime_limit=max_runtime_limit,
             batch=batch,
             replicate=replicate,
         ),
@@ -47,16 +50,20 @@ def do_create_next_task(
     )
     task_type = "projection"
     task_priority = priority
+    task_locality = make_task_locality(place, multiplier)
+    task_queue = run
+    # Runtimes are only comparable between tasks that run on the same partition
+    task_group = f"proj:{run}:{setup}:{batch}:{task_locality}"
 
-    try:
-        controller.add_new_task(
-            task_id=task_id,
-            task_type=task_type,
-            task_data_json=task_data.json(),
-            task_priority=task_priority,
-        )
-    except Exception as e:
-        logging.warning("failed to add task: %s : %s", task_id, e)
+    return (
+        task_id,
+        task_type,
+        task_data.json(),
+        task_priority,
+        task_locality,
+        task_group,
+        task_queue,
+    )
 
 
 @click.command()
@@ -69,26 +76,52 @@ def proj_task_source():
         port=config.controller_port,
         key_file=str(config.key_file),
         cert_file=str(config.cert_file),
+        transport=config.controller_transport,
     )
 
     setup = parse_projection_setup(config.setup_dir)
+    estimates = get_runtime_estimates(controller)
 
+    tasks = []
     for cell in setup.cells:
         for place in cell.places:
+            max_runtime = suggest_max_runtime(
+                estimates=estimates,
+                task_type="projection",
+                task_locality=make_task_locality(place.place_name, config.multiplier),
+                max_runtime=config.max_runtime,
+            )
             for batch, n_replicates in enumerate(
                 config.num_replicates, config.start_batch
             ):
                 priority = int(place.priority + -batch * 1e6)
                 for replicate in range(n_replicates):
-                    do_create_next_task(
-                        controller=controller,
-                        run=config.run_name,
-                        setup=setup.setup_name,
-                        cell=cell.cell_name,
-                        place=place.place_name,
-                        batch=batch,
-                        replicate=replicate,
-                        priority=priority,
-                        multiplier=config.multiplier,
-                        max_runtime=config.max_runtime,
-                    )
+                    try:
+                        task = do_create_next_task(
+                            run=config.run_name,
+                            setup=setup.setup_name,
+                            cell=cell.cell_name,
+                            place=place.place_name,
+                            batch=batch,
+                            replicate=replicate,
+                            priority=priority,
+                            multiplier=config.multiplier,
+                            max_runtime=max_runtime,
+                            max_runtime_limit=config.max_runtime,
+                        )
+                    except Exception as e:
+                        logger.warning(
+                            "failed to create task: %s:%s:%s:%d:%d : %s",
+                            setup.setup_name,
+                            cell.cell_name,
+                            place.place_name,
+                            batch,
+                            replicate,
+                            e,
+                        )
+                        continue
+                    tasks.append(task)
+
+    logger.info("Adding %d tasks", len(tasks))
+    for task_id in controller.add_new_tasks(tasks):
+        logger.warning("failed to add task: %s : already exists", task_id)
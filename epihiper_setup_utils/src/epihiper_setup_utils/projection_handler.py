@@ -8,7 +8,7 @@ from typing import Any, Optional
 from pydantic import BaseModel
 
 from .env_file import EnvironmentConfig
-from .common_setup import mkdir_output_dir, check_epihiper_successful
+from .common_setup import get_output_dir, mkdir_output_dir, check_epihiper_successful
 from .projection_setup import ProjTask, setup_projection
 
 logger = logging.getLogger(__name__)
@@ -19,6 +19,12 @@ class ProjTaskResult(BaseModel):
     output_dir: str
 
 
+def estimate_load(env: EnvironmentConfig, task_data: Any) -> int:
+    """Estimate the load of a task from its partition config."""
+    task = ProjTask.parse_obj(task_data)
+    return env.get_load(task.task_data.place, task.task_data.multiplier)
+
+
 def setup_task(
     env: EnvironmentConfig, output_root: Path, setup_root: Path, task_data: Any
 ) -> tuple[Path, int, int]:
@@ -26,14 +32,14 @@ def setup_task(
     task = ProjTask.parse_obj(task_data)
     logger.info("setting up task %s", task.task_id)
 
-    output_dir = output_root / task.output_dir
-    mkdir_output_dir(output_dir)
+    output_dir = get_output_dir(output_root, task.output_dir, task.speculative_of)
+    is_retry = mkdir_output_dir(output_dir)
 
     task_data_file = output_dir / "taskData.json"
     task_data_file.write_text(json.dumps(task_data))
 
     sbatch_script_file, load, max_fails = setup_projection(
-        env, setup_root, task_data_file, output_dir
+        env, setup_root, task_data_file, output_dir, is_retry
     )
     return (sbatch_script_file, load, max_fails)
 
@@ -45,7 +51,7 @@ def get_task_result(
     setup_root = setup_root
 
     task = ProjTask.parse_obj(task_data)
-    output_dir = output_root / task.output_dir
+    output_dir = get_output_dir(output_root, task.output_dir, task.speculative_of)
 
     if not check_epihiper_successful(output_dir):
         return None
@@ -2,6 +2,7 @@
 
 import shutil
 from pathlib import Path
+from typing import Optional
 
 from jinja2 import Environment, PackageLoader, StrictUndefined
 from pydantic import BaseModel
@@ -19,16 +20,24 @@ class ProjTaskData(BaseModel):
     replicate: int
     multiplier: int
     max_runtime: str
+    # Time limit of retries; max_runtime may have been lowered from it
+    max_runtime_limit: Optional[str] = None
 
 
 class ProjTask(BaseModel):
     task_id: str
     task_data: ProjTaskData
     output_dir: str  # Relateive Path
+    # Set by the controller on speculative duplicates
+    speculative_of: Optional[str] = None
 
 
 def setup_projection(
-    env: EnvironmentConfig, setup_root: Path, task_data_file: Path, output_dir: Path
+    env: EnvironmentConfig,
+    setup_root: Path,
+    task_data_file: Path,
+    output_dir: Path,
+    is_retry: bool = False,
 ) -> tuple[Path, int, int]:
     """Setup for calibration."""
     task = ProjTask.parse_file(task_data_file)
@@ -53,11 +62,16 @@ def setup_projection(
     load = env.get_load(task_data.place, task_data.multiplier)
     max_fails = env.env.max_fails
 
+    # The lowered time limit may be what killed the last attempt
+    max_runtime = task_data.max_runtime
+    if is_retry and task_data.max_runtime_limit is not None:
+        max_runtime = task_data.max_runtime_limit
+
     # Create the sbatch script
     sbatch_script_contents = template.render(
         job_name=task.task_id,
         sbatch_job_args=env.get_job_sbatch_args(task_data.place, task_data.multiplier),
-        max_runtime=task_data.max_runtime,
+        max_runtime=max_runtime,
         sbatch_pipeline_args=env.env.pipeline_sbatch_args,
         env_file_contents=env.env_file_contents,
         common_dir=str(setup_root / task_data.setup_name / task_data.cell),
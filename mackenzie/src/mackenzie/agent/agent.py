@@ -1,23 +1,27 @@
 """Main Agent Logic."""
 
-import shlex
-import hashlib
 import logging
-from subprocess import run
+from concurrent.futures import Executor
+from typing import Iterator, Optional
 
 import apsw
 
 from ..db import setup_db as sdb
 from ..controller.main import ControllerProxy
+from ..setup_transfer import PartFile, iter_chunks, ingest_setup, get_setup_dir_hash
 from .config import AgentConfig
 from .slurm_pipeline import (
     process_failed,
     process_ready,
     process_running,
     process_new,
-    SetupTaskType,
+    process_setup,
+    process_submitting,
+    renew_leases,
     GetTaskResultType,
+    EstimateLoadType,
 )
+from .setup_pool import SetupPool
 
 
 logger = logging.getLogger(__name__)
@@ -26,39 +30,54 @@ logger = logging.getLogger(__name__)
 def add_setup(
     config: AgentConfig,
     con: apsw.Connection,
+    controller: ControllerProxy,
     setup_name: str,
-    setup_dir_tar: bytes,
 ) -> None:
-    """Add a new set setup to the system."""
+    """Download and extract a setup.
+
+    The setup is fetched chunk by chunk and extracted as it arrives.
+    The received chunks are also appended to a part file,
+    so that a dropped connection resumes from the last received chunk.
+    """
     logger.info("received add setup: setup_name=%s", setup_name)
-    incoming_hash = hashlib.sha256(setup_dir_tar).hexdigest()
+    chunks = controller.get_setup_chunks(setup_name)
+    setup_hash, size, chunk_size, chunk_hashes = chunks
+    chunks = (setup_hash, size, chunk_size, tuple(chunk_hashes))
+    logger.info(
+        "downloading setup: setup_name=%s, setup_hash=%s, size=%d",
+        setup_name,
+        setup_hash,
+        size,
+    )
 
-    setup_tar_file = config.setup_root / f"{setup_name}.tar.gz"
-    if setup_tar_file.exists():
-        logger.info("setup-tar-exists: setup_tar_file=%s", setup_tar_file)
-        existing_hash = hashlib.sha256(setup_tar_file.read_bytes()).hexdigest()
-        if existing_hash != incoming_hash:
-            raise RuntimeError(
-                f"Existing setup '{setup_name}' being replaced by a different setup."
-            )
+    incoming_dir = config.setup_root / "incoming"
+    incoming_dir.mkdir(exist_ok=True)
+    part = PartFile(incoming_dir / f"{setup_hash}.part", chunks)
+    start_index = part.next_index()
+
+    def setup_chunks() -> Iterator[bytes]:
+        if start_index > 0:
+            yield from iter_chunks(part.part_file, chunk_size)
+        for index in range(start_index, len(chunk_hashes)):
+            data = controller.get_setup_chunk(setup_name, index)
+            part.write_chunk(index, data)
+            yield data
+
+    try:
+        ingest_setup(config.setup_root, setup_name, setup_hash, setup_chunks())
+    except RuntimeError:
+        # The part file doesn't match the setup; start over next time
+        part.part_file.unlink(missing_ok=True)
+        raise
+
+    if config.keep_setup_tar:
+        part.part_file.touch()
+        part.part_file.rename(config.setup_root / f"{setup_name}.tar.gz")
     else:
-        logger.info("writing-setup-tar: setup_tar_file=%s", setup_tar_file)
-        setup_tar_file.write_bytes(setup_dir_tar)
-
-    setup_dir = config.setup_root / setup_name
-    if not setup_dir.exists():
-        logger.info("untarring-setup-tar: setup_tar_file=%s", setup_tar_file)
-        cmd = f"tar -C '{config.setup_root}' -xzf '{setup_tar_file}'"
-        logger.info("executing: %s", cmd)
-        cmd = shlex.split(cmd)
-        run(cmd, check=True)
-        if not setup_dir.exists():
-            raise RuntimeError(
-                f"Untarring '{setup_tar_file!s}' did not create '{setup_dir}'"
-            )
+        part.part_file.unlink(missing_ok=True)
 
     try:
-        sdb.add_new_setup(con, setup_name, incoming_hash)
+        sdb.add_new_setup(con, setup_name, setup_hash)
     except apsw.ConstraintError:
         pass
 
@@ -66,32 +85,54 @@ def add_setup(
 def sync_setups(
     config: AgentConfig, controller: ControllerProxy, db_con: apsw.Connection
 ) -> None:
-    """Ensure the agent has all the setups as the controller."""
+    """Ensure the agent has all the setups as the controller.
+
+    A setup directory that is already there but not registered,
+    for example after the agent database was reset,
+    is registered without a transfer if its hash is known and matches.
+    """
 
-    controller_setups = controller.get_all_setup_names()
-    local_setups = sdb.get_all_setup_names(db_con)
+    controller_setups = controller.get_all_setups()
+    local_setups = sdb.get_all_setups(db_con)
     new_setups = set(controller_setups) - set(local_setups)
-    if new_setups:
-        for setup_name in new_setups:
-            setup_dir_tar = controller.get_setup_dir_tar(setup_name)
-            add_setup(config, db_con, setup_name, setup_dir_tar)
+    for setup_name, setup_hash in new_setups:
+        local_hash = get_setup_dir_hash(config.setup_root, setup_name)
+        if local_hash is None:
+            add_setup(config, db_con, controller, setup_name)
+        elif local_hash == setup_hash:
+            logger.info("setup dir exists: setup_name=%s", setup_name)
+            try:
+                sdb.add_new_setup(db_con, setup_name, setup_hash)
+            except apsw.ConstraintError:
+                pass
+        else:
+            raise RuntimeError(
+                f"Existing setup '{setup_name}' does not match the controller's."
+            )
 
 
 def process_jobs(
     con: apsw.Connection,
     config: AgentConfig,
     controller: ControllerProxy,
-    type_setup_task: dict[str, SetupTaskType],
+    setup_pool: SetupPool,
     type_get_task_result: dict[str, GetTaskResultType],
+    result_executor: Executor,
+    type_estimate_load: dict[str, EstimateLoadType],
+    localities: Optional[list[str]] = None,
 ):
     """Process all tasks."""
+    renew_leases(con=con, controller=controller, cluster=config.cluster)
+
     process_new(
         con=con,
-        setup_root=config.setup_root,
         controller=controller,
         cluster=config.cluster,
         max_load=config.max_load,
-        type_setup_task=type_setup_task,
+        claim_batch_size=config.claim_batch_size,
+        default_load=config.default_job_load,
+        type_estimate_load=type_estimate_load,
+        localities=localities,
     )
 
     process_running(
@@ -99,13 +140,13 @@ def process_jobs(
         setup_root=config.setup_root,
         controller=controller,
         type_get_task_result=type_get_task_result,
+        executor=result_executor,
     )
 
-    process_failed(
-        con=con,
-        setup_root=config.setup_root,
-        controller=controller,
-        type_setup_task=type_setup_task,
-    )
+    process_failed(con=con, controller=controller)
+
+    process_setup(con=con, setup_pool=setup_pool)
+
+    process_submitting(con=con)
 
     process_ready(con=con, max_load=config.max_load)
@@ -1,7 +1,7 @@
 """Configuration for the agent."""
 
 import sys
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseSettings, DirectoryPath, FilePath, ValidationError
 
@@ -10,12 +10,31 @@ class AgentConfig(BaseSettings):
     key_file: FilePath
     cert_file: FilePath
     setup_root: DirectoryPath
+    keep_setup_tar: bool = False
 
     cluster: str
     max_load: int
+    claim_batch_size: int = 100
+
+    # Load assumed for a claimed job whose load is not known yet,
+    # when no live job has a known load to go by
+    default_job_load: int = 1
+
+    # Seconds between scans for the task localities of this cluster
+    locality_refresh_period: int = 300
+
+    # Pool the results of finished jobs are checked on
+    result_workers: int = 8
+    result_executor: Literal["thread", "process"] = "thread"
+
+    # Pool the tasks are set up on
+    setup_workers: int = 8
+    setup_executor: Literal["thread", "process"] = "thread"
+    max_setups_in_flight: int = 64
 
     controller_host: str
     controller_port: int
+    controller_transport: Literal["rpyc", "framed"] = "rpyc"
 
     class Config:
         env_prefix = "AGENT_"
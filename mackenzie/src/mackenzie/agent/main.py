@@ -2,6 +2,8 @@
 
 import time
 import logging
+from typing import Callable, Optional
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 
 import apsw
 
@@ -10,16 +12,58 @@ from ..db import job_db as jdb
 from ..controller.main import ControllerProxy
 from .config import get_agent_config
 from .agent import sync_setups, process_jobs
-from .slurm_pipeline import SetupTaskType, GetTaskResultType
+from .slurm_pipeline import SetupTaskType, GetTaskResultType, EstimateLoadType
+from .setup_pool import SetupPool
 
 logger = logging.getLogger(__name__)
 
 
+def make_executor(kind: str, max_workers: int, name: str) -> Executor:
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+
+class LocalityCache:
+    """The task localities of this cluster, rescanned every refresh_period seconds.
+
+    A failed scan keeps the localities found by the last good one;
+    until a scan succeeds only tasks without a locality are claimed.
+    """
+
+    def __init__(self, get_localities: Callable[[], list[str]], refresh_period: int):
+        self.get_localities = get_localities
+        self.refresh_period = refresh_period
+
+        self.localities: list[str] = []
+        self.refresh_at = 0.0
+
+    def get(self) -> list[str]:
+        now = time.monotonic()
+        if now >= self.refresh_at:
+            try:
+                self.localities = self.get_localities()
+                self.refresh_at = now + self.refresh_period
+            except OSError as e:
+                logger.warning("locality scan failed: retrying=True: %s", e)
+        return self.localities
+
+
 def agent_main(
     type_setup_task: dict[str, SetupTaskType],
     type_get_task_result: dict[str, GetTaskResultType],
+    get_localities: Optional[Callable[[], list[str]]] = None,
+    type_estimate_load: Optional[dict[str, EstimateLoadType]] = None,
 ):
-    """Start the agent."""
+    """Start the agent.
+
+    get_localities returns the task localities available on this cluster.
+    It is called every locality_refresh_period seconds
+    so that newly available localities are picked up.
+
+    type_estimate_load estimates the load of a task from its data
+    before it is set up, so that the agent does not claim more than it can run.
+    """
     logger.info("getting agent config")
     config = get_agent_config()
 
@@ -29,6 +73,7 @@ def agent_main(
         port=config.controller_port,
         key_file=str(config.key_file),
         cert_file=str(config.cert_file),
+        transport=config.controller_transport,
     )
 
     logger.info("initializing agent db")
@@ -39,17 +84,36 @@ def agent_main(
     sdb.init_setup_db(db_con)
     jdb.init_job_db(db_con)
 
+    result_executor = make_executor(
+        config.result_executor, config.result_workers, "result"
+    )
+    setup_pool = SetupPool(
+        executor=make_executor(config.setup_executor, config.setup_workers, "setup"),
+        setup_root=config.setup_root,
+        type_setup_task=type_setup_task,
+        max_in_flight=config.max_setups_in_flight,
+    )
+
+    locality_cache = None
+    if get_localities is not None:
+        locality_cache = LocalityCache(get_localities, config.locality_refresh_period)
+
+    # No transaction is held across the loop;
+    # every state change commits on its own (see slurm_pipeline).
     while True:
         try:
-            with db_con:
-                sync_setups(config=config, controller=controller, db_con=db_con)
-                process_jobs(
-                    config=config,
-                    con=db_con,
-                    controller=controller,
-                    type_setup_task=type_setup_task,
-                    type_get_task_result=type_get_task_result,
-                )
+            localities = None if locality_cache is None else locality_cache.get()
+            sync_setups(config=config, controller=controller, db_con=db_con)
+            process_jobs(
+                config=config,
+                con=db_con,
+                controller=controller,
+                setup_pool=setup_pool,
+                type_get_task_result=type_get_task_result,
+                result_executor=result_executor,
+                type_estimate_load=type_estimate_load or {},
+                localities=localities,
+            )
         except EOFError as e:
             logger.warning("connection dropped: reconnecting: %s", e)
             controller.reconnect()
@@ -0,0 +1,100 @@
+"""Parse the output of sacct."""
+
+from datetime import datetime
+from typing import Optional
+
+RSS_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+# elapsed (s), queue_wait (s), max_rss (bytes)
+SacctStatsType = tuple[Optional[int], Optional[int], Optional[int]]
+
+
+def parse_rss(rss: str) -> Optional[int]:
+    """Parse a sacct memory size like 1234K into bytes."""
+    if not rss:
+        return None
+    if rss[-1] in RSS_UNITS:
+        return int(float(rss[:-1]) * RSS_UNITS[rss[-1]])
+    return int(float(rss))
+
+
+def parse_time(timestamp: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(timestamp)
+    except ValueError:
+        # Unknown, None, etc.
+        return None
+
+
+def split_sacct_info(sacct_info: str) -> dict[int, str]:
+    """Split the output of sacct for several jobs into the output for each job.
+
+    The job id is read from the JobID column wherever the header puts it;
+    with `-o ALL` it is not the first one.
+    The rows of a job are its allocation and its steps (<job id>.<step>).
+    Every job keeps the header,
+    so its output is the same as that of a sacct call for just that job.
+    """
+    lines = sacct_info.strip().splitlines()
+    if len(lines) < 2:
+        return {}
+
+    header, rows = lines[0], lines[1:]
+    try:
+        job_id_index = header.split("|").index("JobID")
+    except ValueError:
+        return {}
+
+    job_rows: dict[int, list[str]] = {}
+    for row in rows:
+        fields = row.split("|")
+        if len(fields) <= job_id_index:
+            continue
+        job_id = fields[job_id_index].split(".", 1)[0]
+        if not job_id.isdigit():
+            continue
+        job_rows.setdefault(int(job_id), []).append(row)
+
+    return {
+        job_id: "\n".join([header, *rows]) + "\n"
+        for job_id, rows in job_rows.items()
+    }
+
+
+def parse_sacct_info(slurm_job_id: int, sacct_info: str) -> SacctStatsType:
+    """Get the elapsed time, queue wait and max RSS of a job.
+
+    sacct_info is the output of `sacct -j <slurm_job_id> -o ALL -P`.
+    The times come from the row of the job allocation;
+    MaxRSS is only reported for the job steps, so the max over all rows is taken.
+    """
+    lines = sacct_info.strip().splitlines()
+    if len(lines) < 2:
+        return None, None, None
+
+    header = lines[0].split("|")
+    rows = [dict(zip(header, line.split("|"))) for line in lines[1:]]
+
+    elapsed, queue_wait = None, None
+    for row in rows:
+        if row.get("JobID") != str(slurm_job_id):
+            continue
+
+        if row.get("ElapsedRaw", "").isdigit():
+            elapsed = int(row["ElapsedRaw"])
+
+        submit = parse_time(row.get("Submit", ""))
+        start = parse_time(row.get("Start", ""))
+        if submit is not None and start is not None:
+            queue_wait = max(int((start - submit).total_seconds()), 0)
+
+    max_rss = None
+    for row in rows:
+        try:
+            rss = parse_rss(row.get("MaxRSS", ""))
+        except ValueError:
+            continue
+        if rss is not None and (max_rss is None or rss > max_rss):
+            max_rss = rss
+
+    return elapsed, queue_wait, max_rss
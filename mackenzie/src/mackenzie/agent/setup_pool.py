@@ -0,0 +1,61 @@
+"""Run task setups off the agent's main loop."""
+
+import json
+import logging
+from pathlib import Path
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+SetupTaskType = Callable[[Path, Any], tuple[Path, int, int]]
+
+# job_id, (sbatch_script_file, load, max_fails) or the exception raised
+SetupResultType = tuple[str, Optional[tuple[Path, int, int]], Optional[BaseException]]
+
+
+class SetupPool:
+    """Task setups running on an executor.
+
+    At most max_in_flight setups are submitted at a time;
+    the rest wait in the job table in the setup state.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        setup_root: Path,
+        type_setup_task: dict[str, SetupTaskType],
+        max_in_flight: int,
+    ):
+        self.executor = executor
+        self.setup_root = setup_root
+        self.type_setup_task = type_setup_task
+        self.max_in_flight = max_in_flight
+
+        self.in_flight: dict[str, Future] = {}
+
+    def has_room(self) -> bool:
+        return len(self.in_flight) < self.max_in_flight
+
+    def submit(self, job_id: str, job_type: str, job_data_json: str) -> None:
+        job_data = json.loads(job_data_json)
+        setup_task = self.type_setup_task[job_type]
+        future = self.executor.submit(setup_task, self.setup_root, job_data)
+        self.in_flight[job_id] = future
+        logger.info("job setup started: job_id=%r", job_id)
+
+    def pop_done(self) -> list[SetupResultType]:
+        """Remove and return the setups that have finished."""
+        done = []
+        for job_id, future in list(self.in_flight.items()):
+            if not future.done():
+                continue
+
+            del self.in_flight[job_id]
+            exc = future.exception()
+            if exc is not None:
+                done.append((job_id, None, exc))
+            else:
+                done.append((job_id, future.result(), None))
+        return done
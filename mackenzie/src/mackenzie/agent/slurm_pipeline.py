@@ -1,4 +1,25 @@
-"""Slurm Pipeline."""
+"""Slurm Pipeline.
+
+A job moves through the states
+
+    setup -> ready -> submitting -> running -> completed
+                                       |
+                                       v
+                                    failed -> setup or aborted
+
+Slurm commands and controller calls are never made inside a transaction
+of the job database. The rows a step needs are read up front,
+the external calls are made,
+and each state change is committed on its own right after the call it records.
+A crash thus loses at most the one transition in progress,
+which the next round redoes.
+
+The one call that can't simply be redone is sbatch.
+Jobs are submitted under their job id as the Slurm job name
+and are moved to submitting before the call.
+A job found in submitting was interrupted mid submit;
+Slurm is asked for jobs of that name before it is submitted again.
+"""
 
 import os
 import time
@@ -9,26 +30,41 @@ import logging
 from pathlib import Path
 from subprocess import run
 from functools import partial
+from concurrent.futures import Executor
 from typing import Callable, Optional, Any
 
 import apsw
+from more_itertools import chunked
 
 from ..db import job_db as jdb
 from ..controller.main import ControllerProxy
+from .sacct import parse_sacct_info, split_sacct_info, SacctStatsType
+from .setup_pool import SetupPool, SetupTaskType
 
 SBATCH_EXE = os.environ.get("SBATCH_EXE", "sbatch")
 SQUEUE_EXE = os.environ.get("SQUEUE_EXE", "squeue")
 SACCT_EXE = os.environ.get("SACCT_EXE", "sacct")
+SCANCEL_EXE = os.environ.get("SCANCEL_EXE", "scancel")
 USER = os.environ["USER"]
 
 COMMAND_RETRY_TIME = 30 * 60
 COMMAND_INTER_RETRY_TIME = 30
 COMMAND_TIMEOUT = 300
 
+# How far back sacct looks for jobs whose submit was interrupted
+SUBMIT_LOOKBACK = "now-7days"
+
+# Number of jobs to get the accounting of in one sacct call
+SACCT_CHUNK_SIZE = 100
+
+# Max fails of a job until its setup reports the actual value
 MAX_FAILS = 100
 
-SetupTaskType = Callable[[Path, Any], tuple[Path, int, int]]
+# Orphaned jobs whose task is in one of these states are cancelled
+FINISHED_TASK_STATES = ("completed", "processed", "cancelled")
+
 GetTaskResultType = Callable[[Path, Any], Optional[dict[str, Any]]]
+EstimateLoadType = Callable[[Any], int]
 
 logger = logging.getLogger(__name__)
 
@@ -122,6 +158,86 @@ def get_sacct_info(job_id: int) -> str:
                 raise
 
 
+def do_get_sacct_infos(job_ids: list[int]) -> dict[int, str]:
+    """Get the sacct info for several completed jobs in one call."""
+    job_ids_str = ",".join(str(j) for j in job_ids)
+    cmd = f"{SACCT_EXE} -j {job_ids_str} -o ALL -P"
+    cmd = shlex.split(cmd)
+
+    proc = run(cmd, capture_output=True, check=True, text=True, timeout=COMMAND_TIMEOUT)
+    return split_sacct_info(proc.stdout)
+
+
+def get_sacct_infos(job_ids: list[int]) -> dict[int, str]:
+    """Get the sacct info for several completed jobs.
+
+    The jobs are looked up SACCT_CHUNK_SIZE at a time.
+    A chunk whose call fails, and any job missing from the output,
+    falls back to the per job lookup which tolerates failures.
+    """
+    infos = {}
+    for chunk in chunked(job_ids, SACCT_CHUNK_SIZE):
+        try:
+            infos.update(do_get_sacct_infos(chunk))
+        except subprocess.CalledProcessError as e:
+            log_called_process_error(e)
+        except Exception as e:
+            logger.warning("batch_sacct_failed: num_jobs=%d", len(chunk), exc_info=e)
+
+    for job_id in job_ids:
+        if job_id not in infos:
+            infos[job_id] = get_sacct_info(job_id)
+    return infos
+
+
+def do_get_named_jobids(job_name: str) -> set[int]:
+    """Get the ids of the slurm jobs with the given name."""
+    name = shlex.quote(job_name)
+    cmd = f"{SQUEUE_EXE} -u {USER} --noheader -o %A --name={name}"
+    proc = run(
+        shlex.split(cmd),
+        capture_output=True,
+        check=True,
+        text=True,
+        timeout=COMMAND_TIMEOUT,
+    )
+    job_ids = set(int(j) for j in proc.stdout.strip().split())
+
+    # Jobs that have already left the queue
+    cmd = (
+        f"{SACCT_EXE} -u {USER} -X -n -P -o JobID"
+        f" -S {SUBMIT_LOOKBACK} --name={name}"
+    )
+    proc = run(
+        shlex.split(cmd),
+        capture_output=True,
+        check=True,
+        text=True,
+        timeout=COMMAND_TIMEOUT,
+    )
+    job_ids.update(int(j) for j in proc.stdout.strip().split() if j.isdigit())
+    return job_ids
+
+
+def get_named_jobids(job_name: str) -> set[int]:
+    """Get the ids of the slurm jobs with the given name; Tolerate failures."""
+    start_time = time.monotonic()
+    do_handle_exception = partial(handle_exception, start_time)
+    while True:
+        try:
+            return do_get_named_jobids(job_name)
+        except subprocess.CalledProcessError as e:
+            log_called_process_error(e)
+
+            do_reraise = do_handle_exception("job_lookup_failed", exc_info=None)
+            if do_reraise:
+                raise
+        except Exception as e:
+            do_reraise = do_handle_exception("job_lookup_failed", exc_info=e)
+            if do_reraise:
+                raise
+
+
 def do_submit_sbatch_job(sbatch_cmd_str: str, sbatch_env: dict[str, str]) -> int:
     """Submit a sbatch job."""
     cmd = shlex.split(sbatch_cmd_str)
@@ -168,13 +284,65 @@ def submit_sbatch_job(sbatch_cmd_str: str, sbatch_env: dict[str, str] = {}) -> i
                 raise
 
 
+def cancel_slurm_job(slurm_job_id: int) -> None:
+    """Cancel a slurm job; Failures are only logged."""
+    cmd = f"{SCANCEL_EXE} {slurm_job_id}"
+    cmd = shlex.split(cmd)
+
+    try:
+        run(cmd, check=True, capture_output=True, text=True, timeout=COMMAND_TIMEOUT)
+    except subprocess.CalledProcessError as e:
+        log_called_process_error(e)
+    except Exception as e:
+        logger.warning("scancel_failed: slurm_job_id=%r", slurm_job_id, exc_info=e)
+
+
+def get_task_results(
+    executor: Executor,
+    setup_root: Path,
+    type_get_task_result: dict[str, GetTaskResultType],
+    jobs: list[tuple[str, str]],
+) -> list[Optional[dict[str, Any]]]:
+    """Get the results of the (job_type, job_data_json) jobs on the executor."""
+    futures = []
+    for job_type, job_data_json in jobs:
+        job_data = json.loads(job_data_json)
+        get_task_result = type_get_task_result[job_type]
+        futures.append(executor.submit(get_task_result, setup_root, job_data))
+    return [future.result() for future in futures]
+
+
+def set_slurm_job_finished(
+    con: apsw.Connection,
+    end_time: int,
+    slurm_job_id: int,
+    sacct_info: str,
+    task_stats: SacctStatsType,
+) -> None:
+    elapsed, queue_wait, max_rss = task_stats
+    jdb.set_slurm_job_completion_info(
+        con=con,
+        slurm_job_id=slurm_job_id,
+        end_time=end_time,
+        sacct_info=sacct_info,
+        elapsed=elapsed,
+        queue_wait=queue_wait,
+        max_rss=max_rss,
+    )
+
+
 def process_running(
     con: apsw.Connection,
     setup_root: Path,
     controller: ControllerProxy,
     type_get_task_result: dict[str, GetTaskResultType],
+    executor: Executor,
 ) -> None:
-    """Process the tasks that are running."""
+    """Process the tasks that are running.
+
+    The results of the finished jobs are checked in parallel on the executor;
+    the controller is then told of all the completed tasks at once.
+    """
     running_jobids = get_running_jobids()
 
     sql = """
@@ -182,49 +350,70 @@ def process_running(
         from job
         where job_state = 'running'
         """
-    cur = con.execute(sql)
-
-    cur_time = int(time.time())
-    for job_id, job_type, job_data_json, slurm_job_id in cur:
-        if slurm_job_id in running_jobids:
-            continue
+    finished_jobs = [
+        (job_id, job_type, job_data_json, slurm_job_id)
+        for job_id, job_type, job_data_json, slurm_job_id in con.execute(sql)
+        if slurm_job_id not in running_jobids
+    ]
+    if not finished_jobs:
+        return
 
-        sacct_info = get_sacct_info(slurm_job_id)
-        jdb.set_slurm_job_completion_info(con, slurm_job_id, cur_time, sacct_info)
+    sacct_infos = get_sacct_infos([job[3] for job in finished_jobs])
+    job_results = get_task_results(
+        executor=executor,
+        setup_root=setup_root,
+        type_get_task_result=type_get_task_result,
+        jobs=[(job[1], job[2]) for job in finished_jobs],
+    )
 
-        job_data = json.loads(job_data_json)
-        get_task_result = type_get_task_result[job_type]
-        job_result = get_task_result(setup_root, job_data)
+    cur_time = int(time.time())
+    completed_jobs = []
+    failed_jobs = []
+    for (job_id, _, _, slurm_job_id), job_result in zip(finished_jobs, job_results):
+        sacct_info = sacct_infos[slurm_job_id]
+        task_stats = parse_sacct_info(slurm_job_id, sacct_info)
         if job_result is not None:
             job_result_json = json.dumps(job_result)
-            controller.set_task_completed(
-                task_id=job_id, task_result_json=job_result_json
+            completed_jobs.append(
+                (job_id, job_result_json, slurm_job_id, sacct_info, task_stats)
             )
+        else:
+            failed_jobs.append((job_id, slurm_job_id, sacct_info, task_stats))
+
+    # If we crash before the jobs are marked completed
+    # they are found finished again and reported a second time,
+    # which the controller ignores.
+    if completed_jobs:
+        controller.set_tasks_completed(
+            [(job[0], job[1], job[4]) for job in completed_jobs]
+        )
+
+    for job_id, job_result_json, slurm_job_id, sacct_info, task_stats in completed_jobs:
+        with con:
+            set_slurm_job_finished(con, cur_time, slurm_job_id, sacct_info, task_stats)
             jdb.set_job_completed(con, job_id, job_result_json)
-            logger.info(
-                "job completed: job_id=%r slurm_job_id=%r", job_id, slurm_job_id
-            )
-            continue
+        logger.info("job completed: job_id=%r", job_id)
 
-        jdb.set_job_failed(con, job_id)
+    for job_id, slurm_job_id, sacct_info, task_stats in failed_jobs:
+        with con:
+            set_slurm_job_finished(con, cur_time, slurm_job_id, sacct_info, task_stats)
+            jdb.set_job_failed(con, job_id)
         logger.warning("job failed: job_id=%r slurm_job_i=%r", job_id, slurm_job_id)
 
 
-def process_failed(
-    con: apsw.Connection,
-    setup_root: Path,
-    controller: ControllerProxy,
-    type_setup_task: dict[str, SetupTaskType],
-) -> None:
-    """Process the tasks currently in failed state."""
+def process_failed(con: apsw.Connection, controller: ControllerProxy) -> None:
+    """Process the tasks currently in failed state.
+
+    Jobs that have not failed too often are set up again.
+    """
     sql = """
-        select job_id, job_type, job_data, failure_count, max_fails
+        select job_id, failure_count, max_fails
         from job
         where job_state = 'failed'
         """
-    cur = con.execute(sql)
+    failed_jobs = con.execute(sql).fetchall()
 
-    for job_id, job_type, job_data_json, failure_count, max_fails in cur:
+    for job_id, failure_count, max_fails in failed_jobs:
         if failure_count > max_fails:
             controller.set_task_failed(task_id=job_id)
             jdb.set_job_aborted(con, job_id=job_id)
@@ -233,15 +422,92 @@ def process_failed(
             )
             continue
 
-        job_data = json.loads(job_data_json)
-        setup_task = type_setup_task[job_type]
-        (
-            sbatch_script_file,
-            _,
-            _,
-        ) = setup_task(setup_root, job_data)
-        jdb.set_job_ready(con=con, job_id=job_id, sbatch_script=str(sbatch_script_file))
-        logger.info("job ready: job_id=%r failure_count=%r", job_id, failure_count)
+        jdb.set_job_setup(con, job_id=job_id)
+        logger.info("job retrying: job_id=%r failure_count=%r", job_id, failure_count)
+
+
+def set_job_setup_done(
+    con: apsw.Connection,
+    job_id: str,
+    setup_result: Optional[tuple[Path, int, int]],
+    exc: Optional[BaseException],
+) -> None:
+    """Move a job out of the setup state once its setup has finished."""
+    match jdb.get_job_state(con, job_id):
+        case ("setup", _):
+            pass
+        case other:
+            logger.info("job setup discarded: job_id=%r state=%r", job_id, other)
+            return
+
+    if exc is not None or setup_result is None:
+        jdb.set_job_failed(con, job_id)
+        logger.warning("job setup failed: job_id=%r", job_id, exc_info=exc)
+        return
+
+    sbatch_script_file, load, max_fails = setup_result
+    jdb.set_job_ready(
+        con=con,
+        job_id=job_id,
+        sbatch_script=str(sbatch_script_file),
+        load=load,
+        max_fails=max_fails,
+    )
+    logger.info("job ready: job_id=%r", job_id)
+
+
+def process_setup(con: apsw.Connection, setup_pool: SetupPool) -> None:
+    """Collect the finished task setups and start new ones.
+
+    A job only becomes ready once its setup has finished;
+    a setup that raised counts as a failure of the job.
+    Setups of jobs that have left the setup state meanwhile,
+    for example because they were aborted, are discarded.
+    """
+    for job_id, setup_result, exc in setup_pool.pop_done():
+        with con:
+            set_job_setup_done(con, job_id, setup_result, exc)
+
+    for job_id, job_type, job_data_json in jdb.get_setup_jobs(con):
+        if not setup_pool.has_room():
+            break
+        if job_id in setup_pool.in_flight:
+            continue
+        setup_pool.submit(job_id, job_type, job_data_json)
+
+
+def set_job_submitted(con: apsw.Connection, job_id: str, slurm_job_id: int) -> None:
+    cur_time = int(time.time())
+    with con:
+        jdb.set_job_running(con, job_id, slurm_job_id)
+        jdb.add_slurm_job(con, slurm_job_id, job_id, cur_time)
+    logger.info("job running: job_id=%r slurm_job_id=%r", job_id, slurm_job_id)
+
+
+def process_submitting(con: apsw.Connection) -> None:
+    """Resolve the jobs whose submit was interrupted by a crash.
+
+    A slurm job with the job's name that is not yet recorded
+    is the one the interrupted submit made; the job is marked running with it.
+    If there is none the submit never reached Slurm
+    and the job goes back to ready.
+    """
+    for job_id in jdb.get_submitting_job_ids(con):
+        known = set(jdb.get_slurm_job_ids(con, job_id))
+        found = sorted(get_named_jobids(job_id) - known)
+        if not found:
+            jdb.set_job_submit_lost(con, job_id)
+            logger.warning("job submit lost: job_id=%r", job_id)
+            continue
+
+        # Only one submit can have been interrupted; keep the latest
+        slurm_job_id = found[-1]
+        for extra_slurm_job_id in found[:-1]:
+            cancel_slurm_job(extra_slurm_job_id)
+        logger.warning(
+            "job submit recovered: job_id=%r slurm_job_id=%r", job_id, slurm_job_id
+        )
+        set_job_submitted(con, job_id, slurm_job_id)
 
 
 def process_ready(con: apsw.Connection, max_load: int) -> None:
@@ -254,52 +520,122 @@ def process_ready(con: apsw.Connection, max_load: int) -> None:
         where job_state = 'ready'
         order by job_priority desc, load desc, job_id asc
         """
-    cur = con.execute(sql)
+    ready_jobs = con.execute(sql).fetchall()
 
-    for job_id, sbatch_script, load in cur:
+    for job_id, sbatch_script, load in ready_jobs:
         if cur_load + load > max_load:
             break
 
         cur_load = cur_load + load
 
-        cmd = f"{SBATCH_EXE} {sbatch_script}"
+        # See process_submitting for a crash between here and the commit
+        jdb.set_job_submitting(con, job_id)
+        cmd = f"{SBATCH_EXE} --job-name={shlex.quote(job_id)} {sbatch_script}"
         slurm_job_id = submit_sbatch_job(cmd)
-        jdb.set_job_running(con, job_id, slurm_job_id)
+        set_job_submitted(con, job_id, slurm_job_id)
 
-        cur_time = int(time.time())
-        jdb.add_slurm_job(con, slurm_job_id, job_id, cur_time)
 
-        logger.info("job running: job_id=%r slurm_job_id=%r", job_id, slurm_job_id)
+def renew_leases(
+    con: apsw.Connection, controller: ControllerProxy, cluster: str
+) -> None:
+    """Renew the controller leases of all live jobs.
+
+    Jobs whose task is no longer assigned to this cluster
+    are reported as orphaned; another cluster may be running them too.
+    Orphaned jobs whose task has already finished elsewhere are cancelled.
+    """
+    job_ids = jdb.get_live_job_ids(con)
+    if not job_ids:
+        return
+
+    orphans = controller.renew_task_leases(cluster=cluster, task_ids=job_ids)
+    for job_id, task_state in orphans:
+        if task_state not in FINISHED_TASK_STATES:
+            logger.warning("job orphaned: job_id=%r task_state=%r", job_id, task_state)
+            continue
+
+        match jdb.get_job_state(con, job_id):
+            case ("running", slurm_job_id) if slurm_job_id is not None:
+                cancel_slurm_job(slurm_job_id)
+        jdb.set_job_aborted(con, job_id)
+        logger.info("job cancelled: job_id=%r task_state=%r", job_id, task_state)
+
+
+def estimate_load(
+    type_estimate_load: dict[str, EstimateLoadType], job_type: str, job_data_json: str
+) -> Optional[int]:
+    """Estimate the load of a job before its setup; None if unknown."""
+    if job_type not in type_estimate_load:
+        return None
+
+    try:
+        return type_estimate_load[job_type](json.loads(job_data_json))
+    except Exception as e:
+        logger.warning("load estimate failed: job_type=%r", job_type, exc_info=e)
+        return None
 
 
 def process_new(
     con: apsw.Connection,
-    setup_root: Path,
     controller: ControllerProxy,
     cluster: str,
     max_load: int,
-    type_setup_task: dict[str, SetupTaskType],
+    claim_batch_size: int,
+    default_load: int,
+    type_estimate_load: dict[str, EstimateLoadType],
+    localities: Optional[list[str]] = None,
 ) -> None:
-    """Get and process new tasks from the controller."""
-    cur_load = jdb.get_live_load(con)
-    if cur_load >= max_load:
-        return
-
-    match controller.get_single_available_task(cluster):
-        case None:
+    """Get new tasks from the controller and queue them for setup.
+
+    Keep claiming batches of tasks until the free load is used up
+    or the controller has no more tasks to give.
+    The load of a job is estimated when it is claimed
+    and replaced by the load its setup reports.
+    Jobs without an estimate are assumed to be as large as the largest live job,
+    or default_load if no load is known yet,
+    and each claim is sized so that tasks of that size fit in the free load.
+    While no load is known tasks are claimed one at a time.
+    If localities is given, only tasks that can use them are claimed.
+    """
+    while True:
+        known_load = jdb.get_max_live_load(con)
+        task_load = max(known_load or 0, default_load)
+        free_load = max_load - jdb.get_live_load(con, unknown_load=task_load)
+        max_count = free_load // task_load
+        if max_count <= 0:
             return
-        case (job_id, job_type, job_data_json, job_priority):
-            job_data = json.loads(job_data_json)
-            setup_task = type_setup_task[job_type]
-            sbatch_script_file, load, max_fails = setup_task(setup_root, job_data)
-            jdb.add_job(
-                con=con,
-                job_id=job_id,
-                job_type=job_type,
-                job_data=job_data_json,
-                job_priority=job_priority,
-                sbatch_script=str(sbatch_script_file),
-                load=load,
-                max_fails=max_fails,
-            )
-            logger.info("job ready: job_id=%r", job_id)
+        if known_load is None:
+            # Claim one task so that its estimate sizes the next claim
+            max_count = 1
+
+        tasks = controller.get_available_tasks(
+            cluster=cluster,
+            max_count=min(max_count, claim_batch_size),
+            load_budget=free_load,
+            localities=localities,
+        )
+        if not tasks:
+            return
+
+        loads = [
+            estimate_load(type_estimate_load, job_type, job_data_json)
+            for _, job_type, job_data_json, _ in tasks
+        ]
+
+        # Claimed tasks lost to a crash before this commit
+        # are handed out again once their lease expires.
+        with con:
+            for (job_id, job_type, job_data_json, job_priority), load in zip(
+                tasks, loads
+            ):
+                jdb.add_job(
+                    con=con,
+                    job_id=job_id,
+                    job_type=job_type,
+                    job_data=job_data_json,
+                    job_priority=job_priority,
+                    load=load,
+                    max_fails=MAX_FAILS,
+                )
+        for (job_id, *_), load in zip(tasks, loads):
+            logger.info("job added: job_id=%r load=%r", job_id, load)
@@ -0,0 +1,109 @@
+"""Benchmark task claims against queues of different sizes."""
+
+import time
+import random
+import tempfile
+import statistics
+from pathlib import Path
+
+import apsw
+import click
+from rich.console import Console
+from rich.table import Table
+from more_itertools import chunked
+
+from ..db import task_db as tdb
+from ..controller import controller as ctrl
+from ..controller.config import ControllerConfig
+from ..controller.dispatch import DispatchIndex
+from .common import percentile
+
+INSERT_CHUNK_SIZE = 10000
+
+
+def fill_queue(con: apsw.Connection, queue_size: int) -> None:
+    """Add queue_size available tasks with random priorities."""
+    rng = random.Random(queue_size)
+    tasks = (
+        (f"task:{i}", "bench", "{}", rng.randrange(-1000000, 1000000), None, None, "")
+        for i in range(queue_size)
+    )
+    for chunk in chunked(tasks, INSERT_CHUNK_SIZE):
+        with con:
+            tdb.add_new_tasks(con, chunk)
+
+
+def time_claims(
+    con: apsw.Connection, num_claims: int, batch_size: int
+) -> list[float]:
+    """Time claims the same way the controller does, one transaction each."""
+    # Claims only need the settings of the dispatch path
+    config = ControllerConfig.construct(locality_fallback=False)
+    dispatch = DispatchIndex(queue_weights={}, default_queue_weight=1)
+    dispatch.load(con)
+
+    latencies = []
+    for _ in range(num_claims):
+        start = time.perf_counter()
+        with con:
+            ctrl.get_available_tasks(
+                config=config,
+                db_con=con,
+                dispatch=dispatch,
+                cluster="bench",
+                max_count=batch_size,
+                load_budget=batch_size,
+            )
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+@click.command()
+@click.option(
+    "-q",
+    "--queue-sizes",
+    default="1000,10000,100000,1000000",
+    show_default=True,
+    help="Comma separated list of queue sizes.",
+)
+@click.option(
+    "-n",
+    "--num-claims",
+    type=int,
+    default=1000,
+    show_default=True,
+    help="Number of claims to time per queue size.",
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of tasks assigned per claim.",
+)
+def claim(queue_sizes: str, num_claims: int, batch_size: int):
+    """Measure claim latency as the task queue grows."""
+    table = Table(title="Claim latency")
+    for col in ["queue size", "mean (ms)", "p50 (ms)", "p99 (ms)"]:
+        table.add_column(col, justify="right")
+
+    for queue_size in [int(q) for q in queue_sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            con = apsw.Connection(str(Path(tmp_dir) / "controller.db"))
+            tdb.init_task_db(con)
+
+            click.secho(f"filling queue: queue_size={queue_size}", fg="yellow")
+            fill_queue(con, queue_size)
+
+            latencies = time_claims(con, num_claims, batch_size)
+            latencies = [x * 1000 for x in latencies]
+            table.add_row(
+                str(queue_size),
+                f"{statistics.mean(latencies):.3f}",
+                f"{percentile(latencies, 50):.3f}",
+                f"{percentile(latencies, 99):.3f}",
+            )
+            con.close()
+
+    Console().print(table)
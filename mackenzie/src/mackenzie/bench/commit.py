@@ -0,0 +1,146 @@
+"""Benchmark per RPC commits against group commits."""
+
+import time
+import tempfile
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Callable
+
+import apsw
+import click
+from rich.console import Console
+from rich.table import Table
+
+from ..db import task_db as tdb
+from ..controller import controller as ctrl
+from ..controller.config import ControllerConfig
+from ..controller.db_pool import open_db
+from ..controller.dispatch import DispatchIndex
+from ..controller.writer import WriteQueue
+
+
+def make_db(db_path: str, num_tasks: int, synchronous: str) -> apsw.Connection:
+    """Create a controller database with num_tasks assigned tasks."""
+    con = open_db(db_path, cache_size=64, readonly=False)
+    con.execute(f"pragma synchronous={synchronous};")
+    tdb.init_task_db(con)
+    with con:
+        tasks = [(f"task:{i}", "bench", "{}", 0, None, None, "") for i in range(num_tasks)]
+        tdb.add_new_tasks(con, tasks)
+
+    dispatch = DispatchIndex(queue_weights={}, default_queue_weight=1)
+    dispatch.load(con)
+    with con:
+        ctrl.get_available_tasks(
+            config=ControllerConfig.construct(locality_fallback=False),
+            db_con=con,
+            dispatch=dispatch,
+            cluster="bench",
+            max_count=num_tasks,
+            load_budget=num_tasks,
+        )
+    return con
+
+
+def run_threads(num_threads: int, num_ops: int, do_op: Callable[[int], None]) -> float:
+    """Run num_ops operations split across num_threads; return ops per second."""
+
+    def worker(thread_idx: int) -> None:
+        for i in range(thread_idx, num_ops, num_threads):
+            do_op(i)
+
+    threads = [Thread(target=worker, args=(t,)) for t in range(num_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return num_ops / (time.perf_counter() - start)
+
+
+def bench_locked(db_path: str, num_threads: int, num_ops: int, synchronous: str) -> float:
+    """Every operation commits its own transaction under a global lock."""
+    con = make_db(db_path, num_ops, synchronous)
+    lock = Lock()
+
+    def do_op(i: int) -> None:
+        with lock:
+            with con:
+                tdb.set_task_completed(con, f"task:{i}", "{}", 0)
+
+    ops_per_sec = run_threads(num_threads, num_ops, do_op)
+    con.close()
+    return ops_per_sec
+
+
+def bench_group_commit(
+    db_path: str,
+    num_threads: int,
+    num_ops: int,
+    synchronous: str,
+    commit_interval: float,
+) -> float:
+    """Operations are committed in groups by the write queue."""
+    con = make_db(db_path, num_ops, synchronous)
+    write_queue = WriteQueue(con, commit_interval=commit_interval, max_batch=1000)
+
+    def do_op(i: int) -> None:
+        write_queue.execute(
+            lambda con: tdb.set_task_completed(con, f"task:{i}", "{}", 0)
+        )
+
+    return run_threads(num_threads, num_ops, do_op)
+
+
+@click.command()
+@click.option(
+    "-t",
+    "--num-threads",
+    type=int,
+    default=32,
+    show_default=True,
+    help="Number of concurrent clients.",
+)
+@click.option(
+    "-n",
+    "--num-ops",
+    type=int,
+    default=10000,
+    show_default=True,
+    help="Total number of task completions.",
+)
+@click.option(
+    "-s",
+    "--synchronous",
+    type=click.Choice(["normal", "full"]),
+    default="normal",
+    show_default=True,
+    help="SQLite synchronous setting.",
+)
+@click.option(
+    "-i",
+    "--commit-interval",
+    type=float,
+    default=0.002,
+    show_default=True,
+    help="Group commit interval in seconds.",
+)
+def commit(num_threads: int, num_ops: int, synchronous: str, commit_interval: float):
+    """Measure commits per second with and without group commit."""
+    table = Table(title="Task completions committed")
+    for col in ["writer", "commits/s"]:
+        table.add_column(col, justify="right")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = str(Path(tmp_dir) / "locked.db")
+        ops_per_sec = bench_locked(db_path, num_threads, num_ops, synchronous)
+        table.add_row("global lock", f"{ops_per_sec:.0f}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = str(Path(tmp_dir) / "group_commit.db")
+        ops_per_sec = bench_group_commit(
+            db_path, num_threads, num_ops, synchronous, commit_interval
+        )
+        table.add_row("group commit", f"{ops_per_sec:.0f}")
+
+    Console().print(table)
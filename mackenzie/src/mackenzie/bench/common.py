@@ -0,0 +1,92 @@
+"""Helpers for benchmarks that run a real controller."""
+
+import os
+import sys
+import time
+import shlex
+import socket
+import statistics
+from pathlib import Path
+from contextlib import contextmanager
+from subprocess import run, Popen, DEVNULL
+from typing import Iterator
+
+CONTROLLER_START_TIMEOUT = 30
+
+
+def percentile(xs: list[float], q: int) -> float:
+    return statistics.quantiles(xs, n=100)[q - 1]
+
+
+def make_certs(work_dir: Path) -> tuple[Path, Path]:
+    """Create a key and certificate pair; return the key and cert files."""
+    cmd = f"""
+        openssl req -newkey rsa:2048
+        -x509
+        -sha256
+        -days 1
+        -nodes
+        -out '{work_dir}/common.crt'
+        -keyout '{work_dir}/common.key'
+        -subj '/CN=common'
+    """
+    cmd = shlex.split(cmd)
+    run(cmd, check=True, stdout=DEVNULL, stderr=DEVNULL)
+    return work_dir / "common.key", work_dir / "common.crt"
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float) -> None:
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Controller did not start listening on port {port}")
+
+
+@contextmanager
+def run_controller(
+    work_dir: Path, transport: str, extra_env: dict[str, str] = {}
+) -> Iterator[dict]:
+    """Run a controller in a subprocess; yield the kwargs of ControllerProxy."""
+    key_file, cert_file = make_certs(work_dir)
+    setup_root = work_dir / "controller_setup_root"
+    setup_root.mkdir()
+    port = get_free_port()
+
+    env = dict(os.environ)
+    env.update(
+        CONTROLLER_KEY_FILE=str(key_file),
+        CONTROLLER_CERT_FILE=str(cert_file),
+        CONTROLLER_SETUP_ROOT=str(setup_root),
+        CONTROLLER_TASK_TIMEOUT="3600",
+        CONTROLLER_CONTROLLER_HOST="127.0.0.1",
+        CONTROLLER_CONTROLLER_PORT=str(port),
+        CONTROLLER_CONTROLLER_TRANSPORT=transport,
+    )
+    env.update(extra_env)
+
+    log_file = open(work_dir / "controller.log", "wb")
+    cmd = [sys.executable, "-m", "mackenzie.cli", "controller"]
+    proc = Popen(cmd, env=env, stdout=log_file, stderr=log_file)
+    try:
+        wait_for_port(port, CONTROLLER_START_TIMEOUT)
+        yield dict(
+            host="127.0.0.1",
+            port=port,
+            key_file=str(key_file),
+            cert_file=str(cert_file),
+            transport=transport,
+        )
+    finally:
+        proc.terminate()
+        proc.wait()
+        log_file.close()
@@ -0,0 +1,272 @@
+"""Load test a controller with simulated agents and task sources."""
+
+import time
+import tempfile
+from pathlib import Path
+from collections import defaultdict
+from threading import Barrier, Event, Lock, Thread
+from typing import Any, Callable
+
+import click
+from rich.console import Console
+from rich.table import Table
+from more_itertools import chunked
+
+from ..controller.main import ControllerProxy
+from .common import percentile, run_controller
+
+FILL_CHUNK_SIZE = 10000
+POLL_LIMIT = 1000
+POLL_WAIT_TIME = 0.1
+
+
+class RpcTimes:
+    """Latencies of the calls made to the controller by method."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+
+    def call(self, method: str, func: Callable, *args, **kwargs) -> Any:
+        start = time.perf_counter()
+        ret = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[method].append(elapsed)
+        return ret
+
+
+def make_task(source_idx: int, task_idx: int) -> tuple:
+    return (
+        f"load:{source_idx}:{task_idx}",
+        f"load:{source_idx}",
+        "{}",
+        0,
+        None,
+        None,
+        f"load:{source_idx}",
+    )
+
+
+def fill_queue(proxy_kwargs: dict, queue_size: int, num_sources: int) -> None:
+    """Add queue_size available tasks spread over the task sources."""
+    controller = ControllerProxy(**proxy_kwargs)
+    tasks = (make_task(i % num_sources, i) for i in range(queue_size))
+    for chunk in chunked(tasks, FILL_CHUNK_SIZE):
+        controller.add_new_tasks(chunk)
+    controller.close()
+
+
+def run_agent(
+    proxy_kwargs: dict,
+    agent_idx: int,
+    batch_size: int,
+    barrier: Barrier,
+    stop: Event,
+    times: RpcTimes,
+) -> None:
+    """Renew, complete and claim tasks like an agent that runs them instantly."""
+    controller = ControllerProxy(**proxy_kwargs)
+    cluster = f"load:{agent_idx}"
+    running: list[str] = []
+    barrier.wait()
+
+    while not stop.is_set():
+        times.call("renew_task_leases", controller.renew_task_leases, cluster, running)
+        for task_id in running:
+            times.call(
+                "set_task_completed", controller.set_task_completed, task_id, "{}"
+            )
+
+        tasks = times.call(
+            "get_available_tasks",
+            controller.get_available_tasks,
+            cluster,
+            batch_size,
+            batch_size,
+        )
+        running = [task[0] for task in tasks]
+        if not running:
+            time.sleep(POLL_WAIT_TIME)
+
+    controller.close()
+
+
+def run_source(
+    proxy_kwargs: dict,
+    source_idx: int,
+    next_task_idx: int,
+    barrier: Barrier,
+    stop: Event,
+    times: RpcTimes,
+    num_processed: list[int],
+) -> None:
+    """Poll completions, mark them processed and replace them with new tasks."""
+    controller = ControllerProxy(**proxy_kwargs)
+    task_type = f"load:{source_idx}"
+    seq = 0
+    barrier.wait()
+
+    while not stop.is_set():
+        completed = times.call(
+            "get_completed_since",
+            controller.get_completed_since,
+            seq,
+            POLL_LIMIT,
+            task_type,
+        )
+        if not completed:
+            time.sleep(POLL_WAIT_TIME)
+            continue
+
+        new_tasks = []
+        for completed_seq, task_id, *_ in completed:
+            seq = max(seq, completed_seq)
+            times.call("set_task_processed", controller.set_task_processed, task_id)
+            new_tasks.append(make_task(source_idx, next_task_idx))
+            next_task_idx += 1
+        times.call("add_new_tasks", controller.add_new_tasks, new_tasks)
+        num_processed.append(len(completed))
+
+    controller.close()
+
+
+def bench_load(
+    queue_size: int,
+    num_agents: int,
+    num_sources: int,
+    batch_size: int,
+    duration: float,
+    transport: str,
+) -> tuple[float, RpcTimes]:
+    """Return the processed tasks per second and the RPC latencies."""
+    times = RpcTimes()
+    num_processed: list[int] = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with run_controller(Path(tmp_dir), transport) as proxy_kwargs:
+            fill_queue(proxy_kwargs, queue_size, num_sources)
+
+            barrier = Barrier(num_agents + num_sources + 1)
+            stop = Event()
+            threads = [
+                Thread(
+                    target=run_agent,
+                    args=(proxy_kwargs, idx, batch_size, barrier, stop, times),
+                )
+                for idx in range(num_agents)
+            ]
+            threads += [
+                Thread(
+                    target=run_source,
+                    args=(
+                        proxy_kwargs,
+                        idx,
+                        queue_size,
+                        barrier,
+                        stop,
+                        times,
+                        num_processed,
+                    ),
+                )
+                for idx in range(num_sources)
+            ]
+            for thread in threads:
+                thread.start()
+
+            barrier.wait()
+            start = time.perf_counter()
+            time.sleep(duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+    return sum(num_processed) / elapsed, times
+
+
+@click.command()
+@click.option(
+    "-q",
+    "--queue-sizes",
+    default="1000,10000,100000,1000000",
+    show_default=True,
+    help="Comma separated list of queue sizes.",
+)
+@click.option(
+    "-a",
+    "--num-agents",
+    type=int,
+    default=8,
+    show_default=True,
+    help="Number of simulated agents.",
+)
+@click.option(
+    "-s",
+    "--num-sources",
+    type=int,
+    default=2,
+    show_default=True,
+    help="Number of simulated task sources.",
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Number of tasks an agent claims at a time.",
+)
+@click.option(
+    "-d",
+    "--duration",
+    type=float,
+    default=30.0,
+    show_default=True,
+    help="Seconds to run the load for, per queue size.",
+)
+@click.option(
+    "-t",
+    "--transport",
+    type=click.Choice(["rpyc", "framed"]),
+    default="rpyc",
+    show_default=True,
+    help="Controller transport.",
+)
+def load(
+    queue_sizes: str,
+    num_agents: int,
+    num_sources: int,
+    batch_size: int,
+    duration: float,
+    transport: str,
+):
+    """Drive a controller with simulated agents and task sources."""
+    throughput = Table(title="Throughput")
+    for col in ["queue size", "tasks/s"]:
+        throughput.add_column(col, justify="right")
+
+    latency = Table(title="RPC latency")
+    for col in ["queue size", "method", "calls", "p50 (ms)", "p99 (ms)"]:
+        latency.add_column(col, justify="right")
+
+    for queue_size in [int(q) for q in queue_sizes.split(",")]:
+        click.secho(f"running: queue_size={queue_size}", fg="yellow")
+        tasks_per_sec, times = bench_load(
+            queue_size, num_agents, num_sources, batch_size, duration, transport
+        )
+        throughput.add_row(str(queue_size), f"{tasks_per_sec:.0f}")
+        for method, latencies in sorted(times.latencies.items()):
+            if len(latencies) < 2:
+                continue
+            latencies = [x * 1000 for x in latencies]
+            latency.add_row(
+                str(queue_size),
+                method,
+                str(len(latencies)),
+                f"{percentile(latencies, 50):.3f}",
+                f"{percentile(latencies, 99):.3f}",
+            )
+
+    console = Console()
+    console.print(throughput)
+    console.print(latency)
@@ -0,0 +1,19 @@
+"""Benchmarks for the MacKenzie controller."""
+
+import click
+
+from .claim import claim
+from .commit import commit
+from .load import load
+from .transport import transport
+
+
+@click.group()
+def bench():
+    """Benchmarks for the MacKenzie controller."""
+
+
+bench.add_command(claim)
+bench.add_command(commit)
+bench.add_command(load)
+bench.add_command(transport)
@@ -0,0 +1,108 @@
+"""Benchmark the rpyc and framed controller transports."""
+
+import time
+import tempfile
+from pathlib import Path
+from threading import Barrier, Thread
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+from ..controller.main import ControllerProxy
+from .common import percentile, run_controller
+
+
+def run_client(
+    proxy_kwargs: dict,
+    client_idx: int,
+    num_rounds: int,
+    barrier: Barrier,
+    latencies: list[float],
+) -> None:
+    """Add, claim and complete one task per round like a tiny agent."""
+    controller = ControllerProxy(**proxy_kwargs)
+    cluster = f"cluster:{client_idx}"
+    barrier.wait()
+
+    for i in range(num_rounds):
+        task_id = f"task:{client_idx}:{i}"
+        start = time.perf_counter()
+        controller.add_new_tasks([(task_id, "bench", "{}", 0, None, None, "")])
+        for task in controller.get_available_tasks(cluster, 1, 1):
+            controller.set_task_completed(task[0], "{}")
+        latencies.append(time.perf_counter() - start)
+
+    controller.close()
+
+
+def bench_transport(
+    transport: str, num_clients: int, num_rounds: int
+) -> tuple[float, list[float]]:
+    """Return the rounds per second and the round latencies."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with run_controller(Path(tmp_dir), transport) as proxy_kwargs:
+            barrier = Barrier(num_clients + 1)
+            latencies: list[float] = []
+            threads = [
+                Thread(
+                    target=run_client,
+                    args=(proxy_kwargs, idx, num_rounds, barrier, latencies),
+                )
+                for idx in range(num_clients)
+            ]
+            for thread in threads:
+                thread.start()
+
+            barrier.wait()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+    return len(latencies) / elapsed, latencies
+
+
+@click.command()
+@click.option(
+    "-c",
+    "--num-clients",
+    default="1,10,100",
+    show_default=True,
+    help="Comma separated list of the number of concurrent clients.",
+)
+@click.option(
+    "-n",
+    "--num-rounds",
+    type=int,
+    default=100,
+    show_default=True,
+    help="Number of add/claim/complete rounds per client.",
+)
+@click.option(
+    "-t",
+    "--transports",
+    default="rpyc,framed",
+    show_default=True,
+    help="Comma separated list of transports.",
+)
+def transport(num_clients: str, num_rounds: int, transports: str):
+    """Compare the controller transports under concurrent clients."""
+    table = Table(title="Controller transports")
+    for col in ["transport", "clients", "rounds/s", "p50 (ms)", "p99 (ms)"]:
+        table.add_column(col, justify="right")
+
+    for n in [int(c) for c in num_clients.split(",")]:
+        for t in transports.split(","):
+            click.secho(f"running: transport={t}, clients={n}", fg="yellow")
+            rounds_per_sec, latencies = bench_transport(t, n, num_rounds)
+            latencies = [x * 1000 for x in latencies]
+            table.add_row(
+                t,
+                str(n),
+                f"{rounds_per_sec:.0f}",
+                f"{percentile(latencies, 50):.3f}",
+                f"{percentile(latencies, 99):.3f}",
+            )
+
+    Console().print(table)
@@ -8,6 +8,8 @@ import click
 from .makecert import makecert
 from .controller.main import controller
 from .cmd.main import add_setup
+from .cmd.top import top
+from .bench.main import bench
 
 
 @click.group()
@@ -23,6 +25,8 @@ def cli():
 cli.add_command(makecert)
 cli.add_command(controller)
 cli.add_command(add_setup)
+cli.add_command(top)
+cli.add_command(bench)
 
 if __name__ == "__main__":
     cli(prog_name="mackenzie")
@@ -1,7 +1,7 @@
 """Configuration for the command line interface."""
 
 import sys
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseSettings, FilePath, ValidationError
 
@@ -12,6 +12,7 @@ class CmdConfig(BaseSettings):
 
     controller_host: str
     controller_port: int
+    controller_transport: Literal["rpyc", "framed"] = "rpyc"
 
     class Config:
         env_prefix = "CMD_"
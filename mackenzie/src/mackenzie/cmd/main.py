@@ -8,6 +8,46 @@ import click
 
 from .config import get_cmd_config
 from ..controller.main import ControllerProxy
+from ..setup_transfer import (
+    SETUP_CHUNK_SIZE,
+    SetupChunksType,
+    compute_setup_chunks,
+    iter_chunks,
+)
+
+MAX_UPLOAD_ATTEMPTS = 5
+
+
+def upload_setup(
+    controller: ControllerProxy,
+    setup_name: str,
+    setup_tar_file: Path,
+    chunks: SetupChunksType,
+) -> None:
+    """Upload the setup tarball chunk by chunk.
+
+    A dropped connection resumes from the last chunk the controller has.
+    """
+    setup_hash, _, chunk_size, chunk_hashes = chunks
+    for attempt in range(1, MAX_UPLOAD_ATTEMPTS + 1):
+        try:
+            next_index = controller.begin_setup_upload(setup_name, chunks)
+            if next_index is None:
+                click.secho(f"Setup '{setup_name}' already exists", fg="yellow")
+                return
+
+            data_iter = iter_chunks(setup_tar_file, chunk_size, next_index)
+            for index, data in enumerate(data_iter, start=next_index):
+                controller.put_setup_chunk(setup_hash, index, data)
+                click.secho(f"uploaded chunk {index + 1}/{len(chunk_hashes)}")
+
+            controller.finish_setup_upload(setup_hash)
+            return
+        except EOFError as e:
+            if attempt == MAX_UPLOAD_ATTEMPTS:
+                raise
+            click.secho(f"connection dropped: reconnecting: {e}", fg="red")
+            controller.reconnect()
 
 
 @click.command()
@@ -32,7 +72,8 @@ def add_setup(setup_dir):
     cmd = shlex.split(cmd)
     run(cmd, check=True)
 
-    setup_dir_tar = setup_tar_file.read_bytes()
+    chunks = compute_setup_chunks(setup_tar_file, SETUP_CHUNK_SIZE)
+    click.secho(f"setup hash: {chunks[0]}")
 
     click.secho("Connecting to controller")
     controller = ControllerProxy(
@@ -40,7 +81,8 @@ def add_setup(setup_dir):
         port=config.controller_port,
         key_file=str(config.key_file),
         cert_file=str(config.cert_file),
+        transport=config.controller_transport,
     )
 
-    controller.add_setup(setup_name, setup_dir_tar)
+    upload_setup(controller, setup_name, setup_tar_file, chunks)
     click.secho(f"Setup '{setup_name}' added successfully", fg="green")
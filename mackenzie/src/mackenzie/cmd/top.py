@@ -0,0 +1,103 @@
+"""Live view of the MacKenzie controller."""
+
+import time
+from collections import defaultdict
+
+import click
+from rich.live import Live
+from rich.table import Table
+from rich.console import Group
+
+from .config import get_cmd_config
+from ..controller.main import ControllerProxy
+from ..controller.controller import StatusType
+
+TASK_STATES = ("available", "assigned", "completed", "processed", "failed", "cancelled")
+
+
+def format_age(seconds: int) -> str:
+    hours, rem = divmod(seconds, 3600)
+    minutes, seconds = divmod(rem, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def render_status(status: StatusType, window_minutes: int) -> Group:
+    now, task_counts, oldest_assigned_at, recent, recent_seconds = status
+
+    by_type: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    by_cluster: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for task_state, assigned_to, task_type, num_tasks in task_counts:
+        by_type[task_type][task_state] += num_tasks
+        if assigned_to:
+            by_cluster[assigned_to][task_state] += num_tasks
+
+    type_table = Table(title="Tasks by type")
+    type_table.add_column("task_type")
+    for task_state in TASK_STATES:
+        type_table.add_column(task_state, justify="right")
+    for task_type, counts in sorted(by_type.items()):
+        type_table.add_row(task_type, *[str(counts[s]) for s in TASK_STATES])
+
+    cluster_table = Table(title="Tasks by cluster")
+    cluster_table.add_column("cluster")
+    for task_state in TASK_STATES[1:]:
+        cluster_table.add_column(task_state, justify="right")
+    for cluster, counts in sorted(by_cluster.items()):
+        cluster_table.add_row(cluster, *[str(counts[s]) for s in TASK_STATES[1:]])
+
+    rate_table = Table(title=f"Completions in the last {window_minutes} min")
+    rate_table.add_column("task_type")
+    rate_table.add_column("completed", justify="right")
+    rate_table.add_column("tasks/min", justify="right")
+    for task_type, num_completed in recent:
+        rate = num_completed / (recent_seconds / 60)
+        rate_table.add_row(task_type, str(num_completed), f"{rate:.1f}")
+
+    if oldest_assigned_at is None:
+        oldest = "oldest assigned: -"
+    else:
+        oldest = f"oldest assigned: {format_age(now - oldest_assigned_at)}"
+    updated = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+
+    return Group(f"{updated}  {oldest}", type_table, cluster_table, rate_table)
+
+
+@click.command()
+@click.option(
+    "-i",
+    "--interval",
+    type=float,
+    default=2.0,
+    show_default=True,
+    help="Seconds between refreshes.",
+)
+@click.option(
+    "-w",
+    "--window",
+    type=click.IntRange(1, 60),
+    default=15,
+    show_default=True,
+    help="Minutes of completions to compute the throughput over.",
+)
+def top(interval, window):
+    """Show a live view of the tasks on the controller."""
+    config = get_cmd_config()
+
+    controller = ControllerProxy(
+        host=config.controller_host,
+        port=config.controller_port,
+        key_file=str(config.key_file),
+        cert_file=str(config.cert_file),
+        transport=config.controller_transport,
+    )
+
+    status = controller.get_status(window_minutes=window)
+    with Live(render_status(status, window), auto_refresh=False) as live:
+        while True:
+            time.sleep(interval)
+            try:
+                status = controller.get_status(window_minutes=window)
+            except EOFError:
+                controller.reconnect()
+                continue
+            live.update(render_status(status, window), refresh=True)
@@ -0,0 +1,135 @@
+"""Asyncio controller server speaking the framed transport."""
+
+import ssl
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from .config import ControllerConfig
+from .framed import (
+    HEADER,
+    MAX_FRAME_SIZE,
+    MSG_REQUEST,
+    MSG_REPLY,
+    MSG_ERROR,
+    MSG_PUSH,
+    encode_frame,
+    decode_frame,
+    to_brineable,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class FramedServer:
+    """Serve the exposed methods of a service over the framed transport.
+
+    Each connection gets its own service instance.
+    Requests are read on the event loop and run on a dedicated executor,
+    so the loop only ever does framing and the per-connection cost
+    is a coroutine rather than a thread.
+    Requests on the same connection may complete out of order.
+    """
+
+    def __init__(
+        self,
+        service_factory: Callable[[], Any],
+        config: ControllerConfig,
+    ):
+        self.service_factory = service_factory
+        self.config = config
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.aio_workers, thread_name_prefix="controller-rpc"
+        )
+
+    def make_ssl_context(self) -> ssl.SSLContext:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.load_cert_chain(
+            certfile=str(self.config.cert_file), keyfile=str(self.config.key_file)
+        )
+        context.load_verify_locations(cafile=str(self.config.cert_file))
+        return context
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info("peername")
+        logger.info("framed client connected: peer=%s", peer)
+
+        service = self.service_factory()
+        drain_lock = asyncio.Lock()
+        requests: set[asyncio.Task] = set()
+
+        async def write_frame(frame: bytes) -> None:
+            if writer.is_closing():
+                return
+            writer.write(frame)
+            async with drain_lock:
+                await writer.drain()
+
+        def push(sub_id: int, payload: Any) -> None:
+            # Called from the subscription threads
+            frame = encode_frame((MSG_PUSH, sub_id, to_brineable(payload)))
+            asyncio.run_coroutine_threadsafe(write_frame(frame), loop)
+
+        async def handle_request(seq: int, op: str, args: tuple, kwargs: dict) -> None:
+            try:
+                method = getattr(service, f"exposed_{op}")
+                if op == "subscribe_completions":
+                    kwargs["callback"] = partial(push, kwargs["callback"])
+                result = await loop.run_in_executor(
+                    self.executor, partial(method, *args, **kwargs)
+                )
+                # Encoded here so that a result brine can't dump
+                # is sent back as an error instead of leaving the caller waiting
+                frame = encode_frame((MSG_REPLY, seq, to_brineable(result)))
+            except Exception as e:
+                frame = encode_frame((MSG_ERROR, seq, type(e).__name__, str(e)))
+            try:
+                await write_frame(frame)
+            except ConnectionError:
+                pass
+
+        try:
+            while True:
+                (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if size > MAX_FRAME_SIZE:
+                    logger.warning("frame too large: peer=%s, size=%d", peer, size)
+                    break
+
+                msg = decode_frame(await reader.readexactly(size))
+                if msg[0] != MSG_REQUEST:
+                    logger.warning("unexpected message: peer=%s, msg=%r", peer, msg)
+                    break
+
+                _, seq, op, args, kwargs = msg
+                task = asyncio.create_task(handle_request(seq, op, args, dict(kwargs)))
+                requests.add(task)
+                task.add_done_callback(requests.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            logger.info("framed client disconnected: peer=%s", peer)
+            service.close_subscriptions()
+            writer.close()
+
+    async def serve(self) -> None:
+        server = await asyncio.start_server(
+            self.handle_connection,
+            host=self.config.controller_host,
+            port=self.config.controller_port,
+            ssl=self.make_ssl_context(),
+            backlog=1024,
+        )
+        async with server:
+            await server.serve_forever()
+
+    def start(self) -> None:
+        asyncio.run(self.serve())
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -1,9 +1,15 @@
 """Configuration for the controller."""
 
 import sys
-from typing import Optional
+from typing import Literal, Optional
 
-from pydantic import BaseSettings, DirectoryPath, FilePath, ValidationError
+from pydantic import (
+    BaseSettings,
+    DirectoryPath,
+    FilePath,
+    PositiveInt,
+    ValidationError,
+)
 
 
 class ControllerConfig(BaseSettings):
@@ -12,9 +18,32 @@ class ControllerConfig(BaseSettings):
     setup_root: DirectoryPath
 
     task_timeout: int
+    reaper_period: int = 60
+    locality_fallback: bool = False
+
+    # Weights of the task queues, as JSON: {"queue": weight, ...}
+    queue_weights: dict[str, PositiveInt] = {}
+    default_queue_weight: PositiveInt = 1
+
+    speculation: bool = False
+    speculation_min_completed: float = 0.75  # fraction of the task group
+    speculation_percentile: int = 90
+
+    ljf_tail_size: int = 0  # longest job first for the last tasks of a queue
+
+    db_readers: int = 4
+    db_cache_size: int = 64  # MiB
+
+    commit_interval: float = 0.002  # seconds
+    commit_max_batch: int = 1000
 
     controller_host: str
     controller_port: int
+    controller_transport: Literal["rpyc", "framed"] = "rpyc"
+    aio_workers: int = 32
+
+    metrics_host: str = "127.0.0.1"
+    metrics_port: Optional[int] = None
 
     class Config:
         env_prefix = "CONTROLLER_"
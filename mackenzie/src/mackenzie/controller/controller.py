@@ -1,77 +1,204 @@
 """Main Controller Logic."""
 
+import math
 import time
-import shlex
-import hashlib
 import logging
-from subprocess import run
+from pathlib import Path
 from typing import Optional
 
 import apsw
 
 from .config import ControllerConfig
+from .dispatch import DispatchIndex
+from . import metrics
+from ..setup_transfer import (
+    SETUP_CHUNK_SIZE,
+    SetupChunksType,
+    PartFile,
+    compute_setup_chunks,
+    read_chunk,
+    save_chunks,
+    load_chunks,
+    iter_chunks,
+    ingest_setup,
+)
 from ..db import setup_db as sdb
 from ..db import task_db as tdb
 
 logger = logging.getLogger(__name__)
 
+# elapsed (s), queue_wait (s), max_rss (bytes) of a task's job
+TaskStatsType = tuple[Optional[int], Optional[int], Optional[int]]
+
+# task_id, task_result_json, task_stats
+TaskCompletionType = tuple[str, str, Optional[TaskStatsType]]
+
+# now, (task_state, assigned_to, task_type, num_tasks)s, oldest_assigned_at,
+# (task_type, num_completed)s, seconds the completions were counted over
+StatusType = tuple[
+    int,
+    tuple[tuple[str, str, str, int], ...],
+    Optional[int],
+    tuple[tuple[str, int], ...],
+    float,
+]
+
 # Setup distribution
 # ------------------
 
 
-def add_setup(
+def get_incoming_dir(config: ControllerConfig) -> Path:
+    incoming_dir = config.setup_root / "incoming"
+    incoming_dir.mkdir(exist_ok=True)
+    return incoming_dir
+
+
+def begin_setup_upload(
     config: ControllerConfig,
-    db_con: apsw.Connection,
     setup_name: str,
-    setup_dir_tar: bytes,
-) -> None:
-    """Add a new set setup to the system."""
-    logger.info("received add setup: setup_name=%s", setup_name)
-    incoming_hash = hashlib.sha256(setup_dir_tar).hexdigest()
-
-    setup_tar_file = config.setup_root / f"{setup_name}.tar.gz"
-    if setup_tar_file.exists():
-        logger.info("setup tar exists: setup_tar_file=%s", setup_tar_file)
-        existing_hash = hashlib.sha256(setup_tar_file.read_bytes()).hexdigest()
-        if existing_hash != incoming_hash:
+    existing_hash: Optional[str],
+    chunks: SetupChunksType,
+) -> Optional[int]:
+    """Start or resume a setup upload.
+
+    Return the index of the next chunk to be uploaded,
+    or None if the controller already has the setup.
+    """
+    setup_hash = chunks[0]
+    logger.info(
+        "received begin setup upload: setup_name=%s, setup_hash=%s",
+        setup_name,
+        setup_hash,
+    )
+    if existing_hash is not None:
+        if existing_hash != setup_hash:
             raise RuntimeError(
                 f"Trying to replace existing setup '{setup_name}' with a different setup."
             )
-    else:
-        logger.info("writing setup tar: setup_tar_file=%s", setup_tar_file)
-        setup_tar_file.write_bytes(setup_dir_tar)
-
-    setup_dir = config.setup_root / setup_name
-    if not setup_dir.exists():
-        logger.info("untarring setup tar: setup_tar_file=%s", setup_tar_file)
-        cmd = f"tar -C '{config.setup_root}' -xzf '{setup_tar_file}'"
-        logger.info("executing: %s", cmd)
-        cmd = shlex.split(cmd)
-        run(cmd, check=True)
-        if not setup_dir.exists():
+        logger.info("setup exists: setup_name=%s", setup_name)
+        return None
+
+    incoming_dir = get_incoming_dir(config)
+    upload_file = incoming_dir / f"{setup_hash}.json"
+    if upload_file.exists():
+        upload_setup_name, _ = load_chunks(upload_file)
+        if upload_setup_name != setup_name:
             raise RuntimeError(
-                f"Untarring '{setup_tar_file!s}' did not create '{setup_dir}'"
+                f"Setup '{setup_name}' is being uploaded as '{upload_setup_name}'."
             )
+    else:
+        save_chunks(upload_file, setup_name, chunks)
+
+    part = PartFile(incoming_dir / f"{setup_hash}.part", chunks)
+    return part.next_index()
 
+
+def put_setup_chunk(
+    config: ControllerConfig, setup_hash: str, index: int, data: bytes
+) -> None:
+    """Append the next chunk of a setup upload."""
+    incoming_dir = get_incoming_dir(config)
+    upload_file = incoming_dir / f"{setup_hash}.json"
+    if not upload_file.exists():
+        raise RuntimeError(f"No upload in progress for setup {setup_hash}.")
+
+    _, chunks = load_chunks(upload_file)
+    part = PartFile(incoming_dir / f"{setup_hash}.part", chunks)
+    part.write_chunk(index, data)
+    metrics.SETUP_BYTES.inc("upload", amount=len(data))
+
+
+def finish_setup_upload(config: ControllerConfig, setup_hash: str) -> str:
+    """Verify and untar an uploaded setup; return the setup name."""
+    incoming_dir = get_incoming_dir(config)
+    upload_file = incoming_dir / f"{setup_hash}.json"
+    if not upload_file.exists():
+        raise RuntimeError(f"No upload in progress for setup {setup_hash}.")
+
+    setup_name, chunks = load_chunks(upload_file)
+    logger.info(
+        "received finish setup upload: setup_name=%s, setup_hash=%s",
+        setup_name,
+        setup_hash,
+    )
+
+    part = PartFile(incoming_dir / f"{setup_hash}.part", chunks)
+    if not part.is_complete():
+        raise RuntimeError(f"Setup {setup_hash} has not been fully uploaded.")
+
+    # The controller keeps the tarball to serve it to the agents
+    setup_tar_file = config.setup_root / f"{setup_name}.tar.gz"
+    part_chunks = iter_chunks(part.part_file, part.chunk_size)
+    ingest_setup(config.setup_root, setup_name, setup_hash, part_chunks)
+    part.part_file.rename(setup_tar_file)
+
+    save_chunks(config.setup_root / f"{setup_name}.chunks.json", setup_name, chunks)
+    upload_file.unlink()
+    return setup_name
+
+
+def register_setup(db_con: apsw.Connection, setup_name: str, setup_hash: str) -> None:
+    """Register an added setup in the setup database."""
     try:
-        sdb.add_new_setup(db_con, setup_name, incoming_hash)
+        sdb.add_new_setup(db_con, setup_name, setup_hash)
     except apsw.ConstraintError:
         pass
 
 
-def get_all_setup_names(db_con: apsw.Connection) -> list[str]:
-    """Get all registered setups."""
-    return sdb.get_all_setup_names(db_con)
+def get_setup_hash(db_con: apsw.Connection, setup_name: str) -> Optional[str]:
+    """Get the hash of a registered setup."""
+    return sdb.get_setup_hash(db_con, setup_name)
 
 
-def get_setup_dir_tar(config: ControllerConfig, setup_name: str) -> bytes:
-    """Get the setup dir tar."""
+def get_all_setups(db_con: apsw.Connection) -> list[tuple[str, str]]:
+    """Get the name and hash of all registered setups."""
+    return sdb.get_all_setups(db_con)
+
+
+def get_setup_chunks(config: ControllerConfig, setup_name: str) -> SetupChunksType:
+    """Get the chunk index of a setup."""
+    chunks_file = config.setup_root / f"{setup_name}.chunks.json"
+    if chunks_file.exists():
+        _, chunks = load_chunks(chunks_file)
+        return chunks
+
+    # Setups added before the chunked transfer don't have an index
     setup_tar_file = config.setup_root / f"{setup_name}.tar.gz"
     if not setup_tar_file.exists():
         raise RuntimeError(f"Tar file for '{setup_name}' not found.")
 
-    setup_dir_tar = setup_tar_file.read_bytes()
-    return setup_dir_tar
+    logger.info("indexing setup tar: setup_tar_file=%s", setup_tar_file)
+    chunks = compute_setup_chunks(setup_tar_file, SETUP_CHUNK_SIZE)
+    save_chunks(chunks_file, setup_name, chunks)
+    return chunks
+
+
+def get_setup_chunk(config: ControllerConfig, setup_name: str, index: int) -> bytes:
+    """Get a chunk of the setup tarball."""
+    chunks = get_setup_chunks(config, setup_name)
+    setup_tar_file = config.setup_root / f"{setup_name}.tar.gz"
+    data = read_chunk(setup_tar_file, chunks[2], index)
+    metrics.SETUP_BYTES.inc("download", amount=len(data))
+    return data
+
+
+def get_all_setup_names(db_con: apsw.Connection) -> list[str]:
+    """Get the names of all registered setups.
+
+    Deprecated: kept for clients older than the chunked transfer.
+    """
+    return sdb.get_all_setup_names(db_con)
+
+
+def get_setup_dir_tar(config: ControllerConfig, setup_name: str) -> bytes:
+    """Get the whole setup tarball.
+
+    Deprecated: kept for clients older than the chunked transfer.
+    """
+    chunks = get_setup_chunks(config, setup_name)
+    return b"".join(
+        get_setup_chunk(config, setup_name, index) for index in range(len(chunks[3]))
+    )
 
 
 # Agent - Controller Interaction
@@ -79,59 +206,334 @@ def get_setup_dir_tar(config: ControllerConfig, setup_name: str) -> bytes:
 
 
 def make_timeout_tasks_available(
-    config: ControllerConfig, db_con: apsw.Connection
+    config: ControllerConfig, db_con: apsw.Connection, dispatch: DispatchIndex
 ) -> None:
-    """Make the tasks that have reached timeout available again."""
-    sql = """
-        select task_id, assigned_at, assigned_to
-        from task
-        where task_state = 'assigned' and assigned_at < ?
-        """
-
+    """Make the tasks whose lease has not been renewed in time available again."""
     start_time = int(time.time()) - config.task_timeout
-    cur = db_con.execute(sql, (start_time,))
-    for task_id, assigned_at, assigned_to in list(cur):
+    timeout_tasks = tdb.get_timeout_tasks(con=db_con, heartbeat_before=start_time)
+    for task_id, heartbeat_at, assigned_to in timeout_tasks:
         logger.warning(
-            "task timeout: task_id=%s, was_assinged_to=%s, was_assinged_at=%s",
+            "task timeout: task_id=%s, was_assinged_to=%s, last_heartbeat_at=%s",
             task_id,
             assigned_to,
-            assigned_at,
+            heartbeat_at,
+        )
+
+        task_priority, task_locality, task_queue, task_type = tdb.set_task_available(
+            con=db_con, task_id=task_id
+        )
+        dispatch.push(task_id, task_priority, task_locality, task_queue, task_type)
+        metrics.TASKS.move(
+            ("assigned", assigned_to, task_type), ("available", "", task_type)
         )
+        metrics.TASK_RECLAIMS.inc()
 
-        tdb.set_task_available(con=db_con, task_id=task_id)
+
+def get_runtime_percentile(runtimes: list[int], percentile: int) -> int:
+    """Get the nearest rank percentile of the runtimes."""
+    runtimes = sorted(runtimes)
+    rank = math.ceil(percentile / 100 * len(runtimes))
+    return runtimes[max(rank, 1) - 1]
+
+
+def make_speculative_tasks(
+    config: ControllerConfig, db_con: apsw.Connection, dispatch: DispatchIndex
+) -> None:
+    """Make duplicates of the stragglers of mostly completed task groups.
+
+    An assigned task is a straggler if it has been running longer than
+    speculation_percentile of the completed tasks in its group.
+    The duplicate is never given to the cluster running the original.
+    """
+    now = int(time.time())
+    for task_group in tdb.get_speculation_groups(con=db_con):
+        num_tasks, runtimes, running = tdb.get_task_group_runtimes(
+            con=db_con, task_group=task_group
+        )
+        if not runtimes or len(runtimes) < config.speculation_min_completed * num_tasks:
+            continue
+
+        threshold = get_runtime_percentile(runtimes, config.speculation_percentile)
+        for task_id, assigned_at in running:
+            if now - assigned_at <= threshold:
+                continue
+
+            duplicate = tdb.add_speculative_task(con=db_con, task_id=task_id)
+            (
+                duplicate_id,
+                task_priority,
+                task_locality,
+                task_queue,
+                task_type,
+            ) = duplicate
+            dispatch.push(
+                duplicate_id, task_priority, task_locality, task_queue, task_type
+            )
+            logger.info(
+                "speculative task added: task_id=%s, runtime=%d, threshold=%d",
+                task_id,
+                now - assigned_at,
+                threshold,
+            )
+            metrics.TASKS.move(None, ("available", "", task_type))
+            metrics.SPECULATIVE_TASKS.inc()
 
 
 def get_single_available_task(
-    config: ControllerConfig, db_con: apsw.Connection, cluster: str
+    config: ControllerConfig,
+    db_con: apsw.Connection,
+    dispatch: DispatchIndex,
+    cluster: str,
+    localities: Optional[tuple[str, ...]] = None,
 ) -> Optional[tuple[str, str, str, int]]:
     """Get one available task."""
-    # Make the timed out tasks available again
-    make_timeout_tasks_available(config=config, db_con=db_con)
+    tasks = get_available_tasks(
+        config=config,
+        db_con=db_con,
+        dispatch=dispatch,
+        cluster=cluster,
+        max_count=1,
+        load_budget=1,
+        localities=localities,
+    )
+    if not tasks:
+        return None
+    return tasks[0]
 
-    match tdb.get_single_available_task(con=db_con):
-        case None:
-            return None
-        case (task_id, task_type, task_data_json, task_priority):
-            logger.info("task assinged: task_id=%s, cluster=%s", task_id, cluster)
-            now = int(time.time())
-            tdb.set_task_assigned(
-                con=db_con, task_id=task_id, assigned_to=cluster, assigned_at=now
+
+def get_available_tasks(
+    config: ControllerConfig,
+    db_con: apsw.Connection,
+    dispatch: DispatchIndex,
+    cluster: str,
+    max_count: int,
+    load_budget: int,
+    localities: Optional[tuple[str, ...]] = None,
+) -> list[tuple[str, str, str, int]]:
+    """Get a batch of available tasks.
+
+    The actual load of a task is only known after the agent has set it up,
+    so every task is assumed to consume at least one unit of the load budget.
+
+    Tasks are popped off the dispatch index;
+    entries whose task is no longer available are dropped.
+    Speculative duplicates of tasks assigned to the cluster are skipped
+    and put back afterwards.
+    If the claim fails the popped entries are put back.
+
+    If localities is given only tasks without a locality
+    or with one of the given localities are assigned.
+    With locality_fallback set, the rest of the batch
+    is then filled with tasks from other localities.
+    """
+    max_count = min(max_count, load_budget)
+    if max_count <= 0:
+        return []
+
+    now = int(time.time())
+    tasks = []
+    popped = []
+    skipped = []
+    try:
+        while len(tasks) < max_count:
+            entry = dispatch.pop(localities)
+            if entry is None and localities is not None and config.locality_fallback:
+                entry = dispatch.pop()
+            if entry is None:
+                break
+            popped.append(entry)
+
+            task = tdb.claim_task(
+                con=db_con, task_id=entry[0], assigned_to=cluster, assigned_at=now
             )
-            return (task_id, task_type, task_data_json, task_priority)
+            if task is not None:
+                tasks.append(task)
+                dispatch.charge(entry[3])
+                continue
+
+            state = tdb.get_task_state(con=db_con, task_id=entry[0])
+            if state is not None and state[0] == "available":
+                skipped.append(entry)
+    except Exception:
+        for entry in popped:
+            dispatch.push(*entry)
+        raise
+
+    for entry in skipped:
+        dispatch.push(*entry)
+
+    for task_id, task_type, _, _ in tasks:
+        logger.info("task assinged: task_id=%s, cluster=%s", task_id, cluster)
+        metrics.TASKS.move(
+            ("available", "", task_type), ("assigned", cluster, task_type)
+        )
+    return tasks
+
+
+def renew_task_leases(
+    db_con: apsw.Connection, cluster: str, task_ids: list[str]
+) -> list[tuple[str, str]]:
+    """Renew the leases of the tasks the cluster is working on.
+
+    Return the id and state of the orphaned tasks,
+    those the cluster is still working on but that are no longer assigned to it;
+    for example when the lease expired and the task was reassigned,
+    or when a speculative duplicate finished first.
+    """
+    now = int(time.time())
+    orphan_ids = tdb.renew_task_leases(
+        con=db_con, assigned_to=cluster, task_ids=task_ids, heartbeat_at=now
+    )
+    orphans = []
+    for task_id in orphan_ids:
+        match tdb.get_task_state(con=db_con, task_id=task_id):
+            case None:
+                task_state, assigned_to = "missing", ""
+            case (task_state, assigned_to, _):
+                pass
+        logger.warning(
+            "orphaned task: task_id=%s, cluster=%s, task_state=%s, assigned_to=%s",
+            task_id,
+            cluster,
+            task_state,
+            assigned_to,
+        )
+        orphans.append((task_id, task_state))
+    if orphans:
+        metrics.LEASE_ORPHANS.inc(cluster, amount=len(orphans))
+    return orphans
 
 
 def set_task_completed(
-    db_con: apsw.Connection, task_id: str, task_result_json: str
-) -> None:
-    """Set the task to be completed."""
+    db_con: apsw.Connection,
+    dispatch: DispatchIndex,
+    task_id: str,
+    task_result_json: str,
+    task_stats: Optional[TaskStatsType] = None,
+) -> Optional[tuple[int, str, str, str, str]]:
+    """Set the task to be completed; return the completed task.
+
+    The first result of a speculative pair is recorded on the original task
+    and the duplicate is cancelled.
+    If the duplicate finished first its own start is recorded as well,
+    so that the runtimes of the task group are those of the winning attempts.
+    Results of tasks that are already completed are dropped.
+
+    task_stats are the elapsed time, queue wait and max RSS of the task's job;
+    the elapsed time is added to the runtime estimate of the task's class
+    only if this completion is the one that is recorded.
+    """
     logger.info("task completed: task_id=%s", task_id)
-    tdb.set_task_completed(con=db_con, task_id=task_id, task_result=task_result_json)
+
+    assigned_at = None
+    pair = tdb.get_speculative_pair(con=db_con, task_id=task_id)
+    if pair is not None:
+        original_id, duplicate_id = pair
+        cancel_task(db_con=db_con, task_id=duplicate_id)
+        if task_id == duplicate_id:
+            assigned_at = tdb.get_assigned_at(con=db_con, task_id=duplicate_id)
+            task_id = original_id
+            logger.info("speculative task finished first: task_id=%s", task_id)
+
+    old_state = tdb.get_task_state(con=db_con, task_id=task_id)
+    now = int(time.time())
+    match tdb.set_task_completed(
+        con=db_con,
+        task_id=task_id,
+        task_result=task_result_json,
+        completed_at=now,
+        assigned_at=assigned_at,
+    ):
+        case None if old_state is None:
+            logger.warning("completed task not found: task_id=%s", task_id)
+            return None
+        case None:
+            logger.info("task already completed: task_id=%s", task_id)
+            return None
+        case (completed_seq, task_type, task_data_json):
+            if task_stats is not None and task_stats[0] is not None:
+                add_runtime_sample(db_con, dispatch, task_id, task_stats)
+            metrics.TASKS.move(old_state, ("completed", old_state[1], task_type))
+            metrics.TASK_COMPLETIONS.inc(task_type)
+            metrics.RECENT_COMPLETIONS.inc(task_type)
+            return (completed_seq, task_id, task_type, task_data_json, task_result_json)
+
+
+def set_tasks_completed(
+    db_con: apsw.Connection,
+    dispatch: DispatchIndex,
+    completions: list[TaskCompletionType],
+) -> list[tuple[int, str, str, str, str]]:
+    """Set a batch of tasks to be completed; return the completed tasks."""
+    completed_tasks = []
+    for task_id, task_result_json, task_stats in completions:
+        task = set_task_completed(
+            db_con=db_con,
+            dispatch=dispatch,
+            task_id=task_id,
+            task_result_json=task_result_json,
+            task_stats=task_stats,
+        )
+        if task is not None:
+            completed_tasks.append(task)
+    return completed_tasks
+
+
+def add_runtime_sample(
+    db_con: apsw.Connection,
+    dispatch: DispatchIndex,
+    task_id: str,
+    task_stats: TaskStatsType,
+) -> None:
+    """Add the runtime of a task to the runtime estimate of its class."""
+    elapsed, queue_wait, max_rss = task_stats
+    assert elapsed is not None
+    estimate = tdb.add_runtime_sample(
+        con=db_con,
+        task_id=task_id,
+        elapsed=elapsed,
+        queue_wait=queue_wait,
+        max_rss=max_rss,
+    )
+    if estimate is None:
+        return
+
+    task_type, task_locality, mean_elapsed = estimate
+    dispatch.set_runtime_estimate(task_type, task_locality, mean_elapsed)
+    logger.info(
+        "runtime sample: task_id=%s, elapsed=%d, queue_wait=%s, max_rss=%s",
+        task_id,
+        elapsed,
+        queue_wait,
+        max_rss,
+    )
+
+
+def get_runtime_estimates(
+    db_con: apsw.Connection,
+) -> list[tuple[str, Optional[str], int, float, int, float, Optional[int]]]:
+    """Get the runtime estimates of the task classes."""
+    return tdb.get_runtime_estimates(con=db_con)
+
+
+def cancel_task(db_con: apsw.Connection, task_id: str) -> None:
+    """Cancel a task that is not yet finished."""
+    old_state = tdb.get_task_state(con=db_con, task_id=task_id)
+    if old_state is None or old_state[0] not in ("available", "assigned", "failed"):
+        return
+
+    logger.info("task cancelled: task_id=%s", task_id)
+    tdb.set_task_cancelled(con=db_con, task_id=task_id)
+    metrics.TASKS.move(old_state, ("cancelled", old_state[1], old_state[2]))
 
 
 def set_task_failed(db_con: apsw.Connection, task_id: str) -> None:
     """Set the task to be failed."""
     logger.info("task aborted: task_id=%s", task_id)
+    old_state = tdb.get_task_state(con=db_con, task_id=task_id)
     tdb.set_task_failed(con=db_con, task_id=task_id)
+    if old_state is not None:
+        metrics.TASKS.move(old_state, ("failed", old_state[1], old_state[2]))
 
 
 # Task Source - Controller Interaction
@@ -140,10 +542,14 @@ def set_task_failed(db_con: apsw.Connection, task_id: str) -> None:
 
 def add_new_task(
     db_con: apsw.Connection,
+    dispatch: DispatchIndex,
     task_id: str,
     task_type: str,
     task_data_json: str,
     task_priority: int,
+    task_locality: Optional[str] = None,
+    task_group: Optional[str] = None,
+    task_queue: str = "",
 ) -> None:
     """Add a new task to the task database."""
     logger.info("adding new task: task_id=%s", task_id)
@@ -153,7 +559,28 @@ def add_new_task(
         task_type=task_type,
         task_data=task_data_json,
         task_priority=task_priority,
+        task_locality=task_locality,
+        task_group=task_group,
+        task_queue=task_queue,
     )
+    dispatch.push(task_id, task_priority, task_locality, task_queue, task_type)
+    metrics.TASKS.move(None, ("available", "", task_type))
+
+
+def add_new_tasks(
+    db_con: apsw.Connection,
+    dispatch: DispatchIndex,
+    tasks: list[tdb.NewTaskType],
+) -> list[str]:
+    """Add a batch of new tasks; return ids of the duplicate tasks."""
+    logger.info("adding new tasks: num_tasks=%d", len(tasks))
+    new_tasks, duplicates = tdb.add_new_tasks(con=db_con, tasks=tasks)
+    for task_id, task_type, _, task_priority, task_locality, _, task_queue in new_tasks:
+        dispatch.push(task_id, task_priority, task_locality, task_queue, task_type)
+        metrics.TASKS.move(None, ("available", "", task_type))
+    for task_id in duplicates:
+        logger.warning("duplicate task: task_id=%s", task_id)
+    return duplicates
 
 
 def get_all_completed_tasks(db_con: apsw.Connection) -> list[tuple[str, str, str, str]]:
@@ -161,7 +588,48 @@ def get_all_completed_tasks(db_con: apsw.Connection) -> list[tuple[str, str, str
     return tdb.get_all_completed_tasks(con=db_con)
 
 
+def get_completed_since(
+    db_con: apsw.Connection, seq: int, limit: int, task_type: Optional[str]
+) -> list[tuple[int, str, str, str, str]]:
+    """Get the completed tasks with completion sequence number after seq."""
+    return tdb.get_completed_since(
+        con=db_con, seq=seq, limit=limit, task_type=task_type
+    )
+
+
 def set_task_processed(db_con: apsw.Connection, task_id: str) -> None:
     """Mark task as processed."""
     logger.info("task processed: task_id=%s", task_id)
+    old_state = tdb.get_task_state(con=db_con, task_id=task_id)
     tdb.set_task_processed(db_con, task_id)
+    if old_state is not None:
+        metrics.TASKS.move(old_state, ("processed", old_state[1], old_state[2]))
+
+
+# Operator - Controller Interaction
+# ---------------------------------
+
+
+def get_status(db_con: apsw.Connection, window_minutes: int) -> StatusType:
+    """Get an overview of the tasks.
+
+    Return the current time, the task counts by state, cluster and task type,
+    the assignment time of the longest assigned task,
+    the number of completed tasks per task type in the last window_minutes
+    and the seconds these were counted over,
+    which are fewer than window_minutes right after a restart.
+
+    This has to run on the writer,
+    where the in memory counts are in step with the task table
+    that the oldest assignment is read from.
+    Everything but the oldest assignment comes from in memory counters,
+    and that is a single lookup in a partial index,
+    so this is cheap enough to poll continuously.
+    """
+    now = int(time.time())
+    task_counts = tuple(metrics.TASKS.snapshot())
+    oldest_assigned_at = tdb.get_oldest_assigned_at(con=db_con)
+    recent = metrics.RECENT_COMPLETIONS.total(window_minutes)
+    recent_seconds = metrics.RECENT_COMPLETIONS.covered_seconds(window_minutes)
+    recent_items = tuple(sorted(recent.items()))
+    return (now, task_counts, oldest_assigned_at, recent_items, recent_seconds)
@@ -0,0 +1,71 @@
+"""Pooled connections to the controller database."""
+
+from queue import Queue
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import apsw
+
+from .config import get_controller_config
+
+BUSY_TIMEOUT = 1800 * 1000
+
+
+def open_db(db_path: str, cache_size: int, readonly: bool) -> apsw.Connection:
+    """Open a connection to the controller database."""
+    if readonly:
+        flags = apsw.SQLITE_OPEN_READONLY
+    else:
+        flags = apsw.SQLITE_OPEN_READWRITE | apsw.SQLITE_OPEN_CREATE
+
+    con = apsw.Connection(db_path, flags=flags)
+    con.setbusytimeout(BUSY_TIMEOUT)
+    if not readonly:
+        con.execute("pragma journal_mode=wal;")
+    con.execute("pragma synchronous=normal;")
+    con.execute("pragma temp_store=memory;")
+    con.execute(f"pragma cache_size=-{cache_size * 1024};")
+    return con
+
+
+class DbPool:
+    """A single writer connection and a pool of read only connections.
+
+    The database is run in WAL mode,
+    so readers don't wait on the writer and vice versa.
+    The writer connection must only be used by the write queue.
+    """
+
+    def __init__(self, db_path: str, num_readers: int, cache_size: int):
+        self.writer = open_db(db_path, cache_size, readonly=False)
+
+        self.readers: Queue[apsw.Connection] = Queue()
+        for _ in range(num_readers):
+            self.readers.put(open_db(db_path, cache_size, readonly=True))
+
+    @contextmanager
+    def reader(self) -> Iterator[apsw.Connection]:
+        """Borrow a read only connection."""
+        con = self.readers.get()
+        try:
+            yield con
+        finally:
+            self.readers.put(con)
+
+
+_DB_POOL: Optional[DbPool] = None
+
+
+def get_db_pool() -> DbPool:
+    global _DB_POOL
+
+    if _DB_POOL is None:
+        config = get_controller_config()
+        db_path = config.setup_root / "controller.db"
+        _DB_POOL = DbPool(
+            db_path=str(db_path),
+            num_readers=config.db_readers,
+            cache_size=config.db_cache_size,
+        )
+
+    return _DB_POOL
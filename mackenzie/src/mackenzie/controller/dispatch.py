@@ -0,0 +1,288 @@
+"""In memory dispatch index of the available tasks."""
+
+import math
+import heapq
+import logging
+from typing import Collection, Optional
+
+import apsw
+
+from ..db import task_db as tdb
+from .config import get_controller_config
+
+logger = logging.getLogger(__name__)
+
+STRIDE = 1 << 20
+
+# (task_type, task_locality)
+TaskClassType = tuple[str, Optional[str]]
+
+# (-mean_elapsed or 0.0, (-task_priority, task_id)) of the head of a class
+ClassKeyType = tuple[float, tuple[int, str]]
+
+
+class DispatchIndex:
+    """Heaps of available tasks ordered by (task_priority desc, task_id).
+
+    Tasks are grouped into task queues,
+    and within a queue there is one heap per task class,
+    that is per (task_type, task_locality).
+    Tasks without a locality can be run on any cluster.
+
+    Queues share the claims by stride scheduling.
+    Every queue has a pass value that advances by STRIDE / weight
+    each time one of its tasks is claimed;
+    the next task comes from the queue with the smallest pass,
+    ties going to the queue name.
+    Priorities only order tasks within a queue.
+
+    Once a queue has no more than ljf_tail_size available tasks,
+    its tasks are handed out longest job first
+    using the mean elapsed time of their class,
+    so that the long tasks do not end up as the last stragglers of a run.
+    Classes without an estimate are taken to be the longest.
+
+    Every queue keeps a heap of the heads of its classes
+    and a stride heap orders the queues by pass.
+    Both are updated lazily: an entry is dropped when it is popped
+    and no longer matches the class head or the pass of the queue,
+    so a pop only looks at the entries it skips for locality
+    instead of at every class of every queue.
+
+    The index mirrors the available tasks in the task table.
+    It is only touched from the writer thread,
+    so every change to it happens in step with the database.
+    Entries are not removed when a task stops being available
+    other than by a claim; such stale entries are skipped
+    when the claim finds the task no longer available.
+    """
+
+    def __init__(
+        self,
+        queue_weights: dict[str, int],
+        default_queue_weight: int,
+        ljf_tail_size: int = 0,
+    ):
+        self.queue_weights = queue_weights
+        self.default_queue_weight = default_queue_weight
+        self.ljf_tail_size = ljf_tail_size
+
+        self.queues: dict[str, dict[TaskClassType, list[tuple[int, str]]]] = {}
+        self.sizes: dict[str, int] = {}
+        self.passes: dict[str, int] = {}
+        self.global_pass = 0
+        self.runtime_estimates: dict[TaskClassType, float] = {}
+
+        # task_queue -> heap of (class_key, task_class)
+        self.heads: dict[str, list[tuple[ClassKeyType, TaskClassType]]] = {}
+        # task_queue -> if the heads are keyed longest job first
+        self.tail_modes: dict[str, bool] = {}
+        # heap of (pass, task_queue)
+        self.stride_heap: list[tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return sum(self.sizes.values())
+
+    def get_weight(self, task_queue: str) -> int:
+        return self.queue_weights.get(task_queue, self.default_queue_weight)
+
+    def load(self, con: apsw.Connection) -> None:
+        """Rebuild the index from the task table."""
+        self.queues = {}
+        self.sizes = {}
+        self.passes = {}
+        self.global_pass = 0
+        rows = tdb.get_available_task_priorities(con)
+        for task_id, task_priority, task_locality, task_queue, task_type in rows:
+            heaps = self.queues.setdefault(task_queue, {})
+            heap = heaps.setdefault((task_type, task_locality), [])
+            heap.append((-task_priority, task_id))
+            self.sizes[task_queue] = self.sizes.get(task_queue, 0) + 1
+        for heaps in self.queues.values():
+            for heap in heaps.values():
+                heapq.heapify(heap)
+        for task_queue in self.queues:
+            self.passes[task_queue] = 0
+
+        self.runtime_estimates = {}
+        for row in tdb.get_runtime_estimates(con):
+            task_type, task_locality, _, mean_elapsed = row[:4]
+            self.runtime_estimates[task_type, task_locality] = mean_elapsed
+
+        self.heads = {}
+        self.tail_modes = {}
+        for task_queue in self.queues:
+            self._rebuild_heads(task_queue)
+        self.stride_heap = [(0, task_queue) for task_queue in self.queues]
+        heapq.heapify(self.stride_heap)
+
+        logger.info(
+            "loaded dispatch index: num_tasks=%d, num_queues=%d, num_estimates=%d",
+            len(self),
+            len(self.queues),
+            len(self.runtime_estimates),
+        )
+
+    def set_runtime_estimate(
+        self, task_type: str, task_locality: Optional[str], mean_elapsed: float
+    ) -> None:
+        task_class = (task_type, task_locality)
+        self.runtime_estimates[task_class] = mean_elapsed
+
+        # The old head entries of the class are dropped once popped
+        for task_queue, heaps in self.queues.items():
+            if self.tail_modes[task_queue] and task_class in heaps:
+                self._push_head(task_queue, task_class)
+
+    def push(
+        self,
+        task_id: str,
+        task_priority: int,
+        task_locality: Optional[str],
+        task_queue: str,
+        task_type: str,
+    ) -> None:
+        if task_queue not in self.queues:
+            # A queue that was idle does not get to catch up on the claims it missed
+            self.passes[task_queue] = max(
+                self.passes.get(task_queue, 0), self.global_pass
+            )
+            self.queues[task_queue] = {}
+            self.sizes[task_queue] = 0
+            self.heads[task_queue] = []
+            self.tail_modes[task_queue] = self._is_tail(task_queue)
+            heapq.heappush(self.stride_heap, (self.passes[task_queue], task_queue))
+
+        task_class = (task_type, task_locality)
+        heap = self.queues[task_queue].setdefault(task_class, [])
+        entry = (-task_priority, task_id)
+        heapq.heappush(heap, entry)
+        self.sizes[task_queue] += 1
+        if heap[0] == entry:
+            self._push_head(task_queue, task_class)
+
+    def _is_tail(self, task_queue: str) -> bool:
+        return 0 < self.sizes[task_queue] <= self.ljf_tail_size
+
+    def _class_key(self, task_queue: str, task_class: TaskClassType) -> ClassKeyType:
+        heap = self.queues[task_queue][task_class]
+        if self.tail_modes[task_queue]:
+            mean_elapsed = self.runtime_estimates.get(task_class, math.inf)
+            return (-mean_elapsed, heap[0])
+        return (0.0, heap[0])
+
+    def _push_head(self, task_queue: str, task_class: TaskClassType) -> None:
+        class_key = self._class_key(task_queue, task_class)
+        heapq.heappush(self.heads[task_queue], (class_key, task_class))
+
+    def _rebuild_heads(self, task_queue: str) -> None:
+        """Key the heads of a queue anew, as when it enters or leaves its tail."""
+        self.tail_modes[task_queue] = self._is_tail(task_queue)
+        heads = [
+            (self._class_key(task_queue, task_class), task_class)
+            for task_class in self.queues[task_queue]
+        ]
+        heapq.heapify(heads)
+        self.heads[task_queue] = heads
+
+    def _pop_head(
+        self, task_queue: str, localities: Optional[Collection[str]]
+    ) -> Optional[TaskClassType]:
+        """Find the best class of the queue that is runnable in localities."""
+        if self.tail_modes[task_queue] != self._is_tail(task_queue):
+            self._rebuild_heads(task_queue)
+
+        heaps = self.queues[task_queue]
+        heads = self.heads[task_queue]
+        skipped = []
+        found = None
+        while heads:
+            class_key, task_class = heapq.heappop(heads)
+            if task_class not in heaps:
+                continue
+            if class_key != self._class_key(task_queue, task_class):
+                continue
+            if localities is not None and task_class[1] is not None:
+                if task_class[1] not in localities:
+                    skipped.append((class_key, task_class))
+                    continue
+            found = task_class
+            break
+
+        for entry in skipped:
+            heapq.heappush(heads, entry)
+        return found
+
+    def pop(
+        self, localities: Optional[Collection[str]] = None
+    ) -> Optional[tuple[str, int, Optional[str], str, str]]:
+        """Remove and return the next task runnable in localities.
+
+        If localities is None every task is considered.
+        The queue is not charged for the task until charge is called.
+        """
+        seen = set()
+        skipped = []
+        found = None
+        while self.stride_heap:
+            queue_pass, task_queue = heapq.heappop(self.stride_heap)
+            if task_queue not in self.queues or task_queue in seen:
+                continue
+            if queue_pass != self.passes[task_queue]:
+                continue
+            seen.add(task_queue)
+            skipped.append((queue_pass, task_queue))
+
+            task_class = self._pop_head(task_queue, localities)
+            if task_class is not None:
+                found = task_queue, task_class
+                break
+
+        # The pass of the queue only advances when it is charged
+        for entry in skipped:
+            heapq.heappush(self.stride_heap, entry)
+
+        if found is None:
+            return None
+
+        task_queue, task_class = found
+        task_type, task_locality = task_class
+        heaps = self.queues[task_queue]
+        heap = heaps[task_class]
+        neg_priority, task_id = heapq.heappop(heap)
+        self.sizes[task_queue] -= 1
+        if heap:
+            self._push_head(task_queue, task_class)
+        else:
+            del heaps[task_class]
+        if not heaps:
+            del self.queues[task_queue]
+            del self.sizes[task_queue]
+            del self.heads[task_queue]
+            del self.tail_modes[task_queue]
+        return task_id, -neg_priority, task_locality, task_queue, task_type
+
+    def charge(self, task_queue: str) -> None:
+        """Advance the pass of the queue for a claimed task."""
+        queue_pass = self.passes.get(task_queue, self.global_pass)
+        self.global_pass = queue_pass
+        self.passes[task_queue] = queue_pass + STRIDE // self.get_weight(task_queue)
+        if task_queue in self.queues:
+            heapq.heappush(self.stride_heap, (self.passes[task_queue], task_queue))
+
+
+_DISPATCH_INDEX: Optional[DispatchIndex] = None
+
+
+def get_dispatch_index() -> DispatchIndex:
+    global _DISPATCH_INDEX
+
+    if _DISPATCH_INDEX is None:
+        config = get_controller_config()
+        _DISPATCH_INDEX = DispatchIndex(
+            queue_weights=config.queue_weights,
+            default_queue_weight=config.default_queue_weight,
+            ljf_tail_size=config.ljf_tail_size,
+        )
+
+    return _DISPATCH_INDEX
@@ -0,0 +1,200 @@
+"""Length prefixed brine framing for the asyncio controller transport.
+
+Every frame is a 4 byte big endian length followed by a brine encoded tuple:
+
+    (MSG_REQUEST, seq, op, args, kwargs)
+    (MSG_REPLY, seq, result)
+    (MSG_ERROR, seq, exc_type, exc_message)
+    (MSG_PUSH, sub_id, payload)
+
+kwargs is sent as a tuple of (name, value) pairs.
+Brine only knows about immutable values,
+so lists must be sent as tuples.
+"""
+
+import ssl
+import socket
+import struct
+import logging
+from itertools import count
+from threading import Lock, Thread
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from rpyc.core import brine
+
+logger = logging.getLogger(__name__)
+
+MSG_REQUEST = 1
+MSG_REPLY = 2
+MSG_ERROR = 3
+MSG_PUSH = 4
+
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+
+class RemoteError(RuntimeError):
+    """An exception raised by the controller while serving a request."""
+
+
+def to_brineable(obj: Any) -> Any:
+    """Replace the lists in obj with tuples."""
+    if isinstance(obj, (list, tuple)):
+        return tuple(to_brineable(x) for x in obj)
+    return obj
+
+
+def encode_frame(msg: tuple) -> bytes:
+    data = brine.dump(msg)
+    return HEADER.pack(len(data)) + data
+
+
+def decode_frame(data: bytes) -> tuple:
+    return brine.load(data)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        data = sock.recv(size - len(buf))
+        if not data:
+            raise EOFError("connection closed")
+        buf.extend(data)
+    return bytes(buf)
+
+
+class FramedRoot:
+    """Makes remote calls look like rpyc's conn.root."""
+
+    def __init__(self, conn: "FramedConnection"):
+        self.conn = conn
+
+    def __getattr__(self, op: str) -> Callable:
+        if op == "subscribe_completions":
+            return self.conn.subscribe_completions
+        return lambda *args, **kwargs: self.conn.call(op, *args, **kwargs)
+
+
+class FramedConnection:
+    """Client side of the framed transport.
+
+    Requests can be sent from any thread.
+    A reader thread matches replies to requests
+    and runs the callbacks of pushed completions.
+    """
+
+    def __init__(self, host: str, port: int, key_file: str, cert_file: str):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        # The same key and cert are used wherever the controller runs,
+        # so the host name is not checked.
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.load_cert_chain(certfile=cert_file, keyfile=key_file)
+        context.load_verify_locations(cafile=cert_file)
+
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = context.wrap_socket(sock)
+
+        self.seq = count()
+        self.send_lock = Lock()
+        self.pending: dict[int, Future] = {}
+        self.pending_lock = Lock()
+        self.callbacks: dict[int, Callable] = {}
+        self.closed = False
+
+        self.root = FramedRoot(self)
+        self.reader = Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+
+    def send(self, msg: tuple) -> None:
+        frame = encode_frame(msg)
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+    def call(self, op: str, *args, **kwargs) -> Any:
+        seq = next(self.seq)
+        future = Future()
+        with self.pending_lock:
+            if self.closed:
+                raise EOFError("connection closed")
+            self.pending[seq] = future
+
+        kwarg_items = to_brineable(tuple(kwargs.items()))
+        msg = (MSG_REQUEST, seq, op, to_brineable(args), kwarg_items)
+        try:
+            self.send(msg)
+        except OSError as e:
+            with self.pending_lock:
+                self.pending.pop(seq, None)
+            raise EOFError(str(e)) from e
+        return future.result()
+
+    def subscribe_completions(
+        self,
+        callback: Callable,
+        task_type: Optional[str] = None,
+        task_id_prefix: Optional[str] = None,
+    ) -> None:
+        sub_id = next(self.seq)
+        self.callbacks[sub_id] = callback
+        self.call(
+            "subscribe_completions",
+            callback=sub_id,
+            task_type=task_type,
+            task_id_prefix=task_id_prefix,
+        )
+
+    def read_loop(self) -> None:
+        try:
+            while True:
+                (size,) = HEADER.unpack(recv_exactly(self.sock, HEADER.size))
+                if size > MAX_FRAME_SIZE:
+                    raise EOFError(f"frame too large: {size}")
+                msg = decode_frame(recv_exactly(self.sock, size))
+                self.dispatch(msg)
+        except (EOFError, OSError) as e:
+            self.fail_pending(EOFError(str(e)))
+        except Exception as e:
+            logger.error("framed reader failed: %s", e, exc_info=e)
+            self.fail_pending(EOFError(str(e)))
+
+    def dispatch(self, msg: tuple) -> None:
+        msg_type = msg[0]
+        if msg_type == MSG_PUSH:
+            _, sub_id, payload = msg
+            try:
+                self.callbacks[sub_id](payload)
+            except Exception as e:
+                logger.error("push callback failed: %s", e, exc_info=e)
+            return
+
+        with self.pending_lock:
+            future = self.pending.pop(msg[1])
+        if msg_type == MSG_REPLY:
+            _, _, result = msg
+            future.set_result(result)
+        elif msg_type == MSG_ERROR:
+            _, _, exc_type, exc_message = msg
+            future.set_exception(RemoteError(f"{exc_type}: {exc_message}"))
+        else:
+            raise EOFError(f"unexpected message: {msg!r}")
+
+    def fail_pending(self, exc: Exception) -> None:
+        with self.pending_lock:
+            self.closed = True
+            pending = list(self.pending.values())
+            self.pending.clear()
+        for future in pending:
+            future.set_exception(exc)
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        # The reader must be done with the socket before its fd is released,
+        # otherwise it may end up reading from the next connection.
+        self.reader.join()
+        self.sock.close()
@@ -4,31 +4,56 @@ import sys
 import ssl
 import time
 import logging
-from typing import Optional, Any
+from queue import Queue, Empty
+from typing import Optional, Any, Callable, cast
 from functools import partial
-from threading import Lock
-
-import apsw
+from threading import Lock, Thread
 
 import rpyc
+from more_itertools import chunked
 from rpyc.core import Connection, Service
 from rpyc.utils.server import ThreadedServer
 from rpyc.utils.authenticators import SSLAuthenticator
 
 import click
 
-from .config import get_controller_config
+from .config import ControllerConfig, get_controller_config
+from .db_pool import get_db_pool
+from .writer import get_write_queue
+from .dispatch import get_dispatch_index
+from . import metrics
 from .controller import (
-    add_setup,
+    make_timeout_tasks_available,
+    make_speculative_tasks,
+    begin_setup_upload,
+    put_setup_chunk,
+    finish_setup_upload,
+    register_setup,
+    get_setup_hash,
+    get_all_setups,
+    get_setup_chunks,
+    get_setup_chunk,
     get_all_setup_names,
     get_setup_dir_tar,
     get_single_available_task,
+    get_available_tasks,
+    renew_task_leases,
     set_task_completed,
+    set_tasks_completed,
+    get_runtime_estimates,
     add_new_task,
+    add_new_tasks,
     get_all_completed_tasks,
+    get_completed_since,
     set_task_failed,
     set_task_processed,
+    get_status,
 )
+from .controller import TaskStatsType, TaskCompletionType, StatusType
+from .notifier import CompletionNotifier, CompletedTaskType, Subscription
+from .framed import FramedConnection
+from .aio_server import FramedServer
+from ..setup_transfer import SETUP_CHUNK_SIZE, SetupChunksType, split_chunks
 from ..db import setup_db as sdb
 from ..db import task_db as tdb
 
@@ -37,89 +62,193 @@ logger = logging.getLogger(__name__)
 CONNECT_RETRY_TIME = 300
 CONNECT_INTER_RETRY_TIME = 5
 
-DB_LOCK = Lock()
+ADD_TASKS_CHUNK_SIZE = 1000
+COMPLETED_PAGE_SIZE = 1000
+STATUS_WINDOW_MINUTES = 15
+
+SETUP_LOCK = Lock()
+NOTIFIER = CompletionNotifier()
 
 # Main logic
 # =============================================================================
 
 
+@metrics.instrument_service
 class ControllerService(Service):
     def __init__(self):
         self.conn: Optional[Connection] = None
-        self.db_con: Optional[apsw.Connection] = None
         self.config = get_controller_config()
+        self.db_pool = get_db_pool()
+        self.write_queue = get_write_queue()
+        self.dispatch = get_dispatch_index()
+        self.subscriptions: list[Subscription] = []
 
     def on_connect(self, conn: Connection) -> None:
         self.conn = conn
 
-        db_con_path = self.config.setup_root / "controller.db"
-        db_con_path = str(db_con_path)
-        self.db_con = apsw.Connection(db_con_path)
-        # self.db_con.execute("pragma busy_timeout=1800;")
-        self.db_con.setbusytimeout(1800 * 1000)
-
     def on_disconnect(self, _: Connection) -> None:
         assert self.conn is not None
-        assert self.db_con is not None
 
         self.conn = None
+        self.close_subscriptions()
 
-        self.db_con.close()
-        self.db_con = None
+    def close_subscriptions(self) -> None:
+        for sub in self.subscriptions:
+            NOTIFIER.unsubscribe(sub)
+        self.subscriptions = []
 
     # Setup distribution
 
+    def exposed_begin_setup_upload(
+        self, setup_name: str, chunks: SetupChunksType
+    ) -> Optional[int]:
+        setup_hash, size, chunk_size, chunk_hashes = chunks
+        chunks = (setup_hash, size, chunk_size, tuple(chunk_hashes))
+        with self.db_pool.reader() as db_con:
+            with db_con:
+                existing_hash = get_setup_hash(db_con=db_con, setup_name=setup_name)
+        with SETUP_LOCK:
+            return begin_setup_upload(
+                config=self.config,
+                setup_name=setup_name,
+                existing_hash=existing_hash,
+                chunks=chunks,
+            )
+
+    def exposed_put_setup_chunk(self, setup_hash: str, index: int, data: bytes) -> None:
+        with SETUP_LOCK:
+            put_setup_chunk(
+                config=self.config, setup_hash=setup_hash, index=index, data=data
+            )
+
+    def exposed_finish_setup_upload(self, setup_hash: str) -> None:
+        with SETUP_LOCK:
+            setup_name = finish_setup_upload(config=self.config, setup_hash=setup_hash)
+        self.write_queue.execute(
+            lambda db_con: register_setup(
+                db_con=db_con, setup_name=setup_name, setup_hash=setup_hash
+            )
+        )
+
+    def exposed_get_all_setups(self) -> tuple[tuple[str, str], ...]:
+        with self.db_pool.reader() as db_con:
+            with db_con:
+                return tuple(get_all_setups(db_con=db_con))
+
+    def exposed_get_setup_chunks(self, setup_name: str) -> SetupChunksType:
+        with SETUP_LOCK:
+            return get_setup_chunks(config=self.config, setup_name=setup_name)
+
+    def exposed_get_setup_chunk(self, setup_name: str, index: int) -> bytes:
+        return get_setup_chunk(config=self.config, setup_name=setup_name, index=index)
+
+    # Deprecated setup distribution, kept for clients older than the chunked transfer
+
     def exposed_add_setup(self, setup_name: str, setup_dir_tar: bytes) -> None:
-        assert self.db_con is not None
-
-        with DB_LOCK:
-            with self.db_con:
-                return add_setup(
-                    config=self.config,
-                    db_con=self.db_con,
-                    setup_name=setup_name,
-                    setup_dir_tar=setup_dir_tar,
-                )
+        chunks, data = split_chunks(bytes(setup_dir_tar), SETUP_CHUNK_SIZE)
+        next_index = self.exposed_begin_setup_upload(setup_name, chunks)
+        if next_index is None:
+            return
+        for index in range(next_index, len(data)):
+            self.exposed_put_setup_chunk(chunks[0], index, data[index])
+        self.exposed_finish_setup_upload(chunks[0])
 
     def exposed_get_all_setup_names(self) -> list[str]:
-        assert self.db_con is not None
-
-        with DB_LOCK:
-            with self.db_con:
-                return get_all_setup_names(db_con=self.db_con)
-            return []
+        with self.db_pool.reader() as db_con:
+            with db_con:
+                return get_all_setup_names(db_con=db_con)
 
     def exposed_get_setup_dir_tar(self, setup_name: str) -> bytes:
-        return get_setup_dir_tar(config=self.config, setup_name=setup_name)
+        with SETUP_LOCK:
+            return get_setup_dir_tar(config=self.config, setup_name=setup_name)
 
     # Agent - Controller Interaction
 
     def exposed_get_single_available_task(
-        self, cluster: str
+        self, cluster: str, localities: Optional[tuple[str, ...]] = None
     ) -> Optional[tuple[str, str, str, int]]:
-        assert self.db_con is not None
+        return self.write_queue.execute(
+            lambda db_con: get_single_available_task(
+                config=self.config,
+                db_con=db_con,
+                dispatch=self.dispatch,
+                cluster=cluster,
+                localities=localities,
+            )
+        )
 
-        with DB_LOCK:
-            with self.db_con:
-                return get_single_available_task(
-                    config=self.config, db_con=self.db_con, cluster=cluster
-                )
+    def exposed_get_available_tasks(
+        self,
+        cluster: str,
+        max_count: int,
+        load_budget: int,
+        localities: Optional[tuple[str, ...]] = None,
+    ) -> tuple[tuple[str, str, str, int], ...]:
+        tasks = self.write_queue.execute(
+            lambda db_con: get_available_tasks(
+                config=self.config,
+                db_con=db_con,
+                dispatch=self.dispatch,
+                cluster=cluster,
+                max_count=max_count,
+                load_budget=load_budget,
+                localities=localities,
+            )
+        )
+        # Return a tuple so that rpyc sends it by value
+        return tuple(tasks)
+
+    def exposed_renew_task_leases(
+        self, cluster: str, task_ids: tuple[str, ...]
+    ) -> tuple[tuple[str, str], ...]:
+        task_ids_list = list(task_ids)
+        orphans = self.write_queue.execute(
+            lambda db_con: renew_task_leases(
+                db_con=db_con, cluster=cluster, task_ids=task_ids_list
+            )
+        )
+        return tuple(orphans)
 
-    def exposed_set_task_completed(self, task_id: str, task_result_json: str) -> None:
-        assert self.db_con is not None
+    def exposed_set_task_completed(
+        self,
+        task_id: str,
+        task_result_json: str,
+        task_stats: Optional[TaskStatsType] = None,
+    ) -> None:
+        if task_stats is not None:
+            task_stats = cast(TaskStatsType, tuple(task_stats))
+        self.write_queue.execute(
+            lambda db_con: set_task_completed(
+                db_con=db_con,
+                dispatch=self.dispatch,
+                task_id=task_id,
+                task_result_json=task_result_json,
+                task_stats=task_stats,
+            ),
+            # Publish from the writer so that
+            # subscribers see completions in sequence order.
+            on_commit=publish_completed_task,
+        )
 
-        with DB_LOCK:
-            with self.db_con:
-                return set_task_completed(
-                    db_con=self.db_con, task_id=task_id, task_result_json=task_result_json
-                )
+    def exposed_set_tasks_completed(
+        self, completions: tuple[TaskCompletionType, ...]
+    ) -> None:
+        completions_list = []
+        for task_id, task_result_json, task_stats in completions:
+            if task_stats is not None:
+                task_stats = cast(TaskStatsType, tuple(task_stats))
+            completions_list.append((task_id, task_result_json, task_stats))
+        self.write_queue.execute(
+            lambda db_con: set_tasks_completed(
+                db_con=db_con, dispatch=self.dispatch, completions=completions_list
+            ),
+            on_commit=publish_completed_tasks,
+        )
 
     def exposed_set_task_failed(self, task_id: str) -> None:
-        assert self.db_con is not None
-
-        with DB_LOCK:
-            with self.db_con:
-                return set_task_failed(db_con=self.db_con, task_id=task_id)
+        return self.write_queue.execute(
+            lambda db_con: set_task_failed(db_con=db_con, task_id=task_id)
+        )
 
     # Task Source - Controller Interaction
 
@@ -129,92 +258,265 @@ class ControllerService(Service):
         task_type: str,
         task_data_json: str,
         task_priority: int,
+        task_locality: Optional[str] = None,
+        task_group: Optional[str] = None,
+        task_queue: str = "",
     ) -> None:
-        assert self.db_con is not None
-
-        with DB_LOCK:
-            with self.db_con:
-                return add_new_task(
-                    db_con=self.db_con,
-                    task_id=task_id,
-                    task_type=task_type,
-                    task_data_json=task_data_json,
-                    task_priority=task_priority,
-                )
+        return self.write_queue.execute(
+            lambda db_con: add_new_task(
+                db_con=db_con,
+                dispatch=self.dispatch,
+                task_id=task_id,
+                task_type=task_type,
+                task_data_json=task_data_json,
+                task_priority=task_priority,
+                task_locality=task_locality,
+                task_group=task_group,
+                task_queue=task_queue,
+            )
+        )
 
-    def exposed_get_all_completed_tasks(self) -> list[tuple[str, str, str, str]]:
-        assert self.db_con is not None
+    def exposed_add_new_tasks(
+        self, tasks: tuple[tdb.NewTaskType, ...]
+    ) -> tuple[str, ...]:
+        tasks_list = [tuple(task) for task in tasks]
+        duplicates = self.write_queue.execute(
+            lambda db_con: add_new_tasks(
+                db_con=db_con, dispatch=self.dispatch, tasks=tasks_list
+            )
+        )
+        return tuple(duplicates)
 
+    def exposed_get_runtime_estimates(
+        self,
+    ) -> tuple[tuple[str, Optional[str], int, float, int, float, Optional[int]], ...]:
+        with self.db_pool.reader() as db_con:
+            with db_con:
+                return tuple(get_runtime_estimates(db_con=db_con))
 
-        with DB_LOCK:
-            with self.db_con:
-                return get_all_completed_tasks(db_con=self.db_con)
-            return []
+    def exposed_get_all_completed_tasks(self) -> list[tuple[str, str, str, str]]:
+        with self.db_pool.reader() as db_con:
+            with db_con:
+                return get_all_completed_tasks(db_con=db_con)
+
+    def exposed_get_completed_since(
+        self, seq: int, limit: int, task_type: Optional[str] = None
+    ) -> tuple[tuple[int, str, str, str, str], ...]:
+        with self.db_pool.reader() as db_con:
+            with db_con:
+                tasks = get_completed_since(
+                    db_con=db_con, seq=seq, limit=limit, task_type=task_type
+                )
+                return tuple(tasks)
+
+    def exposed_subscribe_completions(
+        self,
+        callback: Callable[[tuple[CompletedTaskType, ...]], Any],
+        task_type: Optional[str] = None,
+        task_id_prefix: Optional[str] = None,
+    ) -> None:
+        sub = NOTIFIER.subscribe(
+            callback=callback, task_type=task_type, task_id_prefix=task_id_prefix
+        )
+        self.subscriptions.append(sub)
 
     def exposed_set_task_processed(self, task_id: str) -> None:
-        assert self.db_con is not None
+        return self.write_queue.execute(
+            lambda db_con: set_task_processed(db_con=db_con, task_id=task_id)
+        )
+
+    # Operator - Controller Interaction
+
+    def exposed_get_status(
+        self, window_minutes: int = STATUS_WINDOW_MINUTES
+    ) -> StatusType:
+        return self.write_queue.execute(
+            lambda db_con: get_status(db_con=db_con, window_minutes=window_minutes)
+        )
+
 
-        with DB_LOCK:
-            with self.db_con:
-                return set_task_processed(db_con=self.db_con, task_id=task_id)
+def publish_completed_task(task: Optional[CompletedTaskType]) -> None:
+    if task is not None:
+        NOTIFIER.publish([task])
+
+
+def publish_completed_tasks(tasks: list[CompletedTaskType]) -> None:
+    if tasks:
+        NOTIFIER.publish(tasks)
 
 
 class ControllerProxy:
-    def __init__(self, host: str, port: int, key_file: str, cert_file: str, **kwargs):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        key_file: str,
+        cert_file: str,
+        transport: str = "rpyc",
+        **kwargs,
+    ):
         self.host = host
         self.port = port
         self.key_file = key_file
         self.cert_file = cert_file
+        self.transport = transport
         self.extra_kwargs = kwargs
         self.conn = robust_connect(
             host=self.host,
             port=self.port,
             key_file=self.key_file,
             cert_file=self.cert_file,
+            transport=self.transport,
             **self.extra_kwargs,
         )
 
+        # Completion subscriptions; replayed on reconnect
+        self.bg_thread: Optional[rpyc.BgServingThread] = None
+        self.subscriptions: list[tuple[Callable, Optional[str], Optional[str]]] = []
+        self.on_reconnect: list[Callable[[], Any]] = []
+
+    def stop_bg_thread(self):
+        if self.bg_thread is not None:
+            try:
+                self.bg_thread.stop()
+            except Exception as e:
+                logger.warning("failed to stop background thread: %s", e)
+            self.bg_thread = None
+
     def reconnect(self):
+        self.stop_bg_thread()
         self.conn.close()
         self.conn = robust_connect(
             host=self.host,
             port=self.port,
             key_file=self.key_file,
             cert_file=self.cert_file,
+            transport=self.transport,
             **self.extra_kwargs,
         )
 
+        for callback, task_type, task_id_prefix in self.subscriptions:
+            self.do_subscribe_completions(callback, task_type, task_id_prefix)
+        for on_reconnect in self.on_reconnect:
+            on_reconnect()
+
     def close(self):
+        self.stop_bg_thread()
         self.conn.close()
 
     # Setup distribution
 
-    def add_setup(self, setup_name: str, setup_dir_tar: bytes) -> None:
+    def begin_setup_upload(
+        self, setup_name: str, chunks: SetupChunksType
+    ) -> Optional[int]:
         remote: Any = self.conn.root
-        return remote.add_setup(setup_name=setup_name, setup_dir_tar=setup_dir_tar)
+        return remote.begin_setup_upload(setup_name=setup_name, chunks=chunks)
 
-    def get_all_setup_names(self) -> list[str]:
+    def put_setup_chunk(self, setup_hash: str, index: int, data: bytes) -> None:
         remote: Any = self.conn.root
-        return remote.get_all_setup_names()
+        return remote.put_setup_chunk(setup_hash=setup_hash, index=index, data=data)
 
-    def get_setup_dir_tar(self, setup_name: str) -> bytes:
+    def finish_setup_upload(self, setup_hash: str) -> None:
         remote: Any = self.conn.root
-        return remote.get_setup_dir_tar(setup_name=setup_name)
+        return remote.finish_setup_upload(setup_hash=setup_hash)
+
+    def get_all_setups(self) -> tuple[tuple[str, str], ...]:
+        remote: Any = self.conn.root
+        return remote.get_all_setups()
+
+    def get_setup_chunks(self, setup_name: str) -> SetupChunksType:
+        remote: Any = self.conn.root
+        return remote.get_setup_chunks(setup_name=setup_name)
+
+    def get_setup_chunk(self, setup_name: str, index: int) -> bytes:
+        remote: Any = self.conn.root
+        return remote.get_setup_chunk(setup_name=setup_name, index=index)
+
+    # Deprecated setup distribution, kept for callers older than the chunked transfer
+
+    def add_setup(self, setup_name: str, setup_dir_tar: bytes) -> None:
+        chunks, data = split_chunks(setup_dir_tar, SETUP_CHUNK_SIZE)
+        next_index = self.begin_setup_upload(setup_name, chunks)
+        if next_index is None:
+            return
+        for index in range(next_index, len(data)):
+            self.put_setup_chunk(chunks[0], index, data[index])
+        self.finish_setup_upload(chunks[0])
+
+    def get_all_setup_names(self) -> list[str]:
+        return [setup_name for setup_name, _ in self.get_all_setups()]
+
+    def get_setup_dir_tar(self, setup_name: str) -> bytes:
+        chunks = self.get_setup_chunks(setup_name)
+        return b"".join(
+            self.get_setup_chunk(setup_name, index) for index in range(len(chunks[3]))
+        )
 
     # Agent - Controller Interaction
 
     def get_single_available_task(
-        self, cluster: str
+        self, cluster: str, localities: Optional[list[str]] = None
     ) -> Optional[tuple[str, str, str, int]]:
         remote: Any = self.conn.root
-        return remote.get_single_available_task(cluster=cluster)
+        if localities is not None:
+            localities = tuple(localities)
+        return remote.get_single_available_task(cluster=cluster, localities=localities)
 
-    def set_task_completed(self, task_id: str, task_result_json: str) -> None:
+    def get_available_tasks(
+        self,
+        cluster: str,
+        max_count: int,
+        load_budget: int,
+        localities: Optional[list[str]] = None,
+    ) -> tuple[tuple[str, str, str, int], ...]:
+        """Claim a batch of tasks.
+
+        localities lists the task localities that are cheap to run here;
+        None means the caller does not track localities.
+        """
+        remote: Any = self.conn.root
+        if localities is not None:
+            # Send a tuple so that rpyc sends it by value
+            localities = tuple(localities)
+        return remote.get_available_tasks(
+            cluster=cluster,
+            max_count=max_count,
+            load_budget=load_budget,
+            localities=localities,
+        )
+
+    def renew_task_leases(
+        self, cluster: str, task_ids: list[str]
+    ) -> list[tuple[str, str]]:
+        """Renew the leases of the tasks; return id and state of the orphaned tasks."""
+        remote: Any = self.conn.root
+        # Send a tuple so that rpyc sends it by value
+        orphans = remote.renew_task_leases(cluster=cluster, task_ids=tuple(task_ids))
+        return list(orphans)
+
+    def set_task_completed(
+        self,
+        task_id: str,
+        task_result_json: str,
+        task_stats: Optional[TaskStatsType] = None,
+    ) -> None:
         remote: Any = self.conn.root
         return remote.set_task_completed(
-            task_id=task_id, task_result_json=task_result_json
+            task_id=task_id, task_result_json=task_result_json, task_stats=task_stats
         )
 
+    def set_tasks_completed(
+        self,
+        completions: list[TaskCompletionType],
+        chunk_size: int = ADD_TASKS_CHUNK_SIZE,
+    ) -> None:
+        """Set tasks completed in chunks."""
+        remote: Any = self.conn.root
+        for chunk in chunked(completions, chunk_size):
+            # Send tuples so that rpyc sends the completions by value
+            chunk = tuple(tuple(completion) for completion in chunk)
+            remote.set_tasks_completed(completions=chunk)
+
     def set_task_failed(self, task_id: str) -> None:
         remote: Any = self.conn.root
         return remote.set_task_failed(
@@ -229,6 +531,9 @@ class ControllerProxy:
         task_type: str,
         task_data_json: str,
         task_priority: int,
+        task_locality: Optional[str] = None,
+        task_group: Optional[str] = None,
+        task_queue: str = "",
     ) -> None:
         remote: Any = self.conn.root
         return remote.add_new_task(
@@ -236,16 +541,166 @@ class ControllerProxy:
             task_type=task_type,
             task_data_json=task_data_json,
             task_priority=task_priority,
+            task_locality=task_locality,
+            task_group=task_group,
+            task_queue=task_queue,
         )
 
+    def add_new_tasks(
+        self,
+        tasks: list[tdb.NewTaskType],
+        chunk_size: int = ADD_TASKS_CHUNK_SIZE,
+    ) -> list[str]:
+        """Add tasks in chunks; return ids of the duplicate tasks."""
+        remote: Any = self.conn.root
+        duplicates = []
+        for chunk in chunked(tasks, chunk_size):
+            # Send tuples so that rpyc sends the tasks by value
+            chunk = tuple(tuple(task) for task in chunk)
+            duplicates.extend(remote.add_new_tasks(tasks=chunk))
+        return duplicates
+
+    def get_runtime_estimates(
+        self,
+    ) -> list[tuple[str, Optional[str], int, float, int, float, Optional[int]]]:
+        remote: Any = self.conn.root
+        return [tuple(row) for row in remote.get_runtime_estimates()]
+
     def get_all_completed_tasks(self) -> list[tuple[str, str, str, str]]:
         remote: Any = self.conn.root
         return remote.get_all_completed_tasks()
 
+    def get_completed_since(
+        self, seq: int, limit: int, task_type: Optional[str] = None
+    ) -> tuple[tuple[int, str, str, str, str], ...]:
+        remote: Any = self.conn.root
+        return remote.get_completed_since(seq=seq, limit=limit, task_type=task_type)
+
+    def do_subscribe_completions(
+        self,
+        callback: Callable[[tuple[CompletedTaskType, ...]], Any],
+        task_type: Optional[str],
+        task_id_prefix: Optional[str],
+    ) -> None:
+        # The controller calls back over this connection,
+        # so someone needs to be serving it.
+        # The framed connection always has its reader thread running.
+        if self.bg_thread is None and self.transport == "rpyc":
+            self.bg_thread = rpyc.BgServingThread(self.conn)
+
+        remote: Any = self.conn.root
+        remote.subscribe_completions(
+            callback=callback, task_type=task_type, task_id_prefix=task_id_prefix
+        )
+
+    def subscribe_completions(
+        self,
+        callback: Callable[[tuple[CompletedTaskType, ...]], Any],
+        task_type: Optional[str] = None,
+        task_id_prefix: Optional[str] = None,
+    ) -> None:
+        """Have the controller push batches of completed tasks to callback."""
+        self.do_subscribe_completions(callback, task_type, task_id_prefix)
+        self.subscriptions.append((callback, task_type, task_id_prefix))
+
     def set_task_processed(self, task_id: str) -> None:
         remote: Any = self.conn.root
         return remote.set_task_processed(task_id=task_id)
 
+    # Operator - Controller Interaction
+
+    def get_status(self, window_minutes: int = STATUS_WINDOW_MINUTES) -> StatusType:
+        remote: Any = self.conn.root
+        status = remote.get_status(window_minutes=window_minutes)
+        now, task_counts, oldest_assigned_at, recent, recent_seconds = status
+        task_counts = tuple(tuple(row) for row in task_counts)
+        recent = tuple(tuple(row) for row in recent)
+        return cast(
+            StatusType,
+            (now, task_counts, oldest_assigned_at, recent, recent_seconds),
+        )
+
+
+class CompletedTaskFeed:
+    """Completed tasks pushed by the controller.
+
+    The controller is only polled when the feed is first started
+    and after every reconnect, to pick up completions
+    that happened while we were not subscribed.
+    """
+
+    def __init__(
+        self,
+        controller: ControllerProxy,
+        task_type: Optional[str] = None,
+        task_id_prefix: Optional[str] = None,
+        page_size: int = COMPLETED_PAGE_SIZE,
+    ):
+        self.controller = controller
+        self.task_type = task_type
+        self.task_id_prefix = task_id_prefix
+        self.page_size = page_size
+
+        self.seq = 0
+        self.do_poll = True
+        self.queue: Queue[tuple[CompletedTaskType, ...]] = Queue()
+
+        controller.subscribe_completions(
+            callback=self.queue.put,
+            task_type=task_type,
+            task_id_prefix=task_id_prefix,
+        )
+        controller.on_reconnect.append(self.set_do_poll)
+
+    def set_do_poll(self) -> None:
+        # Completions that were received but not yet processed
+        # may have been lost with the connection; start over,
+        # the controller only returns the unprocessed ones.
+        self.seq = 0
+        self.do_poll = True
+
+    def poll(self) -> list[CompletedTaskType]:
+        tasks = []
+        while True:
+            page = self.controller.get_completed_since(
+                seq=self.seq, limit=self.page_size, task_type=self.task_type
+            )
+            if not page:
+                return tasks
+
+            for task in page:
+                _, task_id, _, _, _ = task
+                if self.task_id_prefix is None or task_id.startswith(
+                    self.task_id_prefix
+                ):
+                    tasks.append(task)
+            self.seq = page[-1][0]
+
+    def get(self, timeout: float) -> list[CompletedTaskType]:
+        """Get the new completed tasks; wait at most timeout seconds."""
+        if self.do_poll:
+            self.do_poll = False
+            tasks = self.poll()
+        else:
+            tasks = []
+
+        pushed: list[CompletedTaskType] = []
+        try:
+            if not tasks:
+                pushed.extend(self.queue.get(timeout=timeout))
+            while True:
+                pushed.extend(self.queue.get_nowait())
+        except Empty:
+            pass
+
+        # Pushes arrive in sequence order;
+        # skip the ones we have already seen when polling.
+        for task in pushed:
+            if task[0] > self.seq:
+                tasks.append(task)
+                self.seq = task[0]
+        return tasks
+
 
 # End Main logic
 # =============================================================================
@@ -274,9 +729,14 @@ def handle_exception(
 
 
 def robust_connect(
-    host: str, port: int, key_file: str, cert_file: str, **kwargs
-) -> Connection:
-    """Try to connect to the rpyc server; try to handle failures."""
+    host: str,
+    port: int,
+    key_file: str,
+    cert_file: str,
+    transport: str = "rpyc",
+    **kwargs,
+) -> Any:
+    """Try to connect to the controller; try to handle failures."""
     start_time = time.monotonic()
     do_handle_exception = partial(
         handle_exception, start_time, CONNECT_RETRY_TIME, CONNECT_INTER_RETRY_TIME
@@ -284,6 +744,11 @@ def robust_connect(
 
     while True:
         try:
+            if transport == "framed":
+                return FramedConnection(
+                    host=host, port=port, key_file=key_file, cert_file=cert_file
+                )
+
             # return rpyc.connect(*args, **kwargs)
             return rpyc.ssl_connect(
                 host=host,
@@ -320,6 +785,32 @@ def robust_connect(
                 raise
 
 
+def lease_reaper(config: ControllerConfig) -> None:
+    """Periodically make the timed out tasks available again.
+
+    With speculation on, also make duplicates of the straggler tasks.
+    """
+    write_queue = get_write_queue()
+    dispatch = get_dispatch_index()
+
+    while True:
+        time.sleep(config.reaper_period)
+        try:
+            write_queue.execute(
+                lambda db_con: make_timeout_tasks_available(
+                    config=config, db_con=db_con, dispatch=dispatch
+                )
+            )
+            if config.speculation:
+                write_queue.execute(
+                    lambda db_con: make_speculative_tasks(
+                        config=config, db_con=db_con, dispatch=dispatch
+                    )
+                )
+        except Exception as e:
+            logger.error("lease reaper failed: %s", e, exc_info=e)
+
+
 @click.command()
 def controller():
     """Start the controller."""
@@ -327,30 +818,50 @@ def controller():
     config = get_controller_config()
 
     logger.info("initializing controller db")
-    db_con_path = config.setup_root / "controller.db"
-    db_con_path = str(db_con_path)
-    db_con = apsw.Connection(db_con_path)
-    db_con.execute("pragma busy_timeout=1800;")
-    sdb.init_setup_db(db_con)
-    tdb.init_task_db(db_con)
-    db_con.close()
-
-    authenticator = SSLAuthenticator(
-        keyfile=config.key_file,
-        certfile=config.cert_file,
-        ca_certs=config.cert_file,
-        cert_reqs=ssl.CERT_REQUIRED,
-        ssl_version=ssl.PROTOCOL_TLS_SERVER,
-    )
+    write_queue = get_write_queue()
+    write_queue.execute(sdb.init_setup_db)
+    write_queue.execute(tdb.init_task_db)
+
+    logger.info("loading dispatch index")
+    dispatch = get_dispatch_index()
+    write_queue.execute(dispatch.load)
+    # A failed group commit leaves the index ahead of the database
+    write_queue.on_rollback.append(dispatch.load)
+
+    write_queue.execute(metrics.TASKS.load)
+    write_queue.on_rollback.append(metrics.TASKS.load)
+
+    if config.controller_transport == "framed":
+        server = FramedServer(ControllerService, config)
+    else:
+        authenticator = SSLAuthenticator(
+            keyfile=config.key_file,
+            certfile=config.cert_file,
+            ca_certs=config.cert_file,
+            cert_reqs=ssl.CERT_REQUIRED,
+            ssl_version=ssl.PROTOCOL_TLS_SERVER,
+        )
 
-    server = ThreadedServer(
-        ControllerService,
-        hostname=config.controller_host,
-        port=config.controller_port,
-        authenticator=authenticator,
-    )
+        server = ThreadedServer(
+            ControllerService,
+            hostname=config.controller_host,
+            port=config.controller_port,
+            authenticator=authenticator,
+        )
+
+    logger.info("starting lease reaper")
+    reaper = Thread(target=lease_reaper, args=(config,), daemon=True)
+    reaper.start()
+
+    if config.metrics_port is not None:
+        logger.info(
+            "starting metrics server: host=%s, port=%d",
+            config.metrics_host,
+            config.metrics_port,
+        )
+        metrics.start_metrics_server(config.metrics_host, config.metrics_port)
 
-    logger.info("starting server")
+    logger.info("starting server: transport=%s", config.controller_transport)
     try:
         server.start()
     finally:
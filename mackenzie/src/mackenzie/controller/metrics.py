@@ -0,0 +1,311 @@
+"""Controller metrics in the Prometheus text format."""
+
+import time
+import bisect
+import logging
+import functools
+from threading import Lock, Thread
+from collections import defaultdict, deque
+from typing import Any, Callable, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import apsw
+
+from ..db import task_db as tdb
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+LabelsType = tuple[str, ...]
+
+
+def format_labels(names: LabelsType, values: LabelsType, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    if not parts:
+        return ""
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, labels: LabelsType = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = Lock()
+        self.values: dict[LabelsType, float] = defaultdict(float)
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self.lock:
+            self.values[label_values] += amount
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [
+            f"{self.name}{format_labels(self.labels, lv)} {v}"
+            for lv, v in sorted(values.items())
+        ]
+
+
+class Gauge(Counter):
+    """A value per label set that can go up and down."""
+
+    type_name = "gauge"
+
+    def set(self, *label_values: str, value: float) -> None:
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label set."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: LabelsType = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = Lock()
+        # bucket counts (+ the +Inf bucket), sum
+        self.values: dict[LabelsType, tuple[list[int], list[float]]] = {}
+
+    def observe(self, *label_values: str, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self.values[label_values]
+            counts[idx] += 1
+            total[0] += value
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = {lv: (list(c), t[0]) for lv, (c, t) in self.values.items()}
+
+        ret = []
+        for lv, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for le, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le_str = "+Inf" if le == float("inf") else repr(le)
+                labels = format_labels(self.labels, lv, f'le="{le_str}"')
+                ret.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, lv)
+            ret.append(f"{self.name}_sum{labels} {total}")
+            ret.append(f"{self.name}_count{labels} {cumulative}")
+        return ret
+
+
+class TaskCounts(Gauge):
+    """Number of tasks per state, cluster and task type.
+
+    The counts are loaded from the task table once
+    and then moved along with every task state change made by the writer.
+    """
+
+    def load(self, con: apsw.Connection) -> None:
+        counts = tdb.get_task_counts(con)
+        with self.lock:
+            self.values.clear()
+            for task_state, assigned_to, task_type, num_tasks in counts:
+                self.values[(task_state, assigned_to, task_type)] = num_tasks
+
+    def move(
+        self,
+        old: Optional[tuple[str, str, str]],
+        new: Optional[tuple[str, str, str]],
+        amount: int = 1,
+    ) -> None:
+        with self.lock:
+            if old is not None:
+                self.values[old] -= amount
+            if new is not None:
+                self.values[new] += amount
+
+    def snapshot(self) -> list[tuple[str, str, str, int]]:
+        """Get the non zero counts."""
+        with self.lock:
+            values = dict(self.values)
+        return [(*lv, int(v)) for lv, v in sorted(values.items()) if v]
+
+
+class RecentCounter:
+    """Counts per label set in one minute buckets over the last max_minutes."""
+
+    def __init__(self, max_minutes: int):
+        self.max_minutes = max_minutes
+        self.lock = Lock()
+        self.buckets: deque[tuple[int, dict[str, int]]] = deque()
+        self.started_at = time.time()
+
+    def inc(self, label: str, amount: int = 1) -> None:
+        minute = int(time.time()) // 60
+        with self.lock:
+            if not self.buckets or self.buckets[-1][0] != minute:
+                self.buckets.append((minute, defaultdict(int)))
+                while self.buckets[0][0] <= minute - self.max_minutes:
+                    self.buckets.popleft()
+            self.buckets[-1][1][label] += amount
+
+    def total(self, minutes: int) -> dict[str, int]:
+        """Sum the counts of the last minutes, including the current one."""
+        since = int(time.time()) // 60 - min(minutes, self.max_minutes)
+        ret: dict[str, int] = defaultdict(int)
+        with self.lock:
+            for minute, counts in self.buckets:
+                if minute > since:
+                    for label, count in counts.items():
+                        ret[label] += count
+        return dict(ret)
+
+    def covered_seconds(self, minutes: int) -> float:
+        """Get the seconds that total(minutes) has been counting for."""
+        now = time.time()
+        since = (int(now) // 60 - min(minutes, self.max_minutes) + 1) * 60
+        return max(now - max(since, self.started_at), 1.0)
+
+
+TASKS = TaskCounts(
+    "mackenzie_tasks",
+    "Number of tasks by state, cluster and task type.",
+    ("state", "cluster", "task_type"),
+)
+RECENT_COMPLETIONS = RecentCounter(max_minutes=60)
+TASK_RECLAIMS = Counter(
+    "mackenzie_task_reclaims_total", "Timed out tasks made available again."
+)
+LEASE_ORPHANS = Counter(
+    "mackenzie_lease_orphans_total",
+    "Tasks a cluster renewed the lease of after they were taken from it.",
+    ("cluster",),
+)
+SPECULATIVE_TASKS = Counter(
+    "mackenzie_speculative_tasks_total",
+    "Speculative duplicates made available for straggler tasks.",
+)
+TASK_COMPLETIONS = Counter(
+    "mackenzie_task_completions_total", "Tasks completed.", ("task_type",)
+)
+RPC_LATENCY = Histogram(
+    "mackenzie_rpc_latency_seconds", "Latency of the exposed RPCs.", ("method",)
+)
+RPC_ERRORS = Counter(
+    "mackenzie_rpc_errors_total", "Exposed RPCs that raised.", ("method",)
+)
+WRITE_QUEUE_WAIT = Histogram(
+    "mackenzie_write_queue_wait_seconds",
+    "Time a mutation waited in the write queue before it was run.",
+)
+GROUP_COMMIT_LATENCY = Histogram(
+    "mackenzie_group_commit_seconds", "Time taken to run and commit a group."
+)
+GROUP_COMMIT_SIZE = Histogram(
+    "mackenzie_group_commit_size",
+    "Number of mutations per group commit.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+SETUP_BYTES = Counter(
+    "mackenzie_setup_bytes_total", "Setup bytes transferred.", ("direction",)
+)
+
+ALL_METRICS: list[Any] = [
+    TASKS,
+    TASK_RECLAIMS,
+    LEASE_ORPHANS,
+    SPECULATIVE_TASKS,
+    TASK_COMPLETIONS,
+    RPC_LATENCY,
+    RPC_ERRORS,
+    WRITE_QUEUE_WAIT,
+    GROUP_COMMIT_LATENCY,
+    GROUP_COMMIT_SIZE,
+    SETUP_BYTES,
+]
+
+
+def render() -> str:
+    """Render all metrics in the Prometheus text format."""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def timed_rpc(method: str, func: Callable) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            RPC_ERRORS.inc(method)
+            raise
+        finally:
+            RPC_LATENCY.observe(method, value=time.perf_counter() - start)
+
+    return wrapper
+
+
+def instrument_service(cls):
+    """Record the latency of every exposed method of an rpyc service."""
+    for attr, func in list(vars(cls).items()):
+        if attr.startswith("exposed_") and callable(func):
+            setattr(cls, attr, timed_rpc(attr.removeprefix("exposed_"), func))
+    return cls
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve /metrics from a background thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
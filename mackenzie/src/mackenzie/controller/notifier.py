@@ -0,0 +1,115 @@
+"""Push completed tasks to subscribed task sources."""
+
+import logging
+from queue import Queue, Empty
+from threading import Lock, Thread
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+CompletedTaskType = tuple[int, str, str, str, str]
+
+
+class Subscription:
+    """A single subscriber to completed tasks.
+
+    Every subscription is served by its own thread,
+    so that a slow subscriber can't hold up the others
+    or the RPC that completed the task.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[tuple[CompletedTaskType, ...]], Any],
+        task_type: Optional[str],
+        task_id_prefix: Optional[str],
+        on_failed: Callable[["Subscription"], Any],
+    ):
+        self.callback = callback
+        self.task_type = task_type
+        self.task_id_prefix = task_id_prefix
+        self.on_failed = on_failed
+
+        self.queue: Queue[Optional[CompletedTaskType]] = Queue()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def matches(self, task_id: str, task_type: str) -> bool:
+        if self.task_type is not None and task_type != self.task_type:
+            return False
+        if self.task_id_prefix is not None and not task_id.startswith(
+            self.task_id_prefix
+        ):
+            return False
+        return True
+
+    def close(self) -> None:
+        self.queue.put(None)
+
+    def run(self) -> None:
+        closed = False
+        while not closed:
+            task = self.queue.get()
+            if task is None:
+                return
+
+            # Send everything that has piled up as one batch,
+            # including what arrived just before the subscription was closed
+            batch = [task]
+            try:
+                while True:
+                    task = self.queue.get_nowait()
+                    if task is None:
+                        closed = True
+                        break
+                    batch.append(task)
+            except Empty:
+                pass
+
+            try:
+                self.callback(tuple(batch))
+            except Exception as e:
+                logger.warning("failed to notify subscriber: %s", e)
+                # Stop queueing tasks that nobody will consume
+                self.on_failed(self)
+                return
+
+
+class CompletionNotifier:
+    """Registry of subscribers to completed tasks."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.subscriptions: list[Subscription] = []
+
+    def subscribe(
+        self,
+        callback: Callable[[tuple[CompletedTaskType, ...]], Any],
+        task_type: Optional[str],
+        task_id_prefix: Optional[str],
+    ) -> Subscription:
+        logger.info(
+            "new subscription: task_type=%s, task_id_prefix=%s",
+            task_type,
+            task_id_prefix,
+        )
+        sub = Subscription(callback, task_type, task_id_prefix, self.unsubscribe)
+        with self.lock:
+            self.subscriptions.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self.lock:
+            if sub in self.subscriptions:
+                self.subscriptions.remove(sub)
+        sub.close()
+
+    def publish(self, tasks: list[CompletedTaskType]) -> None:
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+
+        for task in tasks:
+            _, task_id, task_type, _, _ = task
+            for sub in subscriptions:
+                if sub.matches(task_id, task_type):
+                    sub.queue.put(task)
@@ -0,0 +1,151 @@
+"""Group commit write queue for the controller database."""
+
+import time
+import logging
+from queue import Queue, Empty
+from threading import Thread
+from concurrent.futures import Future
+from typing import Any, Callable, Optional, TypeVar
+
+import apsw
+
+from .config import get_controller_config
+from .db_pool import get_db_pool
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MutationType = Callable[[apsw.Connection], Any]
+OnCommitType = Callable[[Any], None]
+# mutation, on_commit, future, queued_at
+QueueItemType = tuple[MutationType, Optional[OnCommitType], Future, float]
+
+
+class WriteQueue:
+    """A single writer thread that commits queued mutations in groups.
+
+    The writer waits at most commit_interval seconds after the first mutation
+    for more mutations to arrive and then runs all of them in one transaction.
+    With a zero commit_interval a group is whatever got queued
+    while the previous group was being committed.
+    Every mutation runs in its own savepoint,
+    so a failing mutation doesn't abort the rest of the group.
+    The callers' futures are resolved only after the group has been committed.
+
+    If the group commit itself fails the on_rollback callbacks are run
+    in a new transaction, so that in memory state kept in step
+    with the database can be reloaded.
+    """
+
+    def __init__(self, db_con: apsw.Connection, commit_interval: float, max_batch: int):
+        self.db_con = db_con
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+
+        self.queue: Queue[QueueItemType] = Queue()
+        self.on_rollback: list[MutationType] = []
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(
+        self, mutation: MutationType, on_commit: Optional[OnCommitType] = None
+    ) -> Future:
+        """Queue a mutation.
+
+        If given, on_commit is called with the result of the mutation
+        in the writer thread right after the commit,
+        in the same order in which the mutations were committed.
+        """
+        future = Future()
+        self.queue.put((mutation, on_commit, future, time.monotonic()))
+        return future
+
+    def execute(
+        self,
+        mutation: Callable[[apsw.Connection], T],
+        on_commit: Optional[OnCommitType] = None,
+    ) -> T:
+        """Queue a mutation and wait for it to be committed."""
+        return self.submit(mutation, on_commit).result()
+
+    def get_batch(self) -> list[QueueItemType]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.commit_interval
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def commit(self, batch: list[QueueItemType]) -> None:
+        start = time.monotonic()
+        metrics.GROUP_COMMIT_SIZE.observe(value=len(batch))
+
+        results = []
+        try:
+            with self.db_con:
+                for mutation, on_commit, future, queued_at in batch:
+                    metrics.WRITE_QUEUE_WAIT.observe(value=time.monotonic() - queued_at)
+                    try:
+                        with self.db_con:
+                            result = mutation(self.db_con)
+                        results.append((on_commit, future, result, None))
+                    except Exception as e:
+                        results.append((None, future, None, e))
+        except Exception as e:
+            logger.error("group commit failed: %s", e, exc_info=e)
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            self.rollback()
+            return
+
+        metrics.GROUP_COMMIT_LATENCY.observe(value=time.monotonic() - start)
+
+        for on_commit, future, result, exc in results:
+            if exc is not None:
+                future.set_exception(exc)
+                continue
+
+            if on_commit is not None:
+                try:
+                    on_commit(result)
+                except Exception as e:
+                    logger.error("on commit callback failed: %s", e, exc_info=e)
+            future.set_result(result)
+
+    def rollback(self) -> None:
+        for on_rollback in self.on_rollback:
+            try:
+                with self.db_con:
+                    on_rollback(self.db_con)
+            except Exception as e:
+                logger.error("on rollback callback failed: %s", e, exc_info=e)
+
+    def run(self) -> None:
+        while True:
+            batch = self.get_batch()
+            self.commit(batch)
+
+
+_WRITE_QUEUE: Optional[WriteQueue] = None
+
+
+def get_write_queue() -> WriteQueue:
+    global _WRITE_QUEUE
+
+    if _WRITE_QUEUE is None:
+        config = get_controller_config()
+        _WRITE_QUEUE = WriteQueue(
+            db_con=get_db_pool().writer,
+            commit_interval=config.commit_interval,
+            max_batch=config.commit_max_batch,
+        )
+
+    return _WRITE_QUEUE
@@ -1,5 +1,19 @@
 """Common db utils."""
 
+import apsw
+
+
 class UnexpectedCase(RuntimeError):
     def __init__(self, other):
         super().__init__("Unexpected case: %r" % other)
+
+
+def add_column_if_missing(
+    con: apsw.Connection, table: str, column: str, column_def: str
+) -> bool:
+    """Add a column to a table created by an older version; return if added."""
+    columns = [row[1] for row in con.execute(f"pragma table_info({table})")]
+    if column in columns:
+        return False
+    con.execute(f"alter table {table} add column {column} {column_def}")
+    return True
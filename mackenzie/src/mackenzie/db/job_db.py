@@ -1,10 +1,10 @@
 """Slurm job database."""
 
-from typing import cast
+from typing import Optional, cast
 
 import apsw
 
-from .db_common import UnexpectedCase
+from .db_common import UnexpectedCase, add_column_if_missing
 
 
 def init_job_db(con: apsw.Connection) -> None:
@@ -35,13 +35,22 @@ def init_job_db(con: apsw.Connection) -> None:
 
         start_time bigint,
         end_time bigint,
-        sacct_info text
+        sacct_info text,
+
+        elapsed bigint,
+        queue_wait bigint,
+        max_rss bigint
     );
 
     create index if not exists slurm_job_job_id on slurm_job (job_id);
     """
     con.execute(sql)
 
+    # Columns added after the first release
+    add_column_if_missing(con, "slurm_job", "elapsed", "bigint")
+    add_column_if_missing(con, "slurm_job", "queue_wait", "bigint")
+    add_column_if_missing(con, "slurm_job", "max_rss", "bigint")
+
 
 def add_job(
     con: apsw.Connection,
@@ -49,30 +58,88 @@ def add_job(
     job_type: str,
     job_data: str,
     job_priority: int,
-    sbatch_script: str,
-    load: int,
+    load: Optional[int],
     max_fails: int,
 ) -> None:
+    """Add a job that still needs to be set up.
+
+    load is an estimate, or None if unknown, until the setup reports it.
+    """
     sql = """
         insert into job values (
             ?,?,?,?,
-            ?,?,?,
+            null,?,?,
             null,
-            null,'ready',0)
+            null,'setup',0)
         """
-    con.execute(
-        sql,
-        (job_id, job_type, job_data, job_priority, sbatch_script, load, max_fails),
-    )
+    con.execute(sql, (job_id, job_type, job_data, job_priority, load, max_fails))
+
+
+def get_setup_jobs(con: apsw.Connection) -> list[tuple[str, str, str]]:
+    """Get the id, type and data of the jobs that need to be set up."""
+    sql = """
+        select job_id, job_type, job_data
+        from job
+        where job_state = 'setup'
+        order by job_priority desc, job_id asc
+        """
+    cur = con.execute(sql)
+    ret = []
+    for job_id, job_type, job_data in cur:
+        job_id = cast(str, job_id)
+        job_type = cast(str, job_type)
+        job_data = cast(str, job_data)
+        ret.append((job_id, job_type, job_data))
+    return ret
+
+
+def set_job_setup(con: apsw.Connection, job_id: str) -> None:
+    sql = """
+        update job
+        set job_state = 'setup'
+        where job_id = ?
+        """
+    con.execute(sql, (job_id,))
+
+
+def set_job_ready(
+    con: apsw.Connection, job_id: str, sbatch_script: str, load: int, max_fails: int
+) -> None:
+    sql = """
+        update job
+        set sbatch_script = ?, load = ?, max_fails = ?, job_state = 'ready'
+        where job_id = ? and job_state = 'setup'
+        """
+    con.execute(sql, (sbatch_script, load, max_fails, job_id))
 
 
-def set_job_ready(con: apsw.Connection, job_id: str, sbatch_script: str) -> None:
+def set_job_submitting(con: apsw.Connection, job_id: str) -> None:
     sql = """
         update job
-        set sbatch_script = ?, job_state = 'ready' 
+        set job_state = 'submitting'
         where job_id = ?
         """
-    con.execute(sql, (sbatch_script, job_id))
+    con.execute(sql, (job_id,))
+
+
+def set_job_submit_lost(con: apsw.Connection, job_id: str) -> None:
+    """Move a job whose submission never reached Slurm back to ready."""
+    sql = """
+        update job
+        set job_state = 'ready'
+        where job_id = ? and job_state = 'submitting'
+        """
+    con.execute(sql, (job_id,))
+
+
+def get_submitting_job_ids(con: apsw.Connection) -> list[str]:
+    sql = """
+        select job_id
+        from job
+        where job_state = 'submitting'
+        """
+    cur = con.execute(sql)
+    return [cast(str, job_id) for job_id, in cur]
 
 
 def set_job_running(con: apsw.Connection, job_id: str, slurm_job_id: int) -> None:
@@ -102,7 +169,7 @@ def set_job_failed(con: apsw.Connection, job_id: str) -> None:
 def set_job_completed(con: apsw.Connection, job_id: str, job_result: str) -> None:
     sql = """
         update job
-        set job_state = 'completed' and job_result = ?
+        set job_state = 'completed', job_result = ?
         where job_id = ?
         """
     con.execute(sql, (job_result, job_id))
@@ -117,6 +184,25 @@ def set_job_processed(con: apsw.Connection, job_id: str) -> None:
     con.execute(sql, (job_id,))
 
 
+def get_job_state(
+    con: apsw.Connection, job_id: str
+) -> Optional[tuple[str, Optional[int]]]:
+    """Get the job state and its current slurm job id."""
+    sql = """
+        select job_state, slurm_job_id
+        from job
+        where job_id = ?
+        """
+    cur = con.execute(sql, (job_id,))
+    match cur.fetchall():
+        case [[job_state, slurm_job_id]]:
+            return (cast(str, job_state), cast(Optional[int], slurm_job_id))
+        case []:
+            return None
+        case other:
+            raise UnexpectedCase(other)
+
+
 def set_job_aborted(con: apsw.Connection, job_id: str) -> None:
     sql = """
         update job
@@ -129,26 +215,53 @@ def set_job_aborted(con: apsw.Connection, job_id: str) -> None:
 def add_slurm_job(
     con: apsw.Connection, slurm_job_id: int, job_id: str, start_time: int
 ) -> None:
-    sql = "insert into slurm_job values (?,?, ?,null,null)"
+    sql = """
+        insert into slurm_job (slurm_job_id, job_id, start_time)
+        values (?,?,?)
+        """
     con.execute(sql, (slurm_job_id, job_id, start_time))
 
 
+def get_slurm_job_ids(con: apsw.Connection, job_id: str) -> list[int]:
+    """Get the ids of the slurm jobs submitted for the job so far."""
+    sql = """
+        select slurm_job_id
+        from slurm_job
+        where job_id = ?
+        """
+    cur = con.execute(sql, (job_id,))
+    return [cast(int, slurm_job_id) for slurm_job_id, in cur]
+
+
 def set_slurm_job_completion_info(
-    con: apsw.Connection, slurm_job_id: int, end_time: int, sacct_info: str
+    con: apsw.Connection,
+    slurm_job_id: int,
+    end_time: int,
+    sacct_info: str,
+    elapsed: Optional[int],
+    queue_wait: Optional[int],
+    max_rss: Optional[int],
 ) -> None:
     sql = """
         update slurm_job
-        set end_time = ? and sacct_info = ?
+        set
+            end_time = ?,
+            sacct_info = ?,
+            elapsed = ?,
+            queue_wait = ?,
+            max_rss = ?
         where slurm_job_id = ?
         """
-    con.execute(sql, (end_time, sacct_info, slurm_job_id))
+    con.execute(
+        sql, (end_time, sacct_info, elapsed, queue_wait, max_rss, slurm_job_id)
+    )
 
 
 def count_live_jobs(con: apsw.Connection) -> int:
     sql = """
         select count(*)
         from job
-        where job_state in ('ready','running','failed')
+        where job_state in ('setup','ready','submitting','running','failed')
         """
     cur = con.execute(sql)
     match cur.fetchall():
@@ -158,11 +271,21 @@ def count_live_jobs(con: apsw.Connection) -> int:
             raise UnexpectedCase(other)
 
 
+def get_live_job_ids(con: apsw.Connection) -> list[str]:
+    sql = """
+        select job_id
+        from job
+        where job_state in ('setup','ready','submitting','running','failed')
+        """
+    cur = con.execute(sql)
+    return [cast(str, job_id) for job_id, in cur]
+
+
 def get_running_load(con: apsw.Connection) -> int:
     sql = """
         select sum(load)
         from job
-        where job_state = 'running'
+        where job_state in ('submitting', 'running')
         """
     cur = con.execute(sql)
     match cur.fetchall():
@@ -174,13 +297,32 @@ def get_running_load(con: apsw.Connection) -> int:
             raise UnexpectedCase(other)
 
 
-def get_live_load(con: apsw.Connection) -> int:
+def get_max_live_load(con: apsw.Connection) -> Optional[int]:
+    """Get the largest known load of the live jobs."""
     sql = """
-        select sum(load)
+        select max(load)
         from job
-        where job_state in ('running', 'ready', 'failed')
+        where job_state in ('setup', 'ready', 'submitting', 'running', 'failed')
         """
     cur = con.execute(sql)
+    match cur.fetchall():
+        case [[max_load]]:
+            return cast(Optional[int], max_load)
+        case other:
+            raise UnexpectedCase(other)
+
+
+def get_live_load(con: apsw.Connection, unknown_load: int = 1) -> int:
+    """Get the load of the live jobs.
+
+    Jobs whose load is not known yet count as unknown_load.
+    """
+    sql = """
+        select sum(coalesce(load, ?))
+        from job
+        where job_state in ('setup', 'ready', 'submitting', 'running', 'failed')
+        """
+    cur = con.execute(sql, (unknown_load,))
     match cur.fetchall():
         case [[None]]:
             return 0
@@ -31,6 +31,13 @@ def get_all_setup_names(con: apsw.Connection) -> list[str]:
     return setup_names
 
 
+def get_all_setups(con: apsw.Connection) -> list[tuple[str, str]]:
+    sql = "select setup_name, setup_hash from setup"
+    cur = con.execute(sql)
+    setups = [(cast(str, n), cast(str, h)) for n, h in cur]
+    return setups
+
+
 def get_setup_hash(con: apsw.Connection, setup_name: str) -> Optional[str]:
     sql = """
     select setup_hash
@@ -41,7 +48,7 @@ def get_setup_hash(con: apsw.Connection, setup_name: str) -> Optional[str]:
     match cur.fetchall():
         case [[setup_hash]]:
             return cast(str, setup_hash)
-        case None:
+        case []:
             return None
         case other:
             raise UnexpectedCase(other)
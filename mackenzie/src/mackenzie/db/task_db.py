@@ -1,10 +1,15 @@
 """Task database."""
 
+import json
 from typing import Optional, cast
 
 import apsw
 
-from .db_common import UnexpectedCase
+from .db_common import UnexpectedCase, add_column_if_missing
+
+# task_id, task_type, task_data, task_priority,
+# task_locality, task_group, task_queue
+NewTaskType = tuple[str, str, str, int, Optional[str], Optional[str], str]
 
 
 def init_task_db(con: apsw.Connection) -> None:
@@ -19,10 +24,64 @@ def init_task_db(con: apsw.Connection) -> None:
         
         task_state text,
         assigned_to text,
-        assigned_at bigint
+        assigned_at bigint,
+        heartbeat_at bigint,
+
+        completed_seq bigint,
+        completed_at bigint,
+
+        task_locality text,
+
+        task_group text,
+        speculative_of text,
+
+        task_queue text not null default ''
     );
+    """
 
+    con.execute(sql)
+
+    # Columns added after the first release
+    add_column_if_missing(con, "task", "completed_seq", "bigint")
+    add_column_if_missing(con, "task", "task_locality", "text")
+    if add_column_if_missing(con, "task", "heartbeat_at", "bigint"):
+        sql = """
+        update task
+        set heartbeat_at = assigned_at
+        where task_state = 'assigned'
+        """
+        con.execute(sql)
+    add_column_if_missing(con, "task", "completed_at", "bigint")
+    add_column_if_missing(con, "task", "task_group", "text")
+    add_column_if_missing(con, "task", "speculative_of", "text")
+    add_column_if_missing(con, "task", "task_queue", "text not null default ''")
+
+    sql = """
     create index if not exists task_state on task (task_state);
+    create index if not exists task_dispatch on task (task_state, task_priority desc, task_id);
+    create index if not exists task_completed_seq on task (completed_seq);
+    drop index if exists task_assigned_at;
+    create index if not exists task_heartbeat_at on task (task_state, heartbeat_at)
+        where task_state = 'assigned';
+    create index if not exists task_assigned_since on task (assigned_at)
+        where task_state = 'assigned';
+    create index if not exists task_group on task (task_group)
+        where task_group is not null;
+    create index if not exists task_speculative_of on task (speculative_of)
+        where speculative_of is not null;
+
+    create table if not exists runtime_estimate (
+        task_type text,
+        task_locality text,
+
+        num_samples int,
+        total_elapsed bigint,
+        max_elapsed bigint,
+        total_queue_wait bigint,
+        max_rss bigint,
+
+        primary key (task_type, task_locality)
+    );
     """
 
     con.execute(sql)
@@ -34,27 +93,90 @@ def add_new_task(
     task_type: str,
     task_data: str,
     task_priority: int,
+    task_locality: Optional[str] = None,
+    task_group: Optional[str] = None,
+    task_queue: str = "",
 ) -> None:
     sql = """
-        insert into task values (
-            ?,?,?,?,
-            null,
-            'available',null,null
+        insert into task (
+            task_id, task_type, task_data, task_priority,
+            task_locality, task_group, task_queue,
+            task_state
         )
+        values (?,?,?,?, ?,?,?, 'available')
         """
     con.execute(
         sql,
-        (task_id, task_type, task_data, task_priority),
+        (
+            task_id,
+            task_type,
+            task_data,
+            task_priority,
+            task_locality,
+            task_group,
+            task_queue,
+        ),
     )
 
 
-def set_task_available(con: apsw.Connection, task_id: str) -> None:
+def add_new_tasks(
+    con: apsw.Connection, tasks: list[NewTaskType]
+) -> tuple[list[NewTaskType], list[str]]:
+    """Add new tasks; return the added tasks and the ids of the duplicate tasks."""
+    sql = """
+        select task_id
+        from task
+        where task_id in (select value from json_each(?))
+        """
+    task_ids = [task[0] for task in tasks]
+    cur = con.execute(sql, (json.dumps(task_ids),))
+    seen = set(cast(str, task_id) for task_id, in cur)
+
+    new_tasks = []
+    duplicates = []
+    for task in tasks:
+        if task[0] in seen:
+            duplicates.append(task[0])
+        else:
+            seen.add(task[0])
+            new_tasks.append(task)
+
+    sql = """
+        insert into task (
+            task_id, task_type, task_data, task_priority,
+            task_locality, task_group, task_queue,
+            task_state
+        )
+        values (?,?,?,?, ?,?,?, 'available')
+        """
+    con.executemany(sql, new_tasks)
+    return new_tasks, duplicates
+
+
+def set_task_available(
+    con: apsw.Connection, task_id: str
+) -> tuple[int, Optional[str], str, str]:
+    """Set the task available; return its priority, locality, queue and type."""
     sql = """
         update task
-        set task_state = 'available', assigned_to = null, assigned_at = null
+        set
+            task_state = 'available',
+            assigned_to = null,
+            assigned_at = null,
+            heartbeat_at = null
         where task_id = ?
+        returning task_priority, task_locality, task_queue, task_type
         """
-    con.execute(sql, (task_id,))
+    cur = con.execute(sql, (task_id,))
+    match cur.fetchall():
+        case [[task_priority, task_locality, task_queue, task_type]]:
+            task_priority = cast(int, task_priority)
+            task_locality = cast(Optional[str], task_locality)
+            task_queue = cast(str, task_queue)
+            task_type = cast(str, task_type)
+            return (task_priority, task_locality, task_queue, task_type)
+        case other:
+            raise UnexpectedCase(other)
 
 
 def set_task_assigned(
@@ -62,19 +184,47 @@ def set_task_assigned(
 ) -> None:
     sql = """
         update task
-        set task_state = 'assigned', assigned_to = ?, assigned_at = ?
+        set task_state = 'assigned', assigned_to = ?, assigned_at = ?, heartbeat_at = ?
         where task_id = ?
         """
-    con.execute(sql, (assigned_to, assigned_at, task_id))
+    con.execute(sql, (assigned_to, assigned_at, assigned_at, task_id))
+
 
+def set_task_completed(
+    con: apsw.Connection,
+    task_id: str,
+    task_result: str,
+    completed_at: int,
+    assigned_at: Optional[int] = None,
+) -> Optional[tuple[int, str, str]]:
+    """Set the task completed; return its completed_seq, task_type and task_data.
 
-def set_task_completed(con: apsw.Connection, task_id: str, task_result: str) -> None:
+    If given, assigned_at replaces the start of the task,
+    for a result that came from another attempt than the assigned one.
+    Tasks that are already completed are left alone.
+    """
     sql = """
         update task
-        set task_state = 'completed', task_result = ?
-        where task_id = ?
+        set
+            task_state = 'completed',
+            task_result = ?,
+            completed_seq = (select coalesce(max(completed_seq), 0) + 1 from task),
+            completed_at = ?,
+            assigned_at = coalesce(?, assigned_at)
+        where task_id = ? and task_state not in ('completed', 'processed')
+        returning completed_seq, task_type, task_data
         """
-    con.execute(sql, (task_result, task_id))
+    cur = con.execute(sql, (task_result, completed_at, assigned_at, task_id))
+    match cur.fetchall():
+        case [[completed_seq, task_type, task_data]]:
+            completed_seq = cast(int, completed_seq)
+            task_type = cast(str, task_type)
+            task_data = cast(str, task_data)
+            return (completed_seq, task_type, task_data)
+        case []:
+            return None
+        case other:
+            raise UnexpectedCase(other)
 
 
 def set_task_failed(con: apsw.Connection, task_id: str) -> None:
@@ -86,6 +236,15 @@ def set_task_failed(con: apsw.Connection, task_id: str) -> None:
     con.execute(sql, (task_id,))
 
 
+def set_task_cancelled(con: apsw.Connection, task_id: str) -> None:
+    sql = """
+        update task
+        set task_state = 'cancelled'
+        where task_id = ? and task_state in ('available', 'assigned', 'failed')
+        """
+    con.execute(sql, (task_id,))
+
+
 def set_task_processed(con: apsw.Connection, task_id: str) -> None:
     sql = """
         update task
@@ -95,17 +254,133 @@ def set_task_processed(con: apsw.Connection, task_id: str) -> None:
     con.execute(sql, (task_id,))
 
 
-def get_single_available_task(
-    con: apsw.Connection,
-) -> Optional[tuple[str, str, str, int]]:
+def get_task_state(
+    con: apsw.Connection, task_id: str
+) -> Optional[tuple[str, str, str]]:
+    """Get the task state, the cluster the task was assigned to and the task type."""
     sql = """
-        select task_id, task_type, task_data, task_priority
+        select task_state, coalesce(assigned_to, ''), task_type
         from task
-        where task_state = 'available'
-        order by task_priority desc
-        limit 1
+        where task_id = ?
+        """
+    cur = con.execute(sql, (task_id,))
+    match cur.fetchall():
+        case [[task_state, assigned_to, task_type]]:
+            return (cast(str, task_state), cast(str, assigned_to), cast(str, task_type))
+        case []:
+            return None
+        case other:
+            raise UnexpectedCase(other)
+
+
+def get_assigned_at(con: apsw.Connection, task_id: str) -> Optional[int]:
+    """Get the time the task was last assigned."""
+    sql = """
+        select assigned_at
+        from task
+        where task_id = ?
+        """
+    cur = con.execute(sql, (task_id,))
+    match cur.fetchall():
+        case [[assigned_at]]:
+            return cast(Optional[int], assigned_at)
+        case []:
+            return None
+        case other:
+            raise UnexpectedCase(other)
+
+
+def get_task_counts(con: apsw.Connection) -> list[tuple[str, str, str, int]]:
+    """Count the tasks by state, the cluster they were assigned to and type."""
+    sql = """
+        select task_state, coalesce(assigned_to, ''), task_type, count(*)
+        from task
+        group by task_state, assigned_to, task_type
+        """
+    cur = con.execute(sql)
+    ret = []
+    for (task_state, assigned_to, task_type, num_tasks) in cur:
+        task_state = cast(str, task_state)
+        assigned_to = cast(str, assigned_to)
+        task_type = cast(str, task_type)
+        num_tasks = cast(int, num_tasks)
+        ret.append((task_state, assigned_to, task_type, num_tasks))
+    return ret
+
+
+def get_oldest_assigned_at(con: apsw.Connection) -> Optional[int]:
+    """Get the assignment time of the longest assigned task."""
+    sql = """
+        select min(assigned_at)
+        from task
+        where task_state = 'assigned'
         """
     cur = con.execute(sql)
+    match cur.fetchall():
+        case [[assigned_at]]:
+            return cast(Optional[int], assigned_at)
+        case other:
+            raise UnexpectedCase(other)
+
+
+def get_timeout_tasks(
+    con: apsw.Connection, heartbeat_before: int
+) -> list[tuple[str, int, str]]:
+    """Get the assigned tasks whose last heartbeat is before heartbeat_before."""
+    sql = """
+        select task_id, heartbeat_at, assigned_to
+        from task
+        where task_state = 'assigned' and heartbeat_at < ?
+        """
+    cur = con.execute(sql, (heartbeat_before,))
+    ret = []
+    for (task_id, heartbeat_at, assigned_to) in cur:
+        task_id = cast(str, task_id)
+        heartbeat_at = cast(int, heartbeat_at)
+        assigned_to = cast(str, assigned_to)
+        ret.append((task_id, heartbeat_at, assigned_to))
+    return ret
+
+
+def renew_task_leases(
+    con: apsw.Connection, assigned_to: str, task_ids: list[str], heartbeat_at: int
+) -> list[str]:
+    """Renew the leases of the tasks; return ids of the tasks not assigned_to."""
+    sql = """
+        update task
+        set heartbeat_at = ?
+        where
+            task_id in (select value from json_each(?))
+            and task_state = 'assigned'
+            and assigned_to = ?
+        returning task_id
+        """
+    cur = con.execute(sql, (heartbeat_at, json.dumps(task_ids), assigned_to))
+    renewed = set(cast(str, task_id) for task_id, in cur)
+    return [task_id for task_id in task_ids if task_id not in renewed]
+
+
+def claim_task(
+    con: apsw.Connection, task_id: str, assigned_to: str, assigned_at: int
+) -> Optional[tuple[str, str, str, int]]:
+    """Assign the task if it is still available; return the assigned task."""
+    sql = """
+        update task
+        set task_state = 'assigned', assigned_to = ?, assigned_at = ?, heartbeat_at = ?
+        where
+            task_id = ?
+            and task_state = 'available'
+            and not exists (
+                select 1
+                from task as original
+                where original.task_id = task.speculative_of
+                    and original.assigned_to = ?
+            )
+        returning task_id, task_type, task_data, task_priority
+        """
+    cur = con.execute(
+        sql, (assigned_to, assigned_at, assigned_at, task_id, assigned_to)
+    )
     match cur.fetchall():
         case [[task_id, task_type, task_data, task_priority]]:
             task_id = cast(str, task_id)
@@ -119,6 +394,224 @@ def get_single_available_task(
             raise UnexpectedCase(other)
 
 
+def get_speculative_pair(
+    con: apsw.Connection, task_id: str
+) -> Optional[tuple[str, str]]:
+    """Get the original and duplicate task ids of a speculative pair."""
+    sql = """
+        select speculative_of, task_id
+        from task
+        where task_id = ? and speculative_of is not null
+        union all
+        select speculative_of, task_id
+        from task
+        where speculative_of = ?
+        """
+    cur = con.execute(sql, (task_id, task_id))
+    match cur.fetchall():
+        case [[original_id, duplicate_id]]:
+            return (cast(str, original_id), cast(str, duplicate_id))
+        case []:
+            return None
+        case other:
+            raise UnexpectedCase(other)
+
+
+def get_speculation_groups(con: apsw.Connection) -> list[str]:
+    """Get the task groups with assigned tasks."""
+    sql = """
+        select distinct task_group
+        from task
+        where task_state = 'assigned' and task_group is not null
+        """
+    cur = con.execute(sql)
+    return [cast(str, task_group) for task_group, in cur]
+
+
+def get_task_group_runtimes(
+    con: apsw.Connection, task_group: str
+) -> tuple[int, list[int], list[tuple[str, int]]]:
+    """Get the runtimes in a task group.
+
+    Return the number of tasks in the group,
+    the runtimes of the completed tasks,
+    and the id and assigned_at of the assigned tasks without a duplicate.
+    """
+    sql = """
+        select
+            task_id,
+            task_state,
+            assigned_at,
+            completed_at,
+            exists (
+                select 1 from task as duplicate
+                where duplicate.speculative_of = task.task_id
+            )
+        from task
+        where task_group = ?
+        """
+    cur = con.execute(sql, (task_group,))
+    num_tasks = 0
+    runtimes = []
+    running = []
+    for task_id, task_state, assigned_at, completed_at, has_duplicate in cur:
+        num_tasks += 1
+        match task_state:
+            case "completed" | "processed" if completed_at is not None:
+                runtimes.append(cast(int, completed_at) - cast(int, assigned_at))
+            case "assigned" if not has_duplicate:
+                running.append((cast(str, task_id), cast(int, assigned_at)))
+    return num_tasks, runtimes, running
+
+
+def add_speculative_task(
+    con: apsw.Connection, task_id: str
+) -> tuple[str, int, Optional[str], str, str]:
+    """Add an available duplicate of the task.
+
+    If the task data is a JSON object the duplicate's data gets
+    a speculative_of field with the id of the original,
+    so that the duplicate can keep its outputs apart from the original's.
+    Return its id, priority, locality, queue and type.
+    """
+    sql = """
+        insert into task (
+            task_id, task_type, task_data, task_priority, task_locality, task_queue,
+            task_state, speculative_of
+        )
+        select
+            task_id || ':speculative',
+            task_type,
+            case
+                when json_valid(task_data) and json_type(task_data) = 'object'
+                then json_set(task_data, '$.speculative_of', task_id)
+                else task_data
+            end,
+            task_priority,
+            task_locality,
+            task_queue,
+            'available',
+            task_id
+        from task
+        where task_id = ?
+        returning task_id, task_priority, task_locality, task_queue, task_type
+        """
+    cur = con.execute(sql, (task_id,))
+    match cur.fetchall():
+        case [[duplicate_id, task_priority, task_locality, task_queue, task_type]]:
+            duplicate_id = cast(str, duplicate_id)
+            task_priority = cast(int, task_priority)
+            task_locality = cast(Optional[str], task_locality)
+            task_queue = cast(str, task_queue)
+            task_type = cast(str, task_type)
+            return (duplicate_id, task_priority, task_locality, task_queue, task_type)
+        case other:
+            raise UnexpectedCase(other)
+
+
+def get_available_task_priorities(
+    con: apsw.Connection,
+) -> list[tuple[str, int, Optional[str], str, str]]:
+    """Get the id, priority, locality, queue and type of every available task."""
+    sql = """
+        select task_id, task_priority, task_locality, task_queue, task_type
+        from task
+        where task_state = 'available'
+        """
+    cur = con.execute(sql)
+    ret = []
+    for task_id, task_priority, task_locality, task_queue, task_type in cur:
+        task_id = cast(str, task_id)
+        task_priority = cast(int, task_priority)
+        task_locality = cast(Optional[str], task_locality)
+        task_queue = cast(str, task_queue)
+        task_type = cast(str, task_type)
+        ret.append((task_id, task_priority, task_locality, task_queue, task_type))
+    return ret
+
+
+def add_runtime_sample(
+    con: apsw.Connection,
+    task_id: str,
+    elapsed: int,
+    queue_wait: Optional[int],
+    max_rss: Optional[int],
+) -> Optional[tuple[str, Optional[str], float]]:
+    """Add a runtime sample of the task to its runtime estimate.
+
+    Return the task type, locality and new mean elapsed time.
+    """
+    sql = """
+        insert into runtime_estimate
+        select task_type, coalesce(task_locality, ''), 1, ?, ?, coalesce(?, 0), ?
+        from task
+        where task_id = ?
+        on conflict (task_type, task_locality) do update set
+            num_samples = num_samples + 1,
+            total_elapsed = total_elapsed + excluded.total_elapsed,
+            max_elapsed = max(max_elapsed, excluded.max_elapsed),
+            total_queue_wait = total_queue_wait + excluded.total_queue_wait,
+            max_rss = max(coalesce(max_rss, 0), coalesce(excluded.max_rss, 0))
+        returning task_type, task_locality, cast(total_elapsed as real) / num_samples
+        """
+    cur = con.execute(sql, (elapsed, elapsed, queue_wait, max_rss, task_id))
+    match cur.fetchall():
+        case [[task_type, task_locality, mean_elapsed]]:
+            task_type = cast(str, task_type)
+            task_locality = cast(str, task_locality) or None
+            mean_elapsed = cast(float, mean_elapsed)
+            return (task_type, task_locality, mean_elapsed)
+        case []:
+            return None
+        case other:
+            raise UnexpectedCase(other)
+
+
+def get_runtime_estimates(
+    con: apsw.Connection,
+) -> list[tuple[str, Optional[str], int, float, int, float, Optional[int]]]:
+    """Get the runtime estimates.
+
+    Return the task type, task locality, number of samples,
+    mean and max elapsed time, mean queue wait and max RSS.
+    """
+    sql = """
+        select
+            task_type,
+            task_locality,
+            num_samples,
+            cast(total_elapsed as real) / num_samples,
+            max_elapsed,
+            cast(total_queue_wait as real) / num_samples,
+            max_rss
+        from runtime_estimate
+        """
+    cur = con.execute(sql)
+    ret = []
+    for row in cur:
+        task_type, task_locality, num_samples = row[:3]
+        mean_elapsed, max_elapsed, mean_queue_wait, max_rss = row[3:]
+        task_type = cast(str, task_type)
+        task_locality = cast(str, task_locality) or None
+        num_samples = cast(int, num_samples)
+        mean_elapsed = cast(float, mean_elapsed)
+        max_elapsed = cast(int, max_elapsed)
+        mean_queue_wait = cast(float, mean_queue_wait)
+        max_rss = cast(Optional[int], max_rss) or None
+        ret.append(
+            (
+                task_type,
+                task_locality,
+                num_samples,
+                mean_elapsed,
+                max_elapsed,
+                mean_queue_wait,
+                max_rss,
+            )
+        )
+    return ret
+
+
 def get_all_completed_tasks(
     con: apsw.Connection,
 ) -> list[tuple[str, str, str, str]]:
@@ -136,3 +629,28 @@ def get_all_completed_tasks(
         task_result = cast(str, task_result)
         ret.append((task_id, task_type, task_data, task_result))
     return ret
+
+
+def get_completed_since(
+    con: apsw.Connection, seq: int, limit: int, task_type: Optional[str]
+) -> list[tuple[int, str, str, str, str]]:
+    sql = """
+        select completed_seq, task_id, task_type, task_data, task_result
+        from task
+        where
+            completed_seq > ?
+            and task_state = 'completed'
+            and (? is null or task_type = ?)
+        order by completed_seq
+        limit ?
+        """
+    cur = con.execute(sql, (seq, task_type, task_type, limit))
+    ret = []
+    for (completed_seq, task_id, task_type, task_data, task_result) in cur:
+        completed_seq = cast(int, completed_seq)
+        task_id = cast(str, task_id)
+        task_type = cast(str, task_type)
+        task_data = cast(str, task_data)
+        task_result = cast(str, task_result)
+        ret.append((completed_seq, task_id, task_type, task_data, task_result))
+    return ret
@@ -0,0 +1,242 @@
+"""Chunked transfer of setup tarballs."""
+
+import io
+import json
+import shutil
+import hashlib
+import logging
+import tarfile
+import tempfile
+from pathlib import Path
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+SETUP_CHUNK_SIZE = 4 * 1024 * 1024
+
+# setup_hash, size, chunk_size, chunk_hashes
+SetupChunksType = tuple[str, int, int, tuple[str, ...]]
+
+
+def iter_chunks(
+    tar_file: Path, chunk_size: int, start_index: int = 0
+) -> Iterator[bytes]:
+    """Read the file chunk by chunk starting from the start_index-th chunk."""
+    with open(tar_file, "rb") as fobj:
+        fobj.seek(start_index * chunk_size)
+        while True:
+            data = fobj.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+
+def read_chunk(tar_file: Path, chunk_size: int, index: int) -> bytes:
+    """Read the index-th chunk of the file."""
+    with open(tar_file, "rb") as fobj:
+        fobj.seek(index * chunk_size)
+        return fobj.read(chunk_size)
+
+
+def compute_setup_chunks(tar_file: Path, chunk_size: int) -> SetupChunksType:
+    """Hash the file and each of its chunks in a single pass."""
+    file_hash = hashlib.sha256()
+    size = 0
+    chunk_hashes = []
+    for data in iter_chunks(tar_file, chunk_size):
+        file_hash.update(data)
+        size += len(data)
+        chunk_hashes.append(hashlib.sha256(data).hexdigest())
+    return (file_hash.hexdigest(), size, chunk_size, tuple(chunk_hashes))
+
+
+def split_chunks(data: bytes, chunk_size: int) -> tuple[SetupChunksType, list[bytes]]:
+    """Split an in memory tarball; return its chunk index and chunks."""
+    chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+    chunk_hashes = tuple(hashlib.sha256(chunk).hexdigest() for chunk in chunks)
+    setup_hash = hashlib.sha256(data).hexdigest()
+    return (setup_hash, len(data), chunk_size, chunk_hashes), chunks
+
+
+def save_chunks(fname: Path, setup_name: str, chunks: SetupChunksType) -> None:
+    """Save the chunk index of a setup."""
+    setup_hash, size, chunk_size, chunk_hashes = chunks
+    obj = dict(
+        setup_name=setup_name,
+        setup_hash=setup_hash,
+        size=size,
+        chunk_size=chunk_size,
+        chunk_hashes=list(chunk_hashes),
+    )
+    tmp_fname = fname.with_suffix(".tmp")
+    tmp_fname.write_text(json.dumps(obj))
+    tmp_fname.rename(fname)
+
+
+def load_chunks(fname: Path) -> tuple[str, SetupChunksType]:
+    """Load the chunk index of a setup; return the setup name and chunks."""
+    obj = json.loads(fname.read_text())
+    chunks = (
+        obj["setup_hash"],
+        obj["size"],
+        obj["chunk_size"],
+        tuple(obj["chunk_hashes"]),
+    )
+    return obj["setup_name"], chunks
+
+
+class PartFile:
+    """A partially received setup tarball.
+
+    Chunks are appended in order and only after checking their hash,
+    so the part file only ever holds verified chunks
+    and an interrupted transfer resumes from its size.
+    """
+
+    def __init__(self, part_file: Path, chunks: SetupChunksType):
+        self.part_file = part_file
+        self.setup_hash, self.size, self.chunk_size, self.chunk_hashes = chunks
+
+    def next_index(self) -> int:
+        """Return the index of the next chunk to be received."""
+        if not self.part_file.exists():
+            return 0
+
+        size = self.part_file.stat().st_size
+        if size == self.size:
+            return len(self.chunk_hashes)
+
+        index = size // self.chunk_size
+        if size != index * self.chunk_size:
+            # Left over from a write that didn't finish
+            with open(self.part_file, "r+b") as fobj:
+                fobj.truncate(index * self.chunk_size)
+        return index
+
+    def is_complete(self) -> bool:
+        return self.next_index() == len(self.chunk_hashes)
+
+    def write_chunk(self, index: int, data: bytes) -> None:
+        """Append the index-th chunk."""
+        next_index = self.next_index()
+        if index != next_index:
+            raise RuntimeError(f"Expected chunk {next_index}; received chunk {index}.")
+
+        chunk_hash = hashlib.sha256(data).hexdigest()
+        if chunk_hash != self.chunk_hashes[index]:
+            raise RuntimeError(f"Hash mismatch for chunk {index} of {self.setup_hash}.")
+
+        with open(self.part_file, "ab") as fobj:
+            fobj.write(data)
+
+
+class ChunkStream(io.RawIOBase):
+    """Read only file object over an iterator of chunks.
+
+    Everything read through the stream is hashed on the way.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.buf = memoryview(b"")
+        self.file_hash = hashlib.sha256()
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buf:
+            try:
+                data = next(self.chunks)
+            except StopIteration:
+                return 0
+            self.file_hash.update(data)
+            self.size += len(data)
+            self.buf = memoryview(data)
+
+        n = min(len(b), len(self.buf))
+        b[:n] = self.buf[:n]
+        self.buf = self.buf[n:]
+        return n
+
+    def drain(self) -> None:
+        """Read the rest of the stream."""
+        for data in self.chunks:
+            self.file_hash.update(data)
+            self.size += len(data)
+        self.buf = memoryview(b"")
+
+    def hexdigest(self) -> str:
+        return self.file_hash.hexdigest()
+
+
+def extract_tar(tar: tarfile.TarFile, dest_dir: Path) -> None:
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(dest_dir, filter="data")
+    else:
+        tar.extractall(dest_dir)
+
+
+def get_hash_file(setup_root: Path, setup_name: str) -> Path:
+    """Return the file recording the tarball hash of an extracted setup."""
+    return setup_root / f"{setup_name}.sha256"
+
+
+def get_setup_dir_hash(setup_root: Path, setup_name: str) -> Optional[str]:
+    """Get the hash of the tarball an existing setup directory came from.
+
+    Return None if the setup directory doesn't exist
+    or if neither its recorded hash nor its tarball are around.
+    """
+    if not (setup_root / setup_name).exists():
+        return None
+
+    hash_file = get_hash_file(setup_root, setup_name)
+    if hash_file.exists():
+        return hash_file.read_text().strip()
+
+    setup_tar_file = setup_root / f"{setup_name}.tar.gz"
+    if setup_tar_file.exists():
+        return compute_setup_chunks(setup_tar_file, SETUP_CHUNK_SIZE)[0]
+    return None
+
+
+def ingest_setup(
+    setup_root: Path, setup_name: str, setup_hash: str, chunks: Iterator[bytes]
+) -> None:
+    """Hash, decompress and extract a setup tarball in a single pass.
+
+    The tarball is extracted into a temporary directory in setup_root
+    and the setup directory is renamed into place
+    only after the hash of the tarball has been verified.
+    If the setup directory already exists the tarball is only verified.
+    The hash of the tarball is recorded next to the setup directory.
+    """
+    setup_dir = setup_root / setup_name
+    stream = ChunkStream(chunks)
+
+    if setup_dir.exists():
+        logger.info("setup dir exists: setup_dir=%s", setup_dir)
+        stream.drain()
+        if stream.hexdigest() != setup_hash:
+            raise RuntimeError(f"Hash mismatch for setup {setup_hash}.")
+        get_hash_file(setup_root, setup_name).write_text(setup_hash)
+        return
+
+    logger.info("extracting setup: setup_name=%s", setup_name)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{setup_name}.", dir=setup_root))
+    try:
+        with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+            extract_tar(tar, tmp_dir)
+        stream.drain()
+        if stream.hexdigest() != setup_hash:
+            raise RuntimeError(f"Hash mismatch for setup {setup_hash}.")
+
+        tmp_setup_dir = tmp_dir / setup_name
+        if not tmp_setup_dir.exists():
+            raise RuntimeError(f"Setup {setup_hash} does not contain '{setup_name}'.")
+        get_hash_file(setup_root, setup_name).write_text(setup_hash)
+        tmp_setup_dir.rename(setup_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,56 @@
+"""Tests for parsing the output of sacct."""
+
+from mackenzie.agent.sacct import parse_sacct_info, split_sacct_info
+
+# Column order of `sacct -o ALL -P` (trimmed); Account comes first, not JobID.
+HEADER = (
+    "Account|AdminComment|AllocCPUS|AllocNodes|AllocTRES|AssocID|AveCPU|AveRSS"
+    "|Cluster|CPUTime|Elapsed|ElapsedRaw|Eligible|End|ExitCode|Flags|Group"
+    "|JobID|JobIDRaw|JobName|MaxRSS|MaxRSSNode|NNodes|NodeList|Partition"
+    "|Start|State|Submit|Timelimit|User"
+)
+
+
+def make_row(job_id: str, elapsed: int, max_rss: str, state: str) -> str:
+    return (
+        f"bii||128|1|cpu=128|42|00:00:00||anvil|04:16:00|00:02:00|{elapsed}"
+        f"|2024-01-01T00:00:00|2024-01-01T00:03:00|0:0||bii"
+        f"|{job_id}|{job_id}|epihiper|{max_rss}|a001|1|a001|wholenode"
+        f"|2024-01-01T00:01:00|{state}|2024-01-01T00:00:00|04:00:00|x"
+    )
+
+
+SACCT_INFO = "\n".join(
+    [
+        HEADER,
+        make_row("101", 120, "", "COMPLETED"),
+        make_row("101.batch", 120, "2G", "COMPLETED"),
+        make_row("101.0", 118, "3G", "COMPLETED"),
+        make_row("102", 60, "", "TIMEOUT"),
+        make_row("102.batch", 60, "1M", "CANCELLED"),
+    ]
+) + "\n"
+
+
+def test_split_sacct_info_all_columns():
+    infos = split_sacct_info(SACCT_INFO)
+
+    assert sorted(infos) == [101, 102]
+    for job_id, info in infos.items():
+        lines = info.strip().splitlines()
+        assert lines[0] == HEADER
+        assert all(f"|{job_id}" in line for line in lines[1:])
+    assert len(infos[101].strip().splitlines()) == 4
+    assert len(infos[102].strip().splitlines()) == 3
+
+
+def test_split_sacct_info_matches_parse():
+    infos = split_sacct_info(SACCT_INFO)
+
+    assert parse_sacct_info(101, infos[101]) == (120, 60, 3 << 30)
+    assert parse_sacct_info(102, infos[102]) == (60, 60, 1 << 20)
+    assert parse_sacct_info(101, infos[101]) == parse_sacct_info(101, SACCT_INFO)
+
+
+def test_split_sacct_info_no_job_id_column():
+    assert split_sacct_info("Account|State\nbii|COMPLETED\n") == {}